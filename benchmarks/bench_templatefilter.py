@@ -0,0 +1,71 @@
+"""
+Compares the template validity filters on the datasets in data/:
+    * 'passes':   one pandas string pass per rule, as find_valid used to do it
+    * 'compiled': templatecrawler.templatefilter.check_valid, all rules in one regex match per template
+Both compute the result of every rule, afterwards the rejection counts per rule are printed.
+
+Usage:  python benchmarks/bench_templatefilter.py [--data-dir data] [--repeat 5]
+"""
+from pathlib import Path
+import argparse
+import re
+import time
+import pandas as pd
+
+from templatecrawler.templatefilter import Reason, check_valid, min_length, max_placeholders
+
+re_char = re.compile(r'^[^a-wyzA-WYZ]+$')
+re_keyword_beginnings = re.compile(r'^\s*(static|#include|#define|#if|#endif)')
+re_comment = re.compile(r'^\s*(//|\*)')
+
+
+def load_templates(data_dir: Path) -> pd.Series:
+    templates = []
+    for path in sorted(data_dir.glob('template_dataset_*.txt')):
+        templates += path.read_text(encoding='utf-8', errors='replace').splitlines()
+    for path in sorted(data_dir.glob('template_dataset_*.csv')):
+        templates += pd.read_csv(path, header=None).iloc[:, 1].dropna().astype(str).tolist()
+    return pd.Series(templates)
+
+
+def filter_passes(data: pd.Series) -> pd.Series:
+    reason = (data.apply(len) < min_length) * int(Reason.SHORT)
+    reason |= data.str.match(re_char) * int(Reason.NO_LETTERS)
+    reason |= data.str.match(re_keyword_beginnings) * int(Reason.KEYWORD)
+    reason |= data.str.match(re_comment) * int(Reason.COMMENT)
+    reason |= (data.str.count('{}') > max_placeholders) * int(Reason.PLACEHOLDERS)
+    return reason
+
+
+def filter_compiled(data: pd.Series) -> pd.Series:
+    return check_valid(data)['reason']
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--data-dir', default=Path(__file__).parent.parent / 'data', type=Path)
+    arg_parser.add_argument('--repeat', type=int, default=5)
+    args = arg_parser.parse_args()
+
+    data = load_templates(args.data_dir)
+    results = {}
+    for name, method in [('passes', filter_passes), ('compiled', filter_compiled)]:
+        timings = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            results[name] = method(data)
+            timings.append(time.perf_counter() - start)
+        best = min(timings)
+        print(f'{name:<10} best of {args.repeat}: {best:8.3f}s  {len(data) / best:10.0f} templates/s')
+
+    if not (results['passes'].values == results['compiled'].values).all():
+        print('Reason codes differ between the filters!')
+    reason = results['compiled']
+    print(f'{len(data)} templates, {int((reason == 0).sum())} valid')
+    for flag in Reason:
+        if flag not in (Reason.NONE, Reason.ALL):
+            print(f'  {flag.name:<14} {int(((reason & int(flag)) > 0).sum()):8}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+"""
+Import-time benchmark: how long a fresh interpreter takes to import the modules the Airflow scheduler (DAG files and
+their operators) and the command line tools start with, and which heavy dependencies come along.
+
+Every import runs in its own process, the best of --repeat runs is reported. DAG files and the operators need Airflow,
+they are reported as unavailable without it. The results are compared against a baseline file, like
+benchmarks/stages.py does, create one with --save-baseline before measuring a change.
+
+Usage:  python benchmarks/imports.py [--module templatecrawler.parser] [--repeat 5] [--save-baseline]
+                                     [--baseline benchmarks/import_baseline.json]
+"""
+from pathlib import Path
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+
+root = Path(__file__).parent
+dags = root.parent / 'dags'
+
+modules = [
+    'templatecrawler',
+    'templatecrawler.metrics',
+    'templatecrawler.detector',
+    'templatecrawler.extractor',
+    'templatecrawler.parser',
+    'templatecrawler.pipeline',
+    'templatecrawler.worker',
+    'templatecrawler.airflow.plugins.operators',
+] + [f'dags/{x.name}' for x in sorted(dags.glob('*.py'))]
+
+heavy = ['pandas', 'numpy', 'pyarrow', 'psycopg2', 'git', 'requests', 'keyring', 'http.server']
+
+# Runs in the child process, prints the result as JSON
+_child = """
+import json, runpy, sys, time
+start = time.perf_counter()
+target = sys.argv[1]
+try:
+    if target.endswith('.py'):
+        runpy.run_path(target)
+    else:
+        __import__(target)
+except ImportError as e:
+    print(json.dumps({'unavailable': str(e)}))
+    sys.exit(0)
+seconds = time.perf_counter() - start
+print(json.dumps({'seconds': seconds, 'modules': len(sys.modules), 'heavy': [x for x in sys.argv[2:] if x in sys.modules]}))
+"""
+
+
+def measure(module: str, repeat: int) -> dict:
+    target = str(root.parent / module) if module.endswith('.py') else module
+    env = {**os.environ, 'PYTHONPATH': os.pathsep.join(sys.path)}
+    best = None
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, '-c', _child, target, *heavy], check=True, stdout=subprocess.PIPE,
+                                stderr=subprocess.DEVNULL, env=env).stdout.decode().strip().splitlines()[-1]
+        result = json.loads(output)
+        if 'unavailable' in result:
+            return result
+        if best is None or result['seconds'] < best['seconds']:
+            best = result
+    return best
+
+
+def compare(module: str, result: dict, baseline: dict):
+    if 'unavailable' in result:
+        print(f'{module:<45} unavailable: {result["unavailable"]}')
+        return
+    line = f'{module:<45} {result["seconds"] * 1000:8.1f} ms {result["modules"]:5} modules  ' \
+           f'heavy: {", ".join(result["heavy"]) or "-"}'
+    before = baseline.get(module)
+    if before and 'seconds' in before:
+        line += f'  (baseline {before["seconds"] * 1000:.1f} ms, {before["modules"]} modules)'
+    print(line)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--module', action='append', help='Default: all modules and DAG files')
+    arg_parser.add_argument('--repeat', type=int, default=5)
+    arg_parser.add_argument('--baseline', type=Path, default=root / 'import_baseline.json')
+    arg_parser.add_argument('--save-baseline', action='store_true', help='Store the results as the new baseline')
+    args = arg_parser.parse_args()
+
+    baseline = json.loads(args.baseline.read_text())['modules'] if args.baseline.exists() else {}
+    results = {}
+    for module in args.module or modules:
+        results[module] = measure(module, args.repeat)
+        compare(module, results[module], baseline)
+
+    if args.save_baseline:
+        args.baseline.write_text(json.dumps({'python': platform.python_version(), 'machine': platform.machine(),
+                                             'modules': {**baseline, **results}}, indent=2))
+        print(f'Saved the baseline to {args.baseline}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+"""
+Compares the template ingestion paths against a local Postgres:
+    * 'values': two execute_values passes (with and without arguments), as the DAGs used to do it
+    * 'copy':   templatecrawler.database.copy_rows, COPY into a staging table plus one INSERT ... SELECT
+
+Usage:  python benchmarks/ingest.py --dsn "dbname=bench user=postgres" --rows 100000
+The benchmark works on its own table 'bench_templates' and drops it afterwards.
+
+Measured with 100000 rows against a local PostgreSQL 16 over a Unix socket (Python 3.11, 1 CPU shared by client and
+server), best of 3 and of 5 runs:
+    values   2.979s / 2.922s    33573 / 34218 rows/s
+    copy     2.875s / 2.401s    34783 / 41651 rows/s
+'values' needs about 1000 round trips (execute_values pages of 100 rows), 'copy' four statements, so the gap grows
+with the latency to the database. The stored rows differ in which of two duplicates wins: 'values' inserts all rows
+with arguments first, 'copy' keeps the order of the input.
+"""
+from datetime import datetime
+import argparse
+import random
+import string
+import time
+import psycopg2
+from psycopg2.extras import execute_values
+
+from templatecrawler.database import copy_rows, is_list_empty
+
+columns = ['template', 'arguments', 'raw', 'repo_id', 'parsed_template', 'crawl_date']
+
+
+def generate_rows(count: int, seed: int = 42):
+    rng = random.Random(seed)
+    words = [''.join(rng.choices(string.ascii_lowercase, k=rng.randint(2, 9))) for _ in range(2000)]
+    crawl_date = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    rows = []
+    for i in range(count):
+        message = ' '.join(rng.choices(words, k=rng.randint(3, 12)))
+        argument_count = rng.choice([0, 0, 1, 2, 3])
+        arguments = [rng.choice(words) for _ in range(argument_count)]
+        parsed = message + ' {}' * argument_count + f' #{i}'
+        template = message + ' {IntegerPlaceholder}' * argument_count + f' #{i}'
+        raw = f'log.info("{message}"' + ''.join(f', {x}' for x in arguments) + ')'
+        # Every 20th row is a duplicate of its predecessor, so conflicts are part of the measurement
+        if i % 20 == 19:
+            template, parsed = rows[-1][0], rows[-1][4]
+        rows.append((template, arguments, raw, 1, parsed, crawl_date))
+    return rows
+
+
+def insert_values(conn, rows):
+    records_args = [x for x in rows if not is_list_empty(x[1])]
+    records_no_args = [x[:1] + x[2:] for x in rows if is_list_empty(x[1])]
+    cur = conn.cursor()
+    execute_values(cur, f"""INSERT INTO bench_templates ({','.join(columns)}) VALUES %s ON CONFLICT DO NOTHING""",
+                   records_args)
+    conn.commit()
+    no_args_columns = [x for x in columns if x != 'arguments']
+    execute_values(cur, f"""INSERT INTO bench_templates ({','.join(no_args_columns)}) VALUES %s
+                           ON CONFLICT DO NOTHING""", records_no_args)
+    conn.commit()
+    cur.close()
+
+
+def insert_copy(conn, rows):
+    copy_rows(conn, 'bench_templates', columns, ((t, None if is_list_empty(a) else a, r, i, p, d)
+                                                  for t, a, r, i, p, d in rows))
+
+
+def reset_table(conn):
+    cur = conn.cursor()
+    cur.execute("""DROP TABLE IF EXISTS bench_templates""")
+    cur.execute("""CREATE TABLE bench_templates (
+                       template_id serial PRIMARY KEY,
+                       repo_id integer NOT NULL,
+                       template text NOT NULL UNIQUE,
+                       crawl_date timestamp with time zone,
+                       raw text,
+                       parsed_template text UNIQUE,
+                       arguments text[])""")
+    conn.commit()
+    cur.close()
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--dsn', required=True)
+    arg_parser.add_argument('--rows', type=int, default=100000)
+    arg_parser.add_argument('--repeat', type=int, default=3)
+    args = arg_parser.parse_args()
+
+    rows = generate_rows(args.rows)
+    conn = psycopg2.connect(args.dsn)
+    try:
+        for name, method in [('values', insert_values), ('copy', insert_copy)]:
+            timings = []
+            for _ in range(args.repeat):
+                reset_table(conn)
+                start = time.perf_counter()
+                method(conn, rows)
+                timings.append(time.perf_counter() - start)
+            cur = conn.cursor()
+            cur.execute("""SELECT count(*), count(arguments) FROM bench_templates""")
+            stored, with_arguments = cur.fetchone()
+            cur.close()
+            best = min(timings)
+            print(f'{name:<8} best of {args.repeat}: {best:8.3f}s  {len(rows) / best:10.0f} rows/s  '
+                  f'({stored} stored, {with_arguments} with arguments)')
+    finally:
+        cur = conn.cursor()
+        cur.execute("""DROP TABLE IF EXISTS bench_templates""")
+        conn.commit()
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+"""
+End-to-end scaling benchmark: runs detect --> extract/parse --> filter --> formalize --> deduplicate
+(templatecrawler.pipeline.Pipeline) on synthetic repositories of growing size, see benchmarks/synthetic.py.
+
+Every run happens in a fresh process, so the peak RSS belongs to that run alone. The results are written to
+<output>/scaling.csv and, if matplotlib is installed, plotted to <output>/scaling.png (time per stage and peak memory
+over the number of files).
+
+Usage:  python benchmarks/scaling.py [--files 1000 10000 100000] [--language java c] [--work-dir /tmp/synthetic]
+                                     [--output benchmarks/results]
+"""
+from pathlib import Path
+import argparse
+import json
+import logging
+import os
+import resource
+import subprocess
+import sys
+import time
+import pandas as pd
+
+from templatecrawler.pipeline import Pipeline
+
+from synthetic import generate
+
+stage_names = ['detect', 'parse', 'filter', 'formalize', 'deduplicate']
+
+
+def measure(repository: str, language: str) -> dict:
+    start = time.perf_counter()
+    pipeline = Pipeline(repository, language=language)
+    pipeline.run()
+    total = time.perf_counter() - start
+    # ru_maxrss is in KiB on Linux
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return {'total': total, 'peak_rss': peak, 'framework': pipeline.framework,
+            **{f'{x}_seconds': pipeline.timings.get(x, 0.0) for x in stage_names},
+            **{f'{x}_rows': count for x, count in pipeline.stats.items()}}
+
+
+def run(repository: Path, language: str) -> dict:
+    command = [sys.executable, __file__, '--measure', str(repository), '--language', language]
+    result = subprocess.run(command, check=True, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                            env={**os.environ, 'PYTHONPATH': os.pathsep.join(sys.path)})
+    # The stages print their progress, the result is the last line
+    return json.loads(result.stdout.decode().strip().splitlines()[-1])
+
+
+def plot(results: pd.DataFrame, path: Path):
+    try:
+        import matplotlib
+        matplotlib.use('Agg')
+        import matplotlib.pyplot as plt
+    except ImportError:
+        print('matplotlib is not installed, skipping the plot')
+        return
+
+    languages = list(results['language'].unique())
+    figure, axes = plt.subplots(2, len(languages), figsize=(6 * len(languages), 8), squeeze=False)
+    for column, language in enumerate(languages):
+        data = results[results['language'] == language].sort_values('files')
+        time_axis, memory_axis = axes[0][column], axes[1][column]
+        for stage in stage_names:
+            time_axis.plot(data['files'], data[f'{stage}_seconds'], marker='o', label=stage)
+        time_axis.plot(data['files'], data['total'], marker='o', color='black', label='total')
+        time_axis.set(xscale='log', yscale='log', title=f'{language}: time', xlabel='files', ylabel='seconds')
+        time_axis.legend()
+        memory_axis.plot(data['files'], data['peak_rss'] / 2 ** 20, marker='o')
+        memory_axis.set(xscale='log', title=f'{language}: peak memory', xlabel='files', ylabel='MiB')
+    figure.tight_layout()
+    figure.savefig(path)
+    print(f'Plotted to {path}')
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--files', type=int, nargs='+', default=[1000, 10000, 100000])
+    arg_parser.add_argument('--language', nargs='+', choices=['java', 'c'], default=['java', 'c'])
+    arg_parser.add_argument('--statements', type=int, default=5, help='Log statements per file')
+    arg_parser.add_argument('--lines', type=int, default=60, help='Lines per file')
+    arg_parser.add_argument('--work-dir', type=Path, default=Path('/tmp/synthetic'),
+                            help='Where the repositories are generated, existing ones are reused')
+    arg_parser.add_argument('--output', type=Path, default=Path(__file__).parent / 'results')
+    arg_parser.add_argument('--measure', help=argparse.SUPPRESS)
+    args = arg_parser.parse_args()
+
+    if args.measure:
+        logging.disable(logging.CRITICAL)
+        print(json.dumps(measure(args.measure, args.language[0])))
+        return
+
+    rows = []
+    for language in args.language:
+        for files in args.files:
+            repository = args.work_dir / f'{language}-{files}-{args.statements}-{args.lines}'
+            if not repository.exists():
+                start = time.perf_counter()
+                generate(repository, language, files, statements=args.statements, lines=args.lines)
+                print(f'Generated {repository} in {time.perf_counter() - start:.1f}s')
+            result = run(repository, language)
+            rows.append({'language': language, 'files': files, **result})
+            print(f'{language:<5} {files:8} files  {result["total"]:9.2f}s  {result["peak_rss"] / 2 ** 20:8.1f} MiB  '
+                  + '  '.join(f'{x} {result[f"{x}_seconds"]:.2f}s' for x in stage_names))
+
+    args.output.mkdir(parents=True, exist_ok=True)
+    results = pd.DataFrame(rows)
+    results.to_csv(args.output / 'scaling.csv', index=False)
+    print(f'Wrote {args.output / "scaling.csv"}')
+    plot(results, args.output / 'scaling.png')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+"""
+Micro-benchmarks of the single stages, without Airflow, GitHub or a database:
+    tokenizer     JavaTokenizer over the Java statements in benchmarks/samples/
+    java_parser   JavaParser.run on the Java statements in benchmarks/samples/
+    c_parser      CParser.run on the C statements in benchmarks/samples/
+    filter        templatefilter.find_valid on all template datasets in data/
+    formalize     formalizer.formalize on data/template_dataset_v0.5.csv, with arguments derived from the placeholders
+
+Every stage reports the best time of --repeat runs, its throughput and the peak of memory allocated during one more
+run (traced with tracemalloc, which is why it isn't timed). The results are compared against a baseline file.
+Baselines depend on the machine, so create one with --save-baseline before measuring a change.
+
+Usage:  python benchmarks/stages.py [--stage java_parser --stage filter] [--repeat 5] [--save-baseline]
+                                    [--baseline benchmarks/baseline.json] [--max-slowdown 1.2]
+"""
+from pathlib import Path
+import argparse
+import contextlib
+import io
+import json
+import platform
+import re
+import sys
+import time
+import tracemalloc
+import pandas as pd
+
+from templatecrawler.logparser.strstream import Stream
+from templatecrawler.logparser.javatokenizer import JavaTokenizer
+from templatecrawler.logparser.java import JavaParser
+from templatecrawler.logparser.c import CParser
+from templatecrawler.templatefilter import find_valid
+from templatecrawler.formalizer import formalize
+from templatecrawler.tokentypes import tokens
+
+from bench_templatefilter import load_templates
+
+root = Path(__file__).parent
+samples = root / 'samples'
+data_dir = root.parent / 'data'
+
+# The samples are small, they are repeated to get measurable run times
+sample_repetitions = 20
+
+argument_names = {'Integer': 'count', 'Float': 'ratio', 'Path': 'path', 'URL': 'hostAddress', 'Time': 'timeout',
+                  'Date': 'now', 'ID': 'requestId', 'Bool': 'enabled', 'User': 'userName', 'Status': 'status',
+                  'String': 'name', 'IP': 'address'}
+re_placeholder = re.compile(r'\{([A-Za-z]*?)(?:Placeholder)?\}')
+
+
+def load_statements(name: str) -> pd.Series:
+    statements = (samples / name).read_text(encoding='utf-8').splitlines()
+    return pd.Series(statements * sample_repetitions)
+
+
+def load_formalize_input() -> pd.DataFrame:
+    templates = pd.read_csv(data_dir / 'template_dataset_v0.5.csv', header=None).iloc[:, 1].dropna().astype(str)
+    parsed = [re_placeholder.sub('{}', x) for x in templates]
+    arguments = [[argument_names.get(x, 'value') for x in re_placeholder.findall(t)] for t in templates]
+    return pd.DataFrame({'parsed_template': parsed, 'arguments': arguments, 'raw': templates.values})
+
+
+def tokenize(statements: pd.Series):
+    for statement in statements:
+        lexer = JavaTokenizer(Stream(statement))
+        while not lexer.eof():
+            lexer.next()
+
+
+# name --> (load the input, run the stage on it)
+stages = {
+    'tokenizer': (lambda: load_statements('java_statements.txt'), tokenize),
+    'java_parser': (lambda: load_statements('java_statements.txt'), lambda x: JavaParser('slf4j').run(x)),
+    'c_parser': (lambda: load_statements('c_statements.txt'), lambda x: CParser('unknown').run(x)),
+    'filter': (lambda: load_templates(data_dir), find_valid),
+    'formalize': (load_formalize_input, lambda x: formalize(x, tokens)),
+}
+
+
+def measure(name: str, repeat: int) -> dict:
+    load, run = stages[name]
+    data = load()
+    timings = []
+    # The stages print their progress, which would only measure the terminal
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(repeat):
+            start = time.perf_counter()
+            run(data)
+            timings.append(time.perf_counter() - start)
+        tracemalloc.start()
+        run(data)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    best = min(timings)
+    return {'items': len(data), 'seconds': best, 'items_per_second': len(data) / best, 'peak_bytes': peak}
+
+
+def compare(name: str, result: dict, baseline: dict) -> float:
+    line = (f'{name:<12} {result["items"]:8} items  {result["seconds"]:8.3f}s  {result["items_per_second"]:10.0f} items/s  '
+            f'{result["peak_bytes"] / 2 ** 20:8.1f} MiB peak')
+    if name not in baseline:
+        print(line)
+        return 1.0
+    ratio = result['seconds'] / baseline[name]['seconds']
+    memory_ratio = result['peak_bytes'] / max(baseline[name]['peak_bytes'], 1)
+    print(f'{line}  time {ratio - 1:+7.1%}  memory {memory_ratio - 1:+7.1%}  vs. baseline')
+    return ratio
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--stage', action='append', choices=list(stages), help='Default: all stages')
+    arg_parser.add_argument('--repeat', type=int, default=5)
+    arg_parser.add_argument('--baseline', type=Path, default=root / 'baseline.json')
+    arg_parser.add_argument('--save-baseline', action='store_true', help='Store the results as the new baseline')
+    arg_parser.add_argument('--max-slowdown', type=float, default=None,
+                            help='Exit with 1 if a stage takes more than this factor of its baseline time')
+    args = arg_parser.parse_args()
+
+    baseline = json.loads(args.baseline.read_text())['stages'] if args.baseline.exists() else {}
+    results = {}
+    slower = []
+    for name in args.stage or list(stages):
+        results[name] = measure(name, args.repeat)
+        ratio = compare(name, results[name], baseline)
+        if args.max_slowdown is not None and ratio > args.max_slowdown:
+            slower.append(name)
+
+    if args.save_baseline:
+        args.baseline.write_text(json.dumps({'python': platform.python_version(), 'machine': platform.machine(),
+                                             'pandas': pd.__version__, 'stages': {**baseline, **results}}, indent=2))
+        print(f'Saved the baseline to {args.baseline}')
+    if slower:
+        print(f'Slower than {args.max_slowdown}x the baseline: {", ".join(slower)}')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
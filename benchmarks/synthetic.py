@@ -0,0 +1,145 @@
+"""
+Generates synthetic Java or C repositories, to measure the pipeline on repositories of any shape without GitHub.
+The log messages are taken from data/template_dataset_v0.5.csv and written in the statement forms the extractors and
+parsers recognize:
+    java:  log.info("... {} ...", a)   log.warn("... " + a + " ...")   log.error(String.format("... %s ...", a))
+    c:     printf("... %d\\n", a)   fprintf(stderr, ...)   printk(KERN_INFO ...)   av_log(ctx, AV_LOG_ERROR, ...)
+
+Usage:  python benchmarks/synthetic.py /tmp/synthetic-java --language java --files 1000 [--statements 5] [--lines 60]
+"""
+from pathlib import Path
+from typing import Union, List
+import argparse
+import random
+import re
+import pandas as pd
+
+data_dir = Path(__file__).parent.parent / 'data'
+
+re_placeholder = re.compile(r'\{([A-Za-z]*?)(?:Placeholder)?\}')
+
+java_arguments = {'Integer': ['count', 'size', 'entries.size()'], 'Float': ['ratio', 'elapsed'],
+                  'Path': ['path', 'file.getName()'], 'URL': ['hostAddress', 'request.getUrl()'],
+                  'Time': ['timeout', 'System.currentTimeMillis()'], 'Date': ['now'], 'ID': ['id', 'requestId'],
+                  'Bool': ['enabled'], 'User': ['userName', 'user.getEmail()'], 'Status': ['status', 'state'],
+                  'String': ['name', 'input'], 'IP': ['address'], '': ['value', 'e.getMessage()']}
+c_arguments = ['value', 'len', 'ret', 'name', 'dev->id', 'i', 'count', 'path', 'buf', 'err', 'ctx->state']
+
+java_imports = {'slf4j': ['import org.slf4j.Logger;', 'import org.slf4j.LoggerFactory;'],
+                'log4j': ['import org.apache.logging.log4j.LogManager;', 'import org.apache.logging.log4j.Logger;']}
+java_loggers = {'slf4j': 'LoggerFactory.getLogger({}.class)', 'log4j': 'LogManager.getLogger({}.class)'}
+
+java_filler = ['int value = count * {i};', 'String name = input.trim();', 'if (value > {i}) {{ value -= {i}; }}',
+               'items.add(name + "-{i}");', 'result = compute(value, {i});', '// Keeps the state consistent']
+c_filler = ['int value = count * {i};', 'buf[{i}] = 0;', 'if (ret < 0) {{ goto out; }}', 'len += strlen(name);',
+            'ret = compute(value, {i});', '/* Keeps the state consistent */']
+
+
+def load_messages() -> List[str]:
+    templates = pd.read_csv(data_dir / 'template_dataset_v0.5.csv', header=None).iloc[:, 1].dropna().astype(str)
+    # Quotes, backslashes and percent signs would have to be escaped, those templates are simply left out
+    return [x for x in templates if 10 < len(x) < 120 and not any(c in x for c in '"\\%\n')]
+
+
+def java_statement(message: str, rng: random.Random) -> str:
+    kinds = re_placeholder.findall(message)
+    arguments = [rng.choice(java_arguments.get(x, java_arguments[''])) for x in kinds]
+    logger = rng.choice(['log', 'LOG'])
+    level = rng.choice(['info', 'debug', 'warn', 'error', 'trace'])
+    form = rng.random()
+    if form < 0.5 or not kinds:
+        return f'{logger}.{level}("{re_placeholder.sub("{}", message)}"' + ''.join(f', {x}' for x in arguments) + ');'
+    elif form < 0.8:
+        parts = [f'"{x}"' for x in re_placeholder.split(message)[::2]]
+        expression = ' + '.join(x for pair in zip(parts, arguments + ['']) for x in pair if x and x != '""')
+        return f'{logger}.{level}({expression});'
+    message = re_placeholder.sub(lambda m: '%d' if m.group(1) == 'Integer' else '%s', message)
+    return f'{logger}.{level}(String.format("{message}"' + ''.join(f', {x}' for x in arguments) + '));'
+
+
+def c_statement(message: str, rng: random.Random) -> str:
+    arguments = ''.join(f', {rng.choice(c_arguments)}' for _ in re_placeholder.findall(message))
+    message = re_placeholder.sub(lambda m: {'Integer': '%d', 'Float': '%f'}.get(m.group(1), '%s'), message)
+    form = rng.random()
+    if form < 0.4:
+        return f'printf("{message}\\n"{arguments});'
+    elif form < 0.6:
+        return f'fprintf(stderr, "{message}\\n"{arguments});'
+    elif form < 0.8:
+        return f'printk(KERN_INFO "{message}\\n"{arguments});'
+    return f'av_log(ctx, AV_LOG_ERROR, "{message}\\n"{arguments});'
+
+
+def java_file(name: str, package: str, framework: str, statements: List[str], lines: int, rng: random.Random) -> str:
+    output = [f'package {package};', ''] + java_imports[framework] + ['', f'public class {name} {{',
+              f'    private static final Logger log = {java_loggers[framework].format(name)};', '']
+    body = _body(statements, java_filler, lines - len(output) - 4, rng)
+    output += ['    public void run(String input, int count) {'] + [f'        {x}' for x in body] + ['    }', '}']
+    return '\n'.join(output) + '\n'
+
+
+def c_file(name: str, statements: List[str], lines: int, rng: random.Random) -> str:
+    output = ['#include <stdio.h>', '#include <string.h>', '', f'int {name}(const char *name, int count)', '{']
+    body = _body(statements, c_filler, lines - len(output) - 3, rng)
+    output += [f'    {x}' for x in body] + ['out:', '    return 0;', '}']
+    return '\n'.join(output) + '\n'
+
+
+def _body(statements: List[str], filler: List[str], lines: int, rng: random.Random) -> List[str]:
+    body = [rng.choice(filler).format(i=i) for i in range(max(lines - len(statements), 0))]
+    for statement in statements:
+        body.insert(rng.randint(0, len(body)), statement)
+    return body
+
+
+def generate(path: Union[str, Path], language: str, files: int, statements: int = 5, lines: int = 60,
+             framework: str = 'slf4j', files_per_directory: int = 100, seed: int = 0) -> Path:
+    """ Writes a synthetic repository.
+
+    :param path: Directory of the repository, created if needed
+    :param language: 'java' or 'c'
+    :param files: Number of source files
+    :param statements: Log statements per file
+    :param lines: Lines per file, including the log statements
+    :param framework: Logging framework of Java repositories, 'slf4j' or 'log4j'
+    :param files_per_directory: Files are spread over directories of this size
+    :param seed: Same seed, same repository
+    :return: The path of the repository
+    """
+    rng = random.Random(seed)
+    messages = load_messages()
+    path = Path(path)
+    for i in range(files):
+        directory = path / 'src' / f'module{i // files_per_directory}'
+        directory.mkdir(parents=True, exist_ok=True)
+        chosen = [rng.choice(messages) for _ in range(statements)]
+        if language == 'java':
+            name = f'Class{i}'
+            content = java_file(name, f'com.example.module{i // files_per_directory}', framework,
+                                [java_statement(x, rng) for x in chosen], lines, rng)
+            (directory / f'{name}.java').write_text(content, encoding='utf-8')
+        elif language == 'c':
+            name = f'unit{i}'
+            content = c_file(name, [c_statement(x, rng) for x in chosen], lines, rng)
+            (directory / f'{name}.c').write_text(content, encoding='utf-8')
+        else:
+            raise ValueError(f'Synthetic repositories are only available for java and c, not for {language}')
+    return path
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('path')
+    arg_parser.add_argument('--language', choices=['java', 'c'], default='java')
+    arg_parser.add_argument('--framework', choices=list(java_imports), default='slf4j')
+    arg_parser.add_argument('--files', type=int, default=1000)
+    arg_parser.add_argument('--statements', type=int, default=5, help='Log statements per file')
+    arg_parser.add_argument('--lines', type=int, default=60, help='Lines per file')
+    arg_parser.add_argument('--seed', type=int, default=0)
+    args = arg_parser.parse_args()
+    generate(args.path, args.language, args.files, statements=args.statements, lines=args.lines,
+             framework=args.framework, seed=args.seed)
+
+
+if __name__ == '__main__':
+    main()
@@ -3,7 +3,6 @@ import logging
 from airflow import DAG
 from airflow.operators.python_operator import PythonOperator
 from airflow.hooks.postgres_hook import PostgresHook
-from psycopg2.extras import execute_values
 
 from templatecrawler.airflow.plugins.operators import  \
     FetchFilesOperator, DetectLoggingWithoutFilesOperator, DetectLoggingFromFilesOperator
@@ -29,6 +28,8 @@ def _load_from_database(**context):
 
 
 def _update_database(**context):
+    from psycopg2.extras import execute_values
+
     task_instance = context['task_instance']
     from_files = task_instance.xcom_pull(key='logging_check_from_files')
     without_files = task_instance.xcom_pull(key='logging_check_without_files')
@@ -79,7 +80,9 @@ dag = DAG('log2vec_detect-logging',
 
 load_task = PythonOperator(task_id='load_from_database_task', dag=dag, python_callable=_load_from_database,
                            provide_context=True, params=default_args)
-fetch_files_task = FetchFilesOperator(task_id='fetch_files_task')
+fetch_files_task = FetchFilesOperator(task_id='fetch_files_task',
+                                      response_cache='/tmp/templatecrawler/responses.sqlite',
+                                      tree_cache='/tmp/templatecrawler/trees.sqlite')
 detect_from_files_task = DetectLoggingFromFilesOperator(task_id='detect_from_files_task', dag=dag)
 detect_without_files_task = DetectLoggingWithoutFilesOperator(task_id='detect_without_files_task', dag=dag)
 update_task = PythonOperator(task_id='update_database_task', dag=dag, python_callable=_update_database,
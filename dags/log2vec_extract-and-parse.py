@@ -1,10 +1,8 @@
 from datetime import datetime
-import pandas as pd
 import logging
 from airflow import DAG
 from airflow.operators.python_operator import PythonOperator
 from airflow.hooks.postgres_hook import PostgresHook
-from psycopg2.extras import execute_values
 
 from templatecrawler.airflow.plugins.operators import \
     CloneAndExtractOperator, FilterTemplatesOperator, ParseOperator, FormalizeOperator
@@ -42,6 +40,8 @@ def _load_from_database(**context):
 
 
 def _update_database(**context):
+    from psycopg2.extras import execute_values
+
     task_instance = context['task_instance']
     data = task_instance.xcom_pull(key='formalized')
 
@@ -1,22 +1,20 @@
 from datetime import datetime
 from airflow import DAG
-from templatecrawler.airflow.plugins.operators import SearchRepoOperator, FilterSearchOperator
+from templatecrawler.airflow.plugins.operators import ShardedSearchOperator
 
 default_args = {
     'start_over': False,
 }
 
+# Runs must not overlap, the shards of a language are paged by one run at a time
 dag = DAG('log2vec_find-repositories',
           description='Searches through the GitHub API for repositores and saves them to the database',
           schedule_interval='*/2 * * * *',
           default_args=default_args,
+          max_active_runs=1,
           start_date=datetime(2020, 3, 20), catchup=False)
 
-start_over = False
-find_task = SearchRepoOperator(task_id='find_repos_task', postgres_conn_id='templates',
-                               start_over=start_over, dag=dag)
-process_and_save_task = FilterSearchOperator(task_id='process_and_save_repos_task', postgres_conn_id='templates',
-                                             language='random', dag=dag)
-
-find_task >> process_and_save_task
-
+# Pages through the whole search space in shards, SearchRepoOperator and FilterSearchOperator only reach the first
+# 1000 results of a language
+find_task = ShardedSearchOperator(task_id='find_repos_task', postgres_conn_id='templates', target_language='random',
+                                  workers=4, max_pages=50, max_queries=200, dag=dag)
@@ -1,67 +1,58 @@
+from contextlib import closing
 from datetime import datetime
-import pandas as pd
+from pathlib import Path
 import logging
 from airflow import DAG
 from airflow.operators.python_operator import PythonOperator
 from airflow.hooks.postgres_hook import PostgresHook
-from psycopg2.extras import execute_values
-from typing import List
-from templatecrawler.detector import LogDetector
-from templatecrawler.crawler import GitHubCrawler
-from templatecrawler.extractor import LogExtractor
-from templatecrawler.parser import LogParser
-from templatecrawler.templatefilter import find_valid
-from templatecrawler.formalizer import formalize
-from templatecrawler.tokentypes import tokens
-import keyring
+from templatecrawler.airflow.plugins.operators import PipelineOperator
 from airflow.exceptions import AirflowSkipException
 
+# The scheduler parses this file continuously, pandas, keyring, git and the stages are imported by the tasks
+
 
 default_args = {
-    'postgres_conn_id': 'templates'
+    'postgres_conn_id': 'templates',
+    'work_dir': '/tmp/templatecrawler',     # Stage outputs are handed over as files in here, not through XCom
+    'lease': 3 * 3600,                      # Seconds until a claimed repository goes back to the queue
+    'digest_cache': '/tmp/templatecrawler/template_digests.bin',
+    'metrics_dir': '/tmp/templatecrawler/metrics',   # One JSON file of metrics per repository and task
+    'profile_dir': None,                    # e.g. '/tmp/templatecrawler/profiles', a .pstats file per stage
+    'slow_statements': 0,                   # Report the n slowest statements of the parser, 0 is off
+    'response_cache': '/tmp/templatecrawler/responses.sqlite',  # GitHub API responses, None to always ask the API
+    'tree_cache': '/tmp/templatecrawler/trees.sqlite',          # Git trees by OID, shared by all repositories
 }
 
 log = logging.getLogger(__name__)
 
 
-# Also takes nested empty lists into account
-# Taken from https://stackoverflow.com/a/1605679/7307284
-def is_list_empty(li: List):
-    if isinstance(li, list):  # Is a list
-        return all(map(is_list_empty, li))
-    return False                  # Not a list
-
+def _work_directory(context):
+    from templatecrawler import handoff
+    return handoff.work_directory(context['params']['work_dir'], context['run_id'])
 
-def _release_lock(pg_hook: PostgresHook, repo_id: str):
-    db_conn = pg_hook.get_conn()
-    db_cursor = db_conn.cursor()
-    db_cursor.execute("""UPDATE repositories SET locked = FALSE WHERE repo_id = %s""", [repo_id])
-    db_conn.commit()
 
+def _finish_hook(pg_hook: PostgresHook, success: bool, repo_id, context, work_dir=None):
+    from templatecrawler import handoff, database
 
-def _finish_hook(pg_hook: PostgresHook, success: bool, repo_id):
-    db_conn = pg_hook.get_conn()
-    db_cursor = db_conn.cursor()
-    if success:
-        db_cursor.execute("""UPDATE repositories SET processed = TRUE, successfully_processed = TRUE 
-                          WHERE repo_id = %s""", [repo_id])
-    else:
-        db_cursor.execute("""UPDATE repositories SET processed = TRUE, successfully_processed = FALSE
-                          WHERE repo_id = %s""", [repo_id])
-    db_conn.commit()
-    _release_lock(pg_hook, repo_id)
+    worker = PipelineOperator.worker_name(context)
+    with closing(pg_hook.get_conn()) as conn:
+        finished = database.finish_repositories(conn, [(int(repo_id), success, None)], worker=worker)
+    if finished == 0:
+        log.warning(f'Repository {repo_id} was taken over by another worker, left it as it is')
+    if work_dir:
+        handoff.cleanup(work_dir)
 
 
 def _load_from_database(**context):
+    from templatecrawler import database
+
     params = context['params']
     postgres_conn_id = params['postgres_conn_id']
     pg_hook = PostgresHook(postgres_conn_id=postgres_conn_id)
     conn = pg_hook.get_conn()
-    cur = conn.cursor()
 
-    raw_query = f"""SELECT * from repositories WHERE processed = %s AND locked = %s  LIMIT 1"""
-    query = cur.mogrify(raw_query)
-    repo_df = pg_hook.get_pandas_df(query, parameters=[False, False])
+    # Selecting and locking happens in one statement, so parallel runs never get the same repository
+    repo_df = database.claim_repositories(conn, 1, lease=params['lease'], worker=PipelineOperator.worker_name(context))
 
     if repo_df is None or len(repo_df) != 1:
         log.info("Could not load a valid repository from the database")
@@ -72,10 +63,6 @@ def _load_from_database(**context):
 
     log.info(f'Loaded repository {repo["url"]} with ID {repo["repo_id"]}. (stars={repo["stars"]},'
              f'size={repo["disk_usage"]}')
-
-    cur = conn.cursor()
-    cur.execute("""UPDATE repositories SET locked = TRUE WHERE repo_id = %s""", [repo['repo_id']])
-    conn.commit()
     log.info(f'Aquired lock for repository {repo["url"]} with ID {repo["repo_id"]}')
     task_instance = context['task_instance']
     task_instance.xcom_push('target_repository', repo)
@@ -83,6 +70,11 @@ def _load_from_database(**context):
 
 
 def _detect(**context):
+    import keyring
+    from templatecrawler.crawler import GitHubCrawler
+    from templatecrawler.crawlerengine.cache import ResponseCache, TreeCache
+    from templatecrawler.detector import LogDetector
+
     task_instance = context['task_instance']
     repo = task_instance.xcom_pull(key='target_repository')
     contains_logging = False
@@ -94,10 +86,17 @@ def _detect(**context):
     conn = pg_hook.get_conn()
     cur = conn.cursor()
 
+    cache = ResponseCache(params['response_cache']) if params.get('response_cache') else None
+    tree_cache = TreeCache(params['tree_cache']) if params.get('tree_cache') else None
     crawler = GitHubCrawler(auth_token=keyring.get_password('github-token', 'tassadarius'),
-                            owner=repo['owner'], repository=repo['name'])
-    git_objects = crawler.fetch_heuristically(40)
-    primary_language = crawler.fetch_primary_language()
+                            owner=repo['owner'], repository=repo['name'], cache=cache, tree_cache=tree_cache)
+    try:
+        git_objects = crawler.fetch_heuristically(40)
+        primary_language = crawler.fetch_primary_language()
+    finally:
+        for x in (cache, tree_cache):
+            if x is not None:
+                x.close()
     tmp_language = primary_language
 
     # Set the main language in the languages column
@@ -126,6 +125,8 @@ def _detect(**context):
             repo['framework'] = framework_indicator
 
     num_files = 'None' if not git_objects else len(git_objects)
+    if tree_cache is not None:
+        log.info(f'Tree cache: {tree_cache.hits} hits, {tree_cache.misses} misses')
     log.info(f"Ran detection on {repo['owner']}/{repo['name']}: Qualifies for logging {may_qualify_logging};"
              f"Fetched {num_files} files. Contain logging {contains_logging}")
 
@@ -136,12 +137,15 @@ def _detect(**context):
     cur.close()
 
     if not final_flag:
-        _finish_hook(pg_hook, success=False, repo_id=repo['repo_id'])
+        _finish_hook(pg_hook, success=False, repo_id=repo['repo_id'], context=context,
+                     work_dir=_work_directory(context))
 
     task_instance.xcom_push(key='target_repository', value=repo)
 
 
 def _clone(**context):
+    from templatecrawler.crawler import GitHubCrawler
+
     task_instance = context['task_instance']
     repo = task_instance.xcom_pull(key='target_repository')  # type: pd.DataFrame
 
@@ -152,194 +156,39 @@ def _clone(**context):
     task_instance.xcom_push(key='repo_path', value=repo_destination)
 
 
-def _determine_framework(**context):
+def _update_database(**context):
+    from templatecrawler import handoff, database, metrics
+    from templatecrawler.dedup import TemplateDeduplicator
+
     task_instance = context['task_instance']
     repo = task_instance.xcom_pull(key='target_repository')  # type: pd.DataFrame
-    repo_path = task_instance.xcom_pull(key='repo_path')  # type: pd.DataFrame
 
     params = context['params']
     postgres_conn_id = params['postgres_conn_id']
     pg_hook = PostgresHook(postgres_conn_id=postgres_conn_id)
-    conn = pg_hook.get_conn()
-    cur = conn.cursor()
 
-    crawler = GitHubCrawler(auth_token=None, owner=None, repository=None)
+    # The handed over files go away whether the templates could be written or not
     try:
-        files = crawler.fetch_files(path=repo_path, language=repo['main_language'])
-        detector = LogDetector(language=repo['main_language'])
-        framework = detector.framework(files=files)
+        data = handoff.load(task_instance.xcom_pull(key='templates'))
+        data['repo_id'] = repo['repo_id']
+        with closing(pg_hook.get_conn()) as conn, metrics.use(metrics.Registry()) as registry:
+            deduplicator = TemplateDeduplicator(params['digest_cache'])
+            deduplicator.sync(conn)
+            data = deduplicator.drop_duplicates(data)
+            written = database.write_templates(conn, data)
+            deduplicator.add(written)           # Not the empty and discarded ones, they aren't in the table
+            deduplicator.save()
+        if params['metrics_dir']:
+            registry.dump(Path(params['metrics_dir'], f'{repo["repo_id"]}_database.json'))
+        log.info(f'Wrote {len(written)} entries for repository {repo["url"]} with ID {repo["repo_id"]}')
     except Exception as e:
-        log.error(f'Determining framework failed. Raised exception {e.__class__.__name__}')
-        _finish_hook(pg_hook, success=False, repo_id=repo['repo_id'])
-        crawler.delete(repo_path)
+        log.error(f'Writing the templates of {repo["url"]} failed. Raised exception {e.__class__.__name__}')
+        _finish_hook(pg_hook, success=False, repo_id=repo['repo_id'], context=context)
         raise e
-
-    repo['framework'] = framework
-    log.info(f'Determined framework for repository {repo["url"]} with ID {repo["repo_id"]} as <{framework}>')
-    task_instance.xcom_push(key='target_repository', value=repo)
-    cur.execute("""UPDATE repositories SET framework = %s WHERE repo_id = %s""", [repo['framework'], repo['repo_id']])
-    conn.commit()
-    cur.close()
-
-
-def _extract(**context):
-    task_instance = context['task_instance']
-    repo = task_instance.xcom_pull(key='target_repository')  # type: pd.DataFrame
-    repo_path = task_instance.xcom_pull(key='repo_path')
-
-    params = context['params']
-    postgres_conn_id = params['postgres_conn_id']
-    pg_hook = PostgresHook(postgres_conn_id=postgres_conn_id)
-
-    extractor = LogExtractor(language=repo['main_language'], framework=repo['framework'], repository=repo_path)
-    source_lines = extractor.extract()
-
-    # Uncomment this to delete the repository
-    # crawler = GitHubCrawler(auth_token=None, owner=None, repository=None)
-    #  crawler.delete(repo_path)
-
-    if source_lines is None or len(source_lines) <= 0:
-        _finish_hook(pg_hook, success=False, repo_id=repo['repo_id'])
-        raise AirflowSkipException()
-
-    log.info(f'Extracting for {repo["url"]} with ID {repo["repo_id"]}'
-             f'(main_language: {repo["main_language"]}, framework: {repo["framework"]}) got {len(source_lines)} events')
-
-    task_instance.xcom_push(key='source_lines', value=source_lines)
-    return True
-
-
-def _parse(**context):
-    task_instance = context['task_instance']
-    repo = task_instance.xcom_pull(key='target_repository')  # type: pd.DataFrame
-    source_lines = task_instance.xcom_pull(key='source_lines')
-
-    params = context['params']
-    postgres_conn_id = params['postgres_conn_id']
-    pg_hook = PostgresHook(postgres_conn_id=postgres_conn_id)
-
-    log.info(f'Parsing raw input {repo["url"]} with ID {repo["repo_id"]}. {len(source_lines)} raw events given.')
-    parser = LogParser(language=repo['main_language'])
-    parsed_result = parser.run(raw_input=source_lines['raw'], framework=repo['framework'])
-
-    if parsed_result is None or len(parsed_result) <= 0:
-        _finish_hook(pg_hook, success=False, repo_id=repo['repo_id'])
-        raise AirflowSkipException()
-    log.info(f'Parsing result for {repo["url"]} with ID {repo["repo_id"]} are {len(parsed_result)} templates')
-
-    validity_mask = find_valid(parsed_result['parsed_template'])
-    parsed_result = parsed_result.loc[validity_mask]
-
-    if parsed_result is None or len(parsed_result) <= 0:
-        _finish_hook(pg_hook, success=False, repo_id=repo['repo_id'])
-        raise AirflowSkipException()
-    log.info(f'Filtering result for {repo["url"]} with ID {repo["repo_id"]} are {len(parsed_result)} templates')
-
-    task_instance.xcom_push(key='raw_templates', value=parsed_result)
-    return True
-
-
-def _formalize(**context):
-    task_instance = context['task_instance']
-    repo = task_instance.xcom_pull(key='target_repository')  # type: pd.DataFrame
-    raw_templates = task_instance.xcom_pull(key='raw_templates')
-
-    params = context['params']
-    postgres_conn_id = params['postgres_conn_id']
-    pg_hook = PostgresHook(postgres_conn_id=postgres_conn_id)
-
-    log.info(f'formalizing raw input {repo["url"]} with ID {repo["repo_id"]}. {len(raw_templates)} templates given.')
-    formalized_output = formalize(data=raw_templates, possible_types=tokens)
-
-    if formalized_output is None or len(formalized_output) <= 0:
-        _finish_hook(pg_hook, success=False, repo_id=repo['repo_id'])
-        raise AirflowSkipException()
-
-    log.info(f'Finished formalizing for {repo["url"]} with ID {repo["repo_id"]}.'
-             f'{len(formalized_output)} final templates')
-
-    # Some elements get filtered out. The return value is a dict of index and result.
-    # First we kick out the indices which are not in the result.
-    processed_templates = raw_templates.loc[formalized_output.keys()]
-    # Then we map the existing results to the correct index, in case they are reordered
-    processed_templates['template'] = processed_templates.index.map(formalized_output)
-    task_instance.xcom_push(key='templates', value=processed_templates)
-    return True
-
-
-def _update_database(**context):
-    task_instance = context['task_instance']
-    data = task_instance.xcom_pull(key='templates')
-    repo = task_instance.xcom_pull(key='target_repository')  # type: pd.DataFrame
-
-    params = context['params']
-    postgres_conn_id = params['postgres_conn_id']
-    pg_hook = PostgresHook(postgres_conn_id=postgres_conn_id)
-
-    data['crawl_date'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    data['repo_id'] = repo['repo_id']
-    columns = ['template', 'arguments', 'raw', 'repo_id', 'parsed_template', 'crawl_date']
-    assert all([x in data.columns for x in columns])
-
-    df = data[columns]  # filter to the relevant columns
-
-    # Check for empty entries
-    mask = df['template'].apply(len) <= 0
-    mask |= df['parsed_template'].apply(len) <= 0
-
-    filter_count = mask.count(True)
-    if filter_count > 0:
-        log.info(f"Checked input data for empty entries in columns [template, parsed_template]"
-                 f"Discarding {filter_count} entries ({len(df)}-->{len(df) - filter_count})")
-        df = df.loc[[not x for x in mask]]
-
-    # First check if entries are in the discarded table:
-    to_check_entries = df[['template', 'parsed_template']].to_records(index=False).tolist()
-    conn = pg_hook.get_conn()
-    cur = conn.cursor()
-    mask = []
-    for pair in to_check_entries:
-        cur.execute(
-            "SELECT EXISTS (SELECT template_id FROM discarded_templates WHERE template = %s OR parsed_template = %s)",
-            pair
-        )
-        fetched_value, = cur.fetchone()  # Directly unpack the 1 element tuple.
-        mask.append(fetched_value)
-
-    if len(mask) != len(df):
-        raise ValueError(f'Checked whether entries are in discarded table returned {len(mask)} values.'
-                         f'But the data has {len(df)} entries, so that would be expected.')
-
-    filter_count = mask.count(True)
-    if filter_count > 0:
-        log.info(f"Checked existing, but discarded templates. "
-                 f"Discarding {filter_count} entries ({len(df)}-->{len(df) - filter_count})")
-        df = df.loc[[not x for x in mask]]
-
-    # Here we have to split the query into ones with arguments and one without arguments
-    emptiness_mask = df['arguments'].apply(is_list_empty)
-    df_args = df.loc[~emptiness_mask]
-    df_no_args = df.loc[emptiness_mask].drop('arguments', axis=1)        # Also drop the column 'arguments' completely
-    records_args = df_args.to_records(index=False).tolist()
-    records_no_args = df_no_args.to_records(index=False).tolist()
-
-    conn = pg_hook.get_conn()
-    cur = conn.cursor()
-    query = cur.mogrify(f"""INSERT INTO templates ({','.join(columns)}) VALUES %s ON CONFLICT DO NOTHING""")
-    execute_values(cur=cur, sql=query, argslist=records_args)
-    conn.commit()
-
-    log.info(f'Wrote {len(records_args)} entries with arguments for repository {repo["url"]} with ID {repo["repo_id"]}')
-
-    columns.remove('arguments')
-    query = cur.mogrify(f"""INSERT INTO templates ({','.join(columns)}) VALUES %s ON CONFLICT DO NOTHING""")
-    execute_values(cur=cur, sql=query, argslist=records_no_args)
-    conn.commit()
-
-    log.info(f'Wrote {len(records_no_args)} entries with NO arguments for repository'
-             f'{repo["url"]} with ID {repo["repo_id"]}')
-
-    _finish_hook(pg_hook, success=True, repo_id=repo['repo_id'])
+    else:
+        _finish_hook(pg_hook, success=True, repo_id=repo['repo_id'], context=context)
+    finally:
+        handoff.cleanup(_work_directory(context))
     log.info(f'Finished cleaning up, have a nice day')
 
 
@@ -356,16 +205,10 @@ detect_task = PythonOperator(task_id='detect_task', dag=dag, python_callable=_de
                              provide_context=True, params=default_args)
 clone_task = PythonOperator(task_id='clone_task', dag=dag, python_callable=_clone,
                             provide_context=True, params=default_args)
-determine_framework_task = PythonOperator(task_id='determine_framework_task', dag=dag,
-                                          python_callable=_determine_framework,
-                                          provide_context=True, params=default_args)
-extract_task = PythonOperator(task_id='extract_task', dag=dag, python_callable=_extract,
-                              provide_context=True, params=default_args)
-parse_task = PythonOperator(task_id='parse_task', dag=dag, python_callable=_parse,
-                            provide_context=True, params=default_args)
-formalize_task = PythonOperator(task_id='formalize_task', dag=dag, python_callable=_formalize,
-                                provide_context=True, params=default_args)
+pipeline_task = PipelineOperator(task_id='pipeline_task', dag=dag, postgres_conn_id=default_args['postgres_conn_id'],
+                                 work_dir=default_args['work_dir'], metrics_dir=default_args['metrics_dir'],
+                                 params=default_args)
 update_task = PythonOperator(task_id='update_database_task', dag=dag, python_callable=_update_database,
                              provide_context=True, params=default_args)
 
-load_task >> detect_task >> clone_task >> determine_framework_task >> extract_task >> parse_task >> formalize_task >> update_task
+load_task >> detect_task >> clone_task >> pipeline_task >> update_task
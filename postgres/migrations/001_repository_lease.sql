@@ -0,0 +1,13 @@
+--
+-- Lease based locking of repositories. A worker claims a repository by setting locked, locked_at and locked_by in
+-- one statement, a lock whose locked_at is older than the lease is considered abandoned and can be claimed again.
+--
+
+ALTER TABLE public.repositories ADD COLUMN locked_at timestamp with time zone;
+ALTER TABLE public.repositories ADD COLUMN locked_by character varying(128);
+
+-- Locks taken before this migration have no timestamp, let them expire like any other lease
+UPDATE public.repositories SET locked_at = now() WHERE locked = TRUE;
+
+CREATE INDEX repositories_queue_idx ON public.repositories USING btree (repo_id)
+    WHERE processed = FALSE;
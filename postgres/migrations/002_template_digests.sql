@@ -0,0 +1,40 @@
+--
+-- Fixed-size SHA-256 digests of template and parsed_template. Lookups and the uniqueness of templates go through the
+-- digests, so their cost no longer depends on the template length. The digests are filled by a trigger and match
+-- templatecrawler.dedup.digest().
+--
+
+CREATE FUNCTION public.set_template_digests() RETURNS trigger
+    LANGUAGE plpgsql
+    AS $$
+BEGIN
+  NEW.template_digest := sha256(convert_to(NEW.template, 'UTF8'));
+  NEW.parsed_template_digest := sha256(convert_to(NEW.parsed_template, 'UTF8'));
+  RETURN NEW;
+END;
+$$;
+
+ALTER TABLE public.templates ADD COLUMN template_digest bytea;
+ALTER TABLE public.templates ADD COLUMN parsed_template_digest bytea;
+ALTER TABLE public.discarded_templates ADD COLUMN template_digest bytea;
+ALTER TABLE public.discarded_templates ADD COLUMN parsed_template_digest bytea;
+
+UPDATE public.templates SET template_digest = sha256(convert_to(template, 'UTF8')),
+                            parsed_template_digest = sha256(convert_to(parsed_template, 'UTF8'));
+UPDATE public.discarded_templates SET template_digest = sha256(convert_to(template, 'UTF8')),
+                                      parsed_template_digest = sha256(convert_to(parsed_template, 'UTF8'));
+
+CREATE TRIGGER templates_digests BEFORE INSERT OR UPDATE OF template, parsed_template ON public.templates
+    FOR EACH ROW EXECUTE FUNCTION public.set_template_digests();
+CREATE TRIGGER discarded_templates_digests BEFORE INSERT OR UPDATE OF template, parsed_template
+    ON public.discarded_templates FOR EACH ROW EXECUTE FUNCTION public.set_template_digests();
+
+-- The unique digest indexes replace the unique constraints on the long text columns
+CREATE UNIQUE INDEX templates_template_digest_key ON public.templates USING btree (template_digest);
+CREATE UNIQUE INDEX templates_parsed_template_digest_key ON public.templates USING btree (parsed_template_digest);
+ALTER TABLE ONLY public.templates DROP CONSTRAINT no_duplicates;
+ALTER TABLE ONLY public.templates DROP CONSTRAINT templates_parsed_template_key;
+
+CREATE INDEX discarded_templates_template_digest_idx ON public.discarded_templates USING hash (template_digest);
+CREATE INDEX discarded_templates_parsed_template_digest_idx ON public.discarded_templates
+    USING hash (parsed_template_digest);
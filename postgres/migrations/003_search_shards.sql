@@ -0,0 +1,23 @@
+--
+-- Checkpoints of the sharded repository search (templatecrawler.search). Every shard is a query GitHub returns
+-- completely, i.e. with at most 1000 results. <cursor> is the end cursor of the last page written to the
+-- repositories, a run continues after it. Planning a shard again starts it over.
+-- A shard without <total> wasn't counted yet, planning replaces it by itself with a total or by its halves.
+--
+
+CREATE TABLE public.search_shards (
+    shard_id serial PRIMARY KEY,
+    language character varying(40) NOT NULL,
+    query text NOT NULL UNIQUE,
+    total integer,
+    truncated boolean DEFAULT false NOT NULL,
+    cursor text,
+    fetched integer DEFAULT 0 NOT NULL,
+    done boolean DEFAULT false NOT NULL,
+    planned_at timestamp with time zone DEFAULT now(),
+    updated_at timestamp with time zone
+);
+
+ALTER TABLE public.search_shards OWNER TO tassadarius;
+
+CREATE INDEX search_shards_pending_idx ON public.search_shards USING btree (language, shard_id) WHERE done = false;
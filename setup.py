@@ -8,6 +8,10 @@ setuptools.setup(
     package_dir={'': 'src'},
     packages=setuptools.find_packages('src'),
     entry_points={
+       'console_scripts': [
+           'templatecrawler-pipeline = templatecrawler.pipeline:main',
+           'templatecrawler-worker = templatecrawler.worker:main'
+       ],
        'airflow.plugins': [
            'crawler_plugin = templatecrawler.airflow.plugins.crawler_plugin:TemplateCrawler'
        ]
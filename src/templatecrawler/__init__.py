@@ -0,0 +1,24 @@
+from templatecrawler import lazy
+
+# Nothing is imported together with the package, the Airflow scheduler parses the DAG files continuously and most of
+# them only need a few names. These are loaded on first access.
+_exports = {
+    'Pipeline': 'templatecrawler.pipeline:Pipeline',
+    'LogDetector': 'templatecrawler.detector:LogDetector',
+    'LogExtractor': 'templatecrawler.extractor:LogExtractor',
+    'LogParser': 'templatecrawler.parser:LogParser',
+    'GitHubCrawler': 'templatecrawler.crawler:GitHubCrawler',
+    'GitHubSearcher': 'templatecrawler.crawler:GitHubSearcher',
+}
+
+__all__ = list(_exports)
+
+
+def __getattr__(name: str):
+    if name in _exports:
+        return lazy.load(_exports[name])
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
@@ -1,23 +1,21 @@
-import psycopg2
-from psycopg2.extras import execute_values
-import keyring
 import logging
-import pandas as pd
 import base64
+import shutil
 import string
 import random
+from contextlib import closing
+from pathlib import Path
+from typing import Tuple, Union, TYPE_CHECKING
 from airflow.models import BaseOperator
 from airflow.utils.decorators import apply_defaults
 from airflow.hooks.postgres_hook import PostgresHook
 from airflow.models.taskinstance import TaskInstance
-from templatecrawler.crawler import GitHubSearcher, GitHubCrawler
-from templatecrawler.detector import LogDetector
-from templatecrawler.extractor import LogExtractor
-from templatecrawler.parser import LogParser
-from templatecrawler.templatefilter import find_valid
+from airflow.exceptions import AirflowSkipException
 
-import templatecrawler.formalizer as formalizer
-import templatecrawler.tokentypes as ttokens
+# The scheduler imports this module with every parse of a DAG file. pandas, keyring and the templatecrawler stages
+# are imported by the operators when they execute, not here.
+if TYPE_CHECKING:
+    import pandas as pd
 
 log = logging.getLogger(__name__)
 
@@ -62,6 +60,9 @@ class SearchRepoOperator(BaseOperator):
         self.start_over = start_over
 
     def execute(self, context):
+        import keyring
+        from templatecrawler.crawler import GitHubSearcher
+
         task_instance = context['task_instance']            # type: TaskInstance
         searcher = GitHubSearcher(auth_token=keyring.get_password('github-token', 'tassadarius'))
         pg_hook = PostgresHook(postgres_conn_id=self._conn_id)
@@ -86,7 +87,7 @@ class SearchRepoOperator(BaseOperator):
     def _clear_cursor(self, pg_hook: PostgresHook):
         pg_hook.run(f'DELETE FROM cursor', True)
 
-    def _parse_cursor(self, cursor_series: pd.Series):
+    def _parse_cursor(self, cursor_series: 'pd.Series'):
         cur_data = cursor_series.apply(base64.b64decode)
         cur_str = cur_data.apply(str)
         cur_str = cur_str.apply(lambda x: x.split(':')[1])
@@ -102,6 +103,8 @@ class FilterSearchOperator(BaseOperator):
         self._conn_id = postgres_conn_id
 
     def execute(self, context):
+        from templatecrawler import database
+
         task_instance = context['task_instance']                    # type: TaskInstance
         search_data = task_instance.xcom_pull(key='raw_search')     # type: pd.DataFrame
 
@@ -109,58 +112,93 @@ class FilterSearchOperator(BaseOperator):
             return
 
         cursor = search_data['cursor'].max()
-        accepted = search_data.loc[search_data['disk_usage'] >= 512000]   # Greater than 500 KiB
-        rejected = search_data.loc[search_data['disk_usage'] < 512000]   # Smaller than 500 KiB
         pg_hook = PostgresHook(postgres_conn_id=self._conn_id)
-        self._write_to_database(accepted, pg_hook, table='repositories')
-        self._write_to_database(rejected, pg_hook, table='discarded_repositories')
+        database.write_repositories(pg_hook.get_conn(), search_data)      # Smaller than 500 KiB are discarded
         self._write_cursor(cursor, pg_hook)
 
-    def _write_to_database(self, df: pd.DataFrame, pg_hook: PostgresHook, table: str) -> None:
-        conn = pg_hook.get_conn()
-        cur = conn.cursor()
+    def _write_cursor(self, cursor: int, pg_hook: PostgresHook):
+        _cursor = int(cursor)
+        pg_hook.run("""INSERT INTO cursor (cursor) VALUES (%s)""", autocommit=True, parameters=[_cursor])
 
-        columns = ['name', 'owner', 'url', 'stars', 'is_fork', 'disk_usage', 'license', 'cursor', 'languages']
-        assert all([x in df.columns for x in columns])
 
-        df = df[columns]        # filter to the relevant columns
-        data_as_list = df.to_records(index=False).tolist()
+class ShardedSearchOperator(BaseOperator):
+    """ Pages through the whole query space of a language instead of the first 1000 results of one search, see
+    templatecrawler.search.ShardedSearcher. Every run continues the plan and the checkpoints of the last one.
+    """
 
-        base_query = cur.mogrify(f"""INSERT INTO {table} ({','.join(columns)}) VALUES %s ON CONFLICT DO NOTHING""")
-        execute_values(cur, base_query, data_as_list, template=None, page_size=100)
-        conn.commit()
-        cur.close()
+    @apply_defaults
+    def __init__(self, postgres_conn_id: str, target_language: str = 'random', workers: int = 4,
+                 max_pages: int = 50, max_queries: int = 200, max_wait: float = 60, *args, **kwargs):
+        """ :param max_queries: Shards counted per run while planning
+        :param max_wait: Seconds a run waits for a rate limit at most, afterwards it stops and leaves the rest
+        """
+        super(ShardedSearchOperator, self).__init__(*args, **kwargs)
+        self._conn_id = postgres_conn_id
+        self.target_language = target_language
+        self.workers = workers
+        self.max_pages = max_pages
+        self.max_queries = max_queries
+        self.max_wait = max_wait
 
-    def _write_cursor(self, cursor: int, pg_hook: PostgresHook):
-        _cursor = int(cursor)
-        pg_hook.run("""INSERT INTO cursor (cursor) VALUES (%s)""", autocommit=True, parameters=[_cursor])
+    def execute(self, context):
+        import keyring
+        from templatecrawler.search import ShardedSearcher
+
+        language = random.choice(['Java', 'C']) if self.target_language == 'random' else self.target_language
+        searcher = ShardedSearcher(auth_token=keyring.get_password('github-token', 'tassadarius'), language=language,
+                                   workers=self.workers, max_wait=self.max_wait)
+        pg_hook = PostgresHook(postgres_conn_id=self._conn_id)
+        conn = pg_hook.get_conn()
+        try:
+            pages = searcher.run(conn, max_pages=self.max_pages, max_queries=self.max_queries)
+        finally:
+            conn.close()
+        if pages == 0:
+            raise AirflowSkipException(f'No pages of {language} repositories fetched')
 
 
 class FetchFilesOperator(BaseOperator):
 
     @apply_defaults
-    def __init__(self, *args, **kwargs):
+    def __init__(self, response_cache: str = None, tree_cache: str = None, *args, **kwargs):
+        """ :param response_cache: (optional) SQLite file to cache GitHub API responses in
+        :param tree_cache: (optional) SQLite file to cache git trees in, by OID
+        """
         super(FetchFilesOperator, self).__init__(*args, **kwargs)
+        self.response_cache = response_cache
+        self.tree_cache = tree_cache
 
     def execute(self, context):
+        import keyring
+        from templatecrawler.crawler import GitHubCrawler
+        from templatecrawler.crawlerengine.cache import ResponseCache, TreeCache
+
         task_instance = context['task_instance']                # type: TaskInstance
         repositories = task_instance.xcom_pull(key='repositories')
         without_files = list()
         with_files = dict()
-        for _, repo in repositories.iterrows():
-            crawler = GitHubCrawler(auth_token=keyring.get_password('github-token', 'tassadarius'),
-                                    owner=repo['owner'], repository=repo['name'])
-            files = crawler.fetch_heuristically(30)
-            primary_language = crawler.fetch_primary_language()
-            tmp_language = primary_language
-            if 'java' in tmp_language or 'Java' in tmp_language:
-                repositories['languages'] = 'java'
-            if tmp_language == 'c':
-                repositories['languages'] = 'c'
-            if files:
-                with_files[repo.repo_id] = files
-            else:
-                without_files.append(repo.repo_id)
+        cache = ResponseCache(self.response_cache) if self.response_cache else None
+        tree_cache = TreeCache(self.tree_cache) if self.tree_cache else None
+        try:
+            for _, repo in repositories.iterrows():
+                crawler = GitHubCrawler(auth_token=keyring.get_password('github-token', 'tassadarius'),
+                                        owner=repo['owner'], repository=repo['name'], cache=cache,
+                                        tree_cache=tree_cache)
+                files = crawler.fetch_heuristically(30)
+                primary_language = crawler.fetch_primary_language()
+                tmp_language = primary_language
+                if 'java' in tmp_language or 'Java' in tmp_language:
+                    repositories['languages'] = 'java'
+                if tmp_language == 'c':
+                    repositories['languages'] = 'c'
+                if files:
+                    with_files[repo.repo_id] = files
+                else:
+                    without_files.append(repo.repo_id)
+        finally:
+            for x in (cache, tree_cache):
+                if x is not None:
+                    x.close()
         task_instance.xcom_push(key='repo_with_files', value=with_files)
         task_instance.xcom_push(key='repo_without_files', value=with_files)
         task_instance.xcom_push(key='repositories', value=repositories)
@@ -173,6 +211,8 @@ class DetectLoggingFromFilesOperator(BaseOperator):
         super(DetectLoggingFromFilesOperator, self).__init__(*args, **kwargs)
 
     def execute(self, context):
+        from templatecrawler.detector import LogDetector
+
         task_instance = context['task_instance']                # type: TaskInstance
         repositories = task_instance.xcom_pull(key='repositories')  # type: pd.DataFrame
         repositories.set_index('repo_id', inplace=True)
@@ -223,6 +263,9 @@ class CloneAndExtractOperator(BaseOperator):
         super(CloneAndExtractOperator, self).__init__(*args, **kwargs)
 
     def execute(self, context):
+        from templatecrawler.crawler import GitHubCrawler
+        from templatecrawler.extractor import LogExtractor
+
         task_instance = context['task_instance']  # type: TaskInstance
         repositories = task_instance.xcom_pull(key='target_repositories')  # type: pd.DataFrame
         repositories.set_index('repo_id', inplace=True)
@@ -266,6 +309,8 @@ class ParseOperator(BaseOperator):
         super(ParseOperator, self).__init__(*args, **kwargs)
 
     def execute(self, context):
+        from templatecrawler.parser import LogParser
+
         task_instance = context['task_instance']  # type: TaskInstance
         repositories = task_instance.xcom_pull(key='target_repositories')  # type: pd.DataFrame
         data = task_instance.xcom_pull(key='raw_events')
@@ -301,6 +346,8 @@ class FilterTemplatesOperator(BaseOperator):
         super(FilterTemplatesOperator, self).__init__(*args, **kwargs)
 
     def execute(self, context):
+        from templatecrawler.templatefilter import find_valid
+
         task_instance = context['task_instance']  # type: TaskInstance
         data = task_instance.xcom_pull(key='parsed')  # type: pd.DataFrame
         validity_mask = find_valid(data['template'])
@@ -315,9 +362,102 @@ class FormalizeOperator(BaseOperator):
         super(FormalizeOperator, self).__init__(*args, **kwargs)
 
     def execute(self, context):
+        import templatecrawler.formalizer as formalizer
+        import templatecrawler.tokentypes as ttokens
+
         task_instance = context['task_instance']  # type: TaskInstance
         data = task_instance.xcom_pull(key='parsed')  # type: pd.DataFrame
         output = formalizer.formalize(data, possible_types=ttokens.tokens)
         data = data.loc[output.keys()]
         data['template'] = output.values()
         task_instance.xcom_push(key='formalized', value=data)
+
+
+class PipelineOperator(BaseOperator):
+    """ Runs the whole extract --> parse --> filter --> formalize chain for the repository in 'target_repository' as
+    one task and hands the templates over to the next task under the key 'templates'.
+    With a metrics_dir the metrics of every run are written to <metrics_dir>/<repo_id>.json
+
+    Profiling is switched on through the params or the conf of a DAG run, the conf wins:
+    'profile_dir' writes a .pstats file per stage to <profile_dir>/<repo_id>/, 'slow_statements' keeps the n slowest
+    statements of the parser (in <profile_dir>/<repo_id>/slow_statements.json, otherwise only logged).
+    """
+
+    @apply_defaults
+    def __init__(self, postgres_conn_id: str, work_dir: str, metrics_dir: str = None, *args, **kwargs):
+        super(PipelineOperator, self).__init__(*args, **kwargs)
+        self._conn_id = postgres_conn_id
+        self._work_dir = work_dir
+        self._metrics_dir = metrics_dir
+
+    def execute(self, context):
+        from templatecrawler.pipeline import Pipeline
+        from templatecrawler import handoff, database
+
+        task_instance = context['task_instance']  # type: TaskInstance
+        repo = task_instance.xcom_pull(key='target_repository')  # type: pd.Series
+        repo_path = task_instance.xcom_pull(key='repo_path')
+        pg_hook = PostgresHook(postgres_conn_id=self._conn_id)
+        worker = self.worker_name(context)
+        repo_ids = [int(repo['repo_id'])]
+
+        # The lease was taken when the DAG run claimed the repository, keep it alive while the pipeline runs
+        lease = int((context.get('params') or {}).get('lease') or 3600)
+        with closing(pg_hook.get_conn()) as conn:
+            renewed = database.renew_leases(conn, repo_ids, worker=worker)
+        if renewed == 0:
+            shutil.rmtree(repo_path, ignore_errors=True)
+            raise AirflowSkipException(f'Lost the lease on {repo["url"]}, another worker processes it now')
+
+        profile_dir, slow_statements = self._profiling(context)
+        if profile_dir:
+            profile_dir = Path(profile_dir, str(repo['repo_id']))
+        pipeline = Pipeline(repo_path, language=repo['main_language'], profile_dir=profile_dir,
+                            slow_statements=slow_statements)
+        try:
+            # The renewals share one connection of their own, it is closed with the block
+            with database.keep_leases(pg_hook.get_conn, repo_ids, worker=worker, interval=lease / 2):
+                templates = pipeline.run()
+        except Exception as e:
+            log.error(f'Pipeline failed for {repo["url"]}. Raised exception {e.__class__.__name__}')
+            self._mark_failed(pg_hook, repo['repo_id'], worker)
+            raise e
+        finally:
+            if self._metrics_dir:
+                pipeline.metrics.dump(Path(self._metrics_dir, f'{repo["repo_id"]}.json'))
+            # The templates are all that is handed over, the clone isn't needed anymore either way
+            shutil.rmtree(repo_path, ignore_errors=True)
+
+        repo['framework'] = pipeline.framework
+        pg_hook.run("""UPDATE repositories SET framework = %s WHERE repo_id = %s""", autocommit=True,
+                    parameters=[repo['framework'], repo['repo_id']])
+        log.info(f'Pipeline for {repo["url"]} with ID {repo["repo_id"]} (framework: {repo["framework"]}) '
+                 f'finished with {pipeline.stats} (aborted: {pipeline.aborted})')
+
+        if len(templates) <= 0:
+            self._mark_failed(pg_hook, repo['repo_id'], worker)
+            raise AirflowSkipException()
+
+        work_dir = handoff.work_directory(self._work_dir, context['run_id'])
+        task_instance.xcom_push(key='target_repository', value=repo)
+        task_instance.xcom_push(key='templates', value=handoff.dump(templates, work_dir, 'templates'))
+
+    @staticmethod
+    def _profiling(context) -> Tuple[Union[str, None], int]:
+        params = dict(context.get('params') or {})
+        dag_run = context.get('dag_run')
+        if dag_run is not None and dag_run.conf:
+            params.update(dag_run.conf)
+        return params.get('profile_dir'), int(params.get('slow_statements') or 0)
+
+    @staticmethod
+    def worker_name(context) -> str:
+        """ The name repositories are claimed under, the same for all tasks of a DAG run """
+        return f'airflow:{context["run_id"]}'
+
+    def _mark_failed(self, pg_hook: PostgresHook, repo_id, worker: str):
+        from templatecrawler import database
+        with closing(pg_hook.get_conn()) as conn:
+            finished = database.finish_repositories(conn, [(int(repo_id), False, None)], worker=worker)
+        if finished == 0:
+            log.warning(f'Repository {repo_id} was taken over by another worker, left it as it is')
@@ -0,0 +1,39 @@
+from hashlib import blake2b
+from typing import Iterable, Union
+import math
+
+
+class BloomFilter:
+    """ Set membership with false positives but without false negatives, in a fixed amount of memory.
+    Used to skip database lookups for values which certainly are not in a table.
+    """
+
+    def __init__(self, capacity: int, error_rate: float = 0.001):
+        capacity = max(capacity, 1)
+        self.size = max(int(-capacity * math.log(error_rate) / (math.log(2) ** 2)), 8)
+        self.hash_count = max(int(round(self.size / capacity * math.log(2))), 1)
+        self._bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, value: Union[str, bytes]):
+        if isinstance(value, str):
+            value = value.encode('utf-8', errors='surrogatepass')
+        digest = blake2b(value, digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hash_count))
+
+    def add(self, value: Union[str, bytes]):
+        for position in self._positions(value):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def update(self, values: Iterable[Union[str, bytes]]):
+        for value in values:
+            if value is not None:
+                self.add(value)
+
+    def __contains__(self, value: Union[str, bytes]) -> bool:
+        if value is None:
+            return False
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(value))
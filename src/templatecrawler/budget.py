@@ -0,0 +1,45 @@
+import time
+
+
+class BudgetExceeded(ValueError):
+    """ A statement needed more steps, time or characters than its budget allows, <kind> tells which one.
+    It is a ValueError, so everything that skips unparsable statements skips these as well.
+    """
+
+    def __init__(self, kind: str, where: str, limit: float):
+        super().__init__(f'Exceeded the {kind} budget ({limit}) in {where}')
+        self.kind = kind        # 'steps', 'seconds' or 'length'
+        self.where = where
+        self.limit = limit
+
+
+class Budget:
+    """ What a single statement may cost in the scanners, so one bad input can't hang a worker.
+    start() before every statement, step() in every iteration of a scanning loop. The clock is only read every
+    <check_every> steps, so a step costs about one comparison.
+
+    :param steps: Loop iterations per statement, summed over all loops and nested calls
+    :param seconds: Wall clock time per statement
+    :param length: Characters per statement
+    """
+
+    def __init__(self, steps: int = 20000, seconds: float = 1.0, length: int = 20000, check_every: int = 256):
+        self.steps = steps
+        self.seconds = seconds
+        self.length = length
+        self.check_every = check_every
+        self._steps = 0
+        self._deadline = 0.0
+
+    def start(self, statement: str = ''):
+        if len(statement) > self.length:
+            raise BudgetExceeded('length', 'start', self.length)
+        self._steps = 0
+        self._deadline = time.perf_counter() + self.seconds
+
+    def step(self, where: str):
+        self._steps += 1
+        if self._steps > self.steps:
+            raise BudgetExceeded('steps', where, self.steps)
+        if self._steps % self.check_every == 0 and time.perf_counter() > self._deadline:
+            raise BudgetExceeded('seconds', where, self.seconds)
@@ -8,23 +8,28 @@ from dataclasses import asdict
 import base64
 import shutil
 import logging
-import psycopg2
 
 from templatecrawler.crawlerengine.calls import GitHubCrawlerCalls
+from templatecrawler.crawlerengine.cache import ResponseCache, TreeCache
 from templatecrawler.crawlerengine.patterns import LanguageMap
 from templatecrawler.crawlerengine.heuristicwalk import HeuristicDeepWalk
 from templatecrawler.crawlerengine.gittypes import GitTree, GitBlob
+from templatecrawler import metrics
 
 
 class GitHubCrawler:
 
     log = logging.getLogger(__name__)
 
-    def __init__(self, auth_token: str, owner: str, repository: str,):
+    def __init__(self, auth_token: str, owner: str, repository: str, cache: ResponseCache = None,
+                 tree_cache: TreeCache = None):
+        """ :param cache: (optional) Cache of API responses, see GitHubCrawlerCalls
+        :param tree_cache: (optional) Trees by OID, shared by all repositories
+        """
         self.auth_token = auth_token
         self.owner = owner
         self.repository = repository
-        self._caller = GitHubCrawlerCalls(auth_token, owner, repository)
+        self._caller = GitHubCrawlerCalls(auth_token, owner, repository, cache=cache, tree_cache=tree_cache)
         self._language = None
         self._extensions = None
         self._path = None
@@ -66,8 +71,10 @@ class GitHubCrawler:
             return self._path
         try:
             target_url = f'https://github.com/{self.owner}/{self.repository}'
-            Repo.clone_from(target_url, str(self._path), multi_options=['--depth 1'])  # , progress=GitHubCrawler._update)
+            with metrics.timer('clone_seconds'):
+                Repo.clone_from(target_url, str(self._path), multi_options=['--depth 1'])  # , progress=GitHubCrawler._update)
         except (CommandError, GitCommandError, GitCommandNotFound) as e:
+            metrics.increment('clone_errors_total')
             raise ValueError(f'Git command {e.command} failed')
         return str(self._path.absolute())
 
@@ -117,6 +124,8 @@ class GitHubCrawler:
 
         if invalid_files:
             self.log.info(f'[FETCH FILES] {len(invalid_files)} could not be read due to UnicodeDecodeErrrors')
+        metrics.increment('crawler_files_read_total', len(files))
+        metrics.increment('crawler_unreadable_files_total', len(invalid_files))
 
         return files
 
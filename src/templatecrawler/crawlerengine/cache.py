@@ -0,0 +1,146 @@
+from pathlib import Path
+from typing import Any, Dict, List, NamedTuple, Union
+import json
+import sqlite3
+import threading
+import time
+import zlib
+
+from templatecrawler import metrics
+
+
+class CachedResponse(NamedTuple):
+    value: Any
+    validator: Union[str, None]     # ETag of the response or whatever else tells if it is still current
+    stored_at: float
+
+    @property
+    def age(self) -> float:
+        return time.time() - self.stored_at
+
+
+class ResponseCache:
+    """ API responses on disk, in SQLite, keyed by the kind of query and its variables. An entry younger than the
+    TTL of its kind is used as it is, an older one has to be revalidated (e.g. with its ETag) before it is used.
+    The file can be shared by several processes.
+
+    :param path: SQLite file, created if it doesn't exist
+    :param ttl: Seconds per kind of query, merged into default_ttl
+    """
+
+    default_ttl = {'repository': 24 * 3600,         # Primary language and default branch
+                   'root_tree': 3600}               # Changes with every push to the default branch
+
+    def __init__(self, path: Union[str, Path], ttl: Dict[str, float] = None):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.ttl = {**self.default_ttl, **(ttl or {})}
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(self.path), timeout=30, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute("""CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, value TEXT NOT NULL,
+                            validator TEXT, stored_at REAL NOT NULL)""")
+        self._db.commit()
+
+    @staticmethod
+    def key(kind: str, variables: dict) -> str:
+        return f'{kind}:{json.dumps(variables, sort_keys=True)}'
+
+    def get(self, kind: str, variables: dict) -> Union[CachedResponse, None]:
+        with self._lock:
+            row = self._db.execute('SELECT value, validator, stored_at FROM responses WHERE key = ?',
+                                   [self.key(kind, variables)]).fetchone()
+        if row is None:
+            return None
+        return CachedResponse(json.loads(row[0]), row[1], row[2])
+
+    def fresh(self, kind: str, entry: CachedResponse) -> bool:
+        return entry.age < self.ttl.get(kind, 0)
+
+    def put(self, kind: str, variables: dict, value: Any, validator: str = None):
+        with self._lock:
+            self._db.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)',
+                             [self.key(kind, variables), json.dumps(value), validator, time.time()])
+            self._db.commit()
+
+    def touch(self, kind: str, variables: dict):
+        """ The entry was revalidated, its TTL starts over """
+        with self._lock:
+            self._db.execute('UPDATE responses SET stored_at = ? WHERE key = ?', [time.time(),
+                                                                                  self.key(kind, variables)])
+            self._db.commit()
+
+    def close(self):
+        self._db.close()
+
+
+class TreeCache:
+    """ Entries of git trees on disk, in SQLite, keyed by the OID of the tree. Trees never change, so an entry is
+    valid forever and is shared by every repository containing the tree, forks above all. Once the entries take more
+    than <max_bytes>, the least recently used ones are evicted.
+
+    :param path: SQLite file, created if it doesn't exist
+    :param max_bytes: Upper bound of the stored (compressed) entries
+    :param touch_after: Seconds after which a hit updates the time the entry was last used. Eviction only needs a
+                        rough order, so most hits are plain reads and don't write to the file.
+    """
+
+    def __init__(self, path: Union[str, Path], max_bytes: int = 256 * 1024 * 1024, touch_after: float = 3600):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.touch_after = touch_after
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(self.path), timeout=30, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute("""CREATE TABLE IF NOT EXISTS trees (oid BLOB PRIMARY KEY, entries BLOB NOT NULL,
+                            size INTEGER NOT NULL, used_at REAL NOT NULL)""")
+        self._db.execute('CREATE INDEX IF NOT EXISTS trees_used_at ON trees (used_at)')
+        self._db.commit()
+        self._size, = self._db.execute('SELECT coalesce(sum(size), 0) FROM trees').fetchone()
+
+    def get(self, oid: bytes) -> Union[List[dict], None]:
+        """ :return: The entries like the API returns them ({'type', 'name', 'oid'}) or None """
+        with self._lock:
+            row = self._db.execute('SELECT entries, used_at FROM trees WHERE oid = ?', [oid]).fetchone()
+            now = time.time()
+            if row is not None and now - row[1] > self.touch_after:
+                self._db.execute('UPDATE trees SET used_at = ? WHERE oid = ?', [now, oid])
+                self._db.commit()
+        if row is None:
+            self.misses += 1
+            metrics.increment('tree_cache_total', result='miss')
+            return None
+        self.hits += 1
+        metrics.increment('tree_cache_total', result='hit')
+        return [{'type': t, 'name': n, 'oid': o} for t, n, o in json.loads(zlib.decompress(row[0]))]
+
+    def put(self, oid: bytes, entries: List[dict]):
+        data = zlib.compress(json.dumps([(x['type'], x['name'], x['oid']) for x in entries],
+                                        separators=(',', ':')).encode('utf-8'))
+        with self._lock:
+            cursor = self._db.execute('INSERT OR IGNORE INTO trees VALUES (?, ?, ?, ?)',
+                                      [oid, data, len(data), time.time()])
+            self._db.commit()
+            self._size += len(data) if cursor.rowcount > 0 else 0
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        # Down to 90 %, so not every insert has to evict. Other processes may have written, so count again.
+        self._size, = self._db.execute('SELECT coalesce(sum(size), 0) FROM trees').fetchone()
+        target = self.max_bytes * 0.9
+        evicted = 0
+        for oid, size in self._db.execute('SELECT oid, size FROM trees ORDER BY used_at').fetchall():
+            if self._size <= target:
+                break
+            self._db.execute('DELETE FROM trees WHERE oid = ?', [oid])
+            self._size -= size
+            evicted += 1
+        self._db.commit()
+        metrics.increment('tree_cache_evictions_total', evicted)
+
+    def close(self):
+        self._db.close()
@@ -1,22 +1,33 @@
 import json
-from typing import Union, List
+from typing import Union, List, Tuple
 
 from .utils import Communicator, get_deepest_dict_value
 from .gittypes import GitTree, GitBlob, GitRepo
+from .cache import ResponseCache, TreeCache
+from templatecrawler import metrics
 
 
 class GitHubCrawlerCalls:
     api_endpoint = 'https://api.github.com/graphql'
 
-    def __init__(self, auth_token: str, owner: str = None, repository: str = None, use_session: bool = True):
+    def __init__(self, auth_token: str, owner: str = None, repository: str = None, use_session: bool = True,
+                 cache: ResponseCache = None, tree_cache: TreeCache = None):
+        """ :param cache: (optional) Keeps the repository metadata and the root tree, re-examining a repository
+                              then costs conditional requests at most, which don't count against the rate limit
+        :param tree_cache: (optional) Trees by OID, asked before the API
+        """
         self.owner = owner
         self.repository = repository
         self._auth_token = auth_token
         self._communicator = Communicator(use_session)
+        self._cache = cache
+        self._tree_cache = tree_cache
 
     def get_primary_language(self) -> str:
         if not self.owner or not self.repository:
             raise ValueError('Owner or repository not set')
+        if self._cache is not None:
+            return self._repository_metadata()['language']
         query_raw = f"""query {{
                             repository(owner: \"{self.owner}\", name:\"{self.repository}\") {{
                                 primaryLanguage {{name}}
@@ -30,6 +41,8 @@ class GitHubCrawlerCalls:
     def get_default_branch(self) -> str:
         if not self.owner or not self.repository:
             raise ValueError('Owner or repository not set')
+        if self._cache is not None:
+            return self._repository_metadata()['default_branch']
         query_raw = f"""query {{
                         repository(owner: "{self.owner}", name:"{self.repository}") {{
                             defaultBranchRef {{
@@ -45,6 +58,42 @@ class GitHubCrawlerCalls:
     def get_root_tree(self) -> GitTree:
         if not self.owner or not self.repository:
             raise ValueError('Owner or repository not set')
+        if self._cache is None:
+            oid, tree_content = self._fetch_root_tree()
+            return self._fill_tree(oid, tree_content, name='__root__')
+
+        # The tree is current as long as the head commit of the default branch is the one it was fetched at
+        variables = {'owner': self.owner, 'repository': self.repository}
+        entry = self._cache.get('root_tree', variables)
+        if entry is not None and self._cache.fresh('root_tree', entry):
+            metrics.increment('api_cache_total', kind='root_tree', result='fresh')
+            return self._fill_tree(entry.value['oid'], entry.value['entries'], name='__root__')
+        response = None
+        if entry is not None:
+            branch = self.get_default_branch()
+            header = {'Authorization': f'bearer {self._auth_token}', 'Accept': 'application/vnd.github.sha'}
+            if entry.validator:
+                header['If-None-Match'] = entry.validator
+            response = self._communicator.get(f'/repos/{self.owner}/{self.repository}/commits/{branch}', header)
+            if response is not None and (response.status_code == 304 or response.text.strip() == entry.value['oid']):
+                if response.status_code == 304:
+                    self._cache.touch('root_tree', variables)
+                else:
+                    self._cache.put('root_tree', variables, entry.value, response.headers.get('ETag'))
+                metrics.increment('api_cache_total', kind='root_tree', result='revalidated')
+                return self._fill_tree(entry.value['oid'], entry.value['entries'], name='__root__')
+
+        metrics.increment('api_cache_total', kind='root_tree', result='miss')
+        oid, tree_content = self._fetch_root_tree()
+        # The ETag of the head commit lookup only validates the tree if nothing was pushed in between
+        validator = None
+        if response is not None and response.status_code == 200 and response.text.strip() == oid:
+            validator = response.headers.get('ETag')
+        self._cache.put('root_tree', variables, {'oid': oid, 'entries': tree_content}, validator)
+        return self._fill_tree(oid, tree_content, name='__root__')
+
+    def _fetch_root_tree(self) -> Tuple[str, List[dict]]:
+        """ :return: (OID of the head commit, entries of its tree) """
         query_raw = f"""query {{
                 repository(name: "{self.repository}" owner: "{self.owner}") {{
                     defaultBranchRef {{
@@ -69,7 +118,32 @@ class GitHubCrawlerCalls:
         data = self._communicator.send_and_receive(header, query).json()
         tree_content = data['data']['repository']['defaultBranchRef']['target']['tree']['entries']
         oid = data['data']['repository']['defaultBranchRef']['target']['oid']
-        return self._fill_tree(oid, tree_content, name='__root__')
+        return oid, tree_content
+
+    def _repository_metadata(self) -> dict:
+        """ Primary language and default branch from the REST API, cached and revalidated with the ETag """
+        variables = {'owner': self.owner, 'repository': self.repository}
+        entry = self._cache.get('repository', variables)
+        if entry is not None and self._cache.fresh('repository', entry):
+            metrics.increment('api_cache_total', kind='repository', result='fresh')
+            return entry.value
+
+        header = {'Authorization': f'bearer {self._auth_token}'}
+        if entry is not None and entry.validator:
+            header['If-None-Match'] = entry.validator
+        response = self._communicator.get(f'/repos/{self.owner}/{self.repository}', header)
+        if response is None:
+            raise ValueError(f'Fetching the metadata of {self.owner}/{self.repository} failed')
+        if response.status_code == 304:
+            metrics.increment('api_cache_total', kind='repository', result='revalidated')
+            self._cache.touch('repository', variables)
+            return entry.value
+
+        metrics.increment('api_cache_total', kind='repository', result='miss')
+        data = response.json()
+        value = {'language': data['language'], 'default_branch': data['default_branch']}
+        self._cache.put('repository', variables, value, response.headers.get('ETag'))
+        return value
 
     def get_tree(self, target_tree: Union[str, GitTree]) -> GitTree:
         if not self.owner or not self.repository:
@@ -79,6 +153,21 @@ class GitHubCrawlerCalls:
         else:
             oid = target_tree
 
+        # Trees are immutable, a cached one is always current
+        tree_content = self._tree_cache.get(bytes.fromhex(oid)) if self._tree_cache is not None else None
+        if tree_content is None:
+            tree_content = self._fetch_tree(oid)
+            if self._tree_cache is not None:
+                self._tree_cache.put(bytes.fromhex(oid), tree_content)
+
+        if type(target_tree) == GitTree:
+            tmp = self._fill_tree(None, tree_content)
+            target_tree.entries = tmp.entries
+            return target_tree
+        else:
+            return self._fill_tree(oid, tree_content)
+
+    def _fetch_tree(self, oid: str) -> List[dict]:
         query_raw = f"""query {{
                 repository(name: "{self.repository}" owner: "{self.owner}") {{
                     object(oid: "{oid}") {{
@@ -97,14 +186,7 @@ class GitHubCrawlerCalls:
         query = json.dumps(query_skeleton)
         header = {'Authorization': f'bearer {self._auth_token}'}
         data = self._communicator.send_and_receive(header, query).json()
-        tree_content = data['data']['repository']['object']['entries']
-
-        if type(target_tree) == GitTree:
-            tmp = self._fill_tree(None, tree_content)
-            target_tree.entries = tmp.entries
-            return target_tree
-        else:
-            return self._fill_tree(oid, tree_content)
+        return data['data']['repository']['object']['entries']
 
     def search_for_repos(self, language: str, count: int, cursor: str = None, after=True) -> List[GitRepo]:
         if cursor:
@@ -112,9 +194,41 @@ class GitHubCrawlerCalls:
             _cursor = direction_keyword + f': "{cursor}"'
         else:
             _cursor = ""
+        data_root = self._search(f'language:{language}', count, _cursor)
+        return self._parse_repositories(data_root['edges'])
+
+    def search_page(self, query: str, count: int = 100,
+                    cursor: str = None) -> Tuple[List[GitRepo], int, Union[str, None], bool]:
+        """ One page of a repository search with any qualifiers, e.g. 'language:Java created:2015-01-01..2015-01-31'.
+
+        :return: (repositories, number of results of the whole query, cursor of the last result, has next page)
+        """
+        data_root = self._search(query, count, f'after: "{cursor}"' if cursor else '')
+        page_info = data_root['pageInfo']
+        return (self._parse_repositories(data_root['edges']), data_root['repositoryCount'], page_info['endCursor'],
+                page_info['hasNextPage'])
 
+    def count_repos(self, query: str) -> int:
+        """ Number of results of a repository search, without fetching them """
         query_raw = f"""query {{
-                search(query: "language:{language}" type: REPOSITORY first: {str(count)} {_cursor}) {{
+                search(query: {json.dumps(query)} type: REPOSITORY first: 1) {{
+                    repositoryCount
+                }}
+        }}"""
+        header = {'Authorization': f'bearer {self._auth_token}'}
+        response = self._communicator.send_and_receive(header, json.dumps({'query': query_raw}))
+        if response is None:
+            raise ValueError('Search request failed')
+        return response.json()['data']['search']['repositoryCount']
+
+    def _search(self, query: str, count: int, cursor_argument: str) -> dict:
+        query_raw = f"""query {{
+                search(query: {json.dumps(query)} type: REPOSITORY first: {str(count)} {cursor_argument}) {{
+                    repositoryCount
+                    pageInfo {{
+                        endCursor
+                        hasNextPage
+                    }}
                     edges {{
                         cursor
                         node {{
@@ -146,10 +260,15 @@ class GitHubCrawlerCalls:
         query_skeleton = {'query': query_raw}
         query = json.dumps(query_skeleton)
         header = {'Authorization': f'bearer {self._auth_token}'}
-        data = self._communicator.send_and_receive(header, query).json()
-        data_root = data['data']['search']['edges']
+        response = self._communicator.send_and_receive(header, query)
+        if response is None:
+            raise ValueError('Search request failed')
+        return response.json()['data']['search']
+
+    @staticmethod
+    def _parse_repositories(edges: List[dict]) -> List[GitRepo]:
         repositories = []
-        for entry in data_root:
+        for entry in edges:
             cursor_data = entry['cursor']
             repo_data = entry['node']
             language_data = [x['node']['name'] for x in repo_data['languages']['edges']]
@@ -1,23 +1,84 @@
 from dataclasses import dataclass
 from typing import List, Union
+import sys
 
 
-@dataclass
 class GitObject:
-    name: Union[str, None]                      # Sometimes this may need to be None when property has not been fetched
-    oid: str
-    type: str
+    """ A tree or blob of a repository. Walks create a lot of these, so they are kept small: slots instead of a dict,
+    the OID as raw bytes (20 instead of 40 characters) and interned names, the same directory and file names come up
+    in every repository.
+    Objects are equal if type and OID are, which makes them usable as cache keys and in sets.
+    """
+
+    __slots__ = ('name', '_oid', 'type')
+
+    def __init__(self, name: Union[str, None], oid: Union[str, bytes, None], type: str):
+        self.name = _intern(name)               # Sometimes this may need to be None when property has not been fetched
+        self._oid = bytes.fromhex(oid) if isinstance(oid, str) else oid
+        self.type = _intern(type)
+
+    @property
+    def oid(self) -> Union[str, None]:
+        """ Hex string, as GitHub uses it """
+        return self._oid.hex() if self._oid is not None else None
+
+    @property
+    def oid_bytes(self) -> Union[bytes, None]:
+        return self._oid
+
+    def __eq__(self, other):
+        if not isinstance(other, GitObject):
+            return NotImplemented
+        if self._oid is None or other._oid is None:
+            return self is other
+        return self._oid == other._oid and self.type == other.type
+
+    def __hash__(self):
+        return hash(self._oid) if self._oid is not None else id(self)
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}(name={self.name!r}, oid={self.oid!r}, type={self.type!r})'
 
 
-@dataclass
 class GitTree(GitObject):
-    entries: Union[List[GitObject], None]       # Sometimes this may need to be None when property has not been fetched
+
+    __slots__ = ('entries',)
+
+    def __init__(self, name: Union[str, None], oid: Union[str, bytes, None], type: str,
+                 entries: Union[List[GitObject], None]):
+        super().__init__(name, oid, type)
+        self.entries = entries                  # Sometimes this may need to be None when property has not been fetched
+
+    def release(self):
+        """ Drops the entries once the tree was walked, it can be fetched again by its OID """
+        self.entries = None
 
 
-@dataclass
 class GitBlob(GitObject):
-    size: Union[int, None]                      # Sometimes this may need to be None when property has not been fetched
-    content: Union[str, None]                   # Sometimes this may need to be None when property has not been fetched
+    """ The content is kept as UTF-8 bytes and only decoded on access """
+
+    __slots__ = ('size', '_content')
+
+    def __init__(self, name: Union[str, None], oid: Union[str, bytes, None], type: str, size: Union[int, None],
+                 content: Union[str, bytes, None]):
+        super().__init__(name, oid, type)
+        self.size = size                        # Sometimes this may need to be None when property has not been fetched
+        self.content = content                  # Sometimes this may need to be None when property has not been fetched
+
+    @property
+    def content(self) -> Union[str, None]:
+        return self._content.decode('utf-8', errors='surrogateescape') if self._content is not None else None
+
+    @content.setter
+    def content(self, value: Union[str, bytes, None]):
+        if isinstance(value, str):
+            value = value.encode('utf-8', errors='surrogateescape')
+        self._content = value
+
+    @property
+    def data(self) -> Union[bytes, None]:
+        """ The content without decoding it """
+        return self._content
 
     def __gt__(self, other):
         return self.size > other.size
@@ -31,8 +92,18 @@ class GitBlob(GitObject):
     def __le__(self, other):
         return self.size <= other.size
 
-    def __eq__(self, other):
-        return self.size == other.size
+    # Python drops __hash__ if a class only overrides the comparisons, GitObject's __eq__ and __hash__ still apply
+    __eq__ = GitObject.__eq__
+    __hash__ = GitObject.__hash__
+
+    def __repr__(self):
+        content = f'<{len(self._content)} bytes>' if self._content is not None else None
+        return f'GitBlob(name={self.name!r}, oid={self.oid!r}, type={self.type!r}, size={self.size!r}, ' \
+               f'content={content})'
+
+
+def _intern(value: Union[str, None]) -> Union[str, None]:
+    return sys.intern(value) if value is not None else None
 
 
 @dataclass
@@ -47,5 +118,3 @@ class GitRepo:
     license_key: str
     languages: List[str]
     cursor: str
-
-
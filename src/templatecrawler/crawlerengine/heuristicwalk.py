@@ -50,6 +50,7 @@ class HeuristicDeepWalk:
         tree_directories = self._filter_trees(tree)
         tree_directories = self._exclude_unimportant_trees(tree_directories)
         next_trees = self._select_random_trees(tree_directories, split)
+        tree.release()      # Everything needed from it is in self.files and next_trees now
         for _tree in next_trees:
             self._deep_walk(_tree, split)
 
@@ -0,0 +1,124 @@
+from concurrent.futures import Executor
+from dataclasses import dataclass, replace
+from datetime import date, timedelta
+from math import sqrt
+from typing import Callable, Iterator, List, Tuple, Union
+import logging
+import re
+
+from templatecrawler import metrics
+
+log = logging.getLogger(__name__)
+
+search_cap = 1000                   # GitHub returns at most this many results per search query, no matter the paging
+github_start = date(2007, 10, 1)    # Nothing was created before
+
+
+@dataclass(frozen=True)
+class Shard:
+    """ A part of the query space of a repository search: a range of creation dates, stars and sizes (KiB).
+    Shards made by split() don't overlap, so together they find every repository exactly once.
+    """
+    language: str
+    created: Tuple[date, date]
+    stars: Tuple[int, int] = (0, 10 ** 6)
+    size: Tuple[int, int] = (0, 10 ** 8)
+    total: int = None               # Number of results, once counted
+    truncated: bool = False         # Has more results than the cap, but can't be split any further
+
+    @property
+    def query(self) -> str:
+        return f'language:{self.language} created:{self.created[0].isoformat()}..{self.created[1].isoformat()} ' \
+               f'stars:{self.stars[0]}..{self.stars[1]} size:{self.size[0]}..{self.size[1]}'
+
+    @classmethod
+    def from_query(cls, query: str, total: int = None, truncated: bool = False) -> 'Shard':
+        """ The shard whose query this is, the inverse of Shard.query """
+        match = _query_re.fullmatch(query)
+        if match is None:
+            raise ValueError(f'Not the query of a shard: {query}')
+        return cls(match['language'], created=(date.fromisoformat(match['created_from']),
+                                               date.fromisoformat(match['created_until'])),
+                   stars=(int(match['stars_from']), int(match['stars_until'])),
+                   size=(int(match['size_from']), int(match['size_until'])), total=total, truncated=truncated)
+
+    def split(self) -> Union[Tuple['Shard', 'Shard'], None]:
+        """ Halves the shard, by creation date until it is a single day, then by stars, then by size.
+
+        :return: The two halves or None if the shard is as small as it gets
+        """
+        first, last = self.created
+        if first < last:
+            middle = first + (last - first) // 2
+            return (replace(self, created=(first, middle), total=None),
+                    replace(self, created=(middle + timedelta(days=1), last), total=None))
+        for field in ('stars', 'size'):
+            low, high = getattr(self, field)
+            if low < high:
+                middle = _split_point(low, high)
+                return replace(self, total=None, **{field: (low, middle)}), \
+                    replace(self, total=None, **{field: (middle + 1, high)})
+        return None
+
+
+_query_re = re.compile(r'language:(?P<language>\S+) created:(?P<created_from>[\d-]+)\.\.(?P<created_until>[\d-]+) '
+                       r'stars:(?P<stars_from>\d+)\.\.(?P<stars_until>\d+) size:(?P<size_from>\d+)\.\.(?P<size_until>\d+)')
+
+
+def _split_point(low: int, high: int) -> int:
+    # Geometric instead of arithmetic middle, most repositories are small and have few stars
+    middle = int(sqrt((low + 1) * (high + 1))) - 1
+    return min(max(middle, low), high - 1)
+
+
+def root_shard(language: str, until: date = None) -> Shard:
+    """ The whole query space of a language """
+    return Shard(language, created=(github_start, until or date.today()))
+
+
+class SearchPlanner:
+    """ Splits a shard until every part has at most <cap> results and can be paged through completely.
+    Each level of the split is counted concurrently if an executor is given.
+
+    :param count: Returns the number of results of a search query, e.g. GitHubCrawlerCalls.count_repos
+    """
+
+    def __init__(self, count: Callable[[str], int], cap: int = search_cap, executor: Executor = None):
+        self._count = count
+        self.cap = cap
+        self._executor = executor
+
+    def plan(self, root: Shard) -> Iterator[Shard]:
+        """ :return: Generator of counted shards, empty ones are left out """
+        level = [root]
+        while level:
+            counts = self._count_all([x.query for x in level])
+            metrics.increment('search_plan_queries_total', len(level))
+            next_level = []
+            for shard, total in zip(level, counts):
+                for part in self.expand(shard, total):
+                    if part.total is None:
+                        next_level.append(part)
+                    else:
+                        yield part
+            level = next_level
+
+    def expand(self, shard: Shard, total: int) -> List[Shard]:
+        """ What a shard with <total> results turns into: nothing if it is empty, itself with its total if it can be
+        paged through completely (or can't be split any further), otherwise its two halves, which aren't counted yet.
+        """
+        if total == 0:
+            return []
+        if total <= self.cap:
+            return [replace(shard, total=total)]
+        halves = shard.split()
+        if halves is None:
+            log.warning(f'Shard <{shard.query}> has {total} results, only {self.cap} of them can be fetched')
+            metrics.increment('search_truncated_shards_total')
+            return [replace(shard, total=total, truncated=True)]
+        return list(halves)
+
+    def _count_all(self, queries: List[str]) -> List[int]:
+        if self._executor is None:
+            return [self._count(x) for x in queries]
+        return list(self._executor.map(self._count, queries))
@@ -1,8 +1,83 @@
+from typing import Union
+import threading
+import time
 import requests
 
+from templatecrawler import metrics
+
+
+class RateLimited(ValueError):
+    """ GitHub refused a request because of its primary or secondary rate limit. It is a ValueError like every other
+    failed request, <retry_after> tells how many seconds to wait before the next one.
+    """
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def rate_limit(response: requests.Response) -> Union[RateLimited, None]:
+    """ :return: The error to raise if the response is a rate limit, otherwise None """
+    headers = response.headers
+    if response.status_code == 200:
+        # GraphQL reports an exhausted primary rate limit as an error of the query
+        errors = response.json().get('errors') or []
+        if not any(x.get('type') == 'RATE_LIMITED' for x in errors):
+            return None
+    elif response.status_code not in (403, 429):
+        return None
+    if 'Retry-After' in headers:
+        wait = float(headers['Retry-After'])
+    elif headers.get('X-RateLimit-Remaining') == '0':
+        wait = max(float(headers.get('X-RateLimit-Reset', 0)) - time.time(), 0) + 1
+    elif response.status_code == 429 or 'rate limit' in response.text.lower():
+        wait = 60.0         # Secondary rate limits come without a time, GitHub asks to wait at least a minute
+    else:
+        return None
+    return RateLimited(f'Rate limited ({response.status_code}), retry after {wait:.0f}s', wait)
+
+
+class Backoff:
+    """ Shared by concurrent requests: once one of them is rate limited, all of them wait. Every further limit in a
+    row doubles the wait, like GitHub asks for it with secondary rate limits.
+    """
+
+    def __init__(self):
+        self._until = 0.0
+        self._strikes = 0
+        self._lock = threading.Lock()
+
+    @property
+    def remaining(self) -> float:
+        """ Seconds until requests may continue """
+        return max(self._until - time.monotonic(), 0.0)
+
+    def limited(self, error: RateLimited) -> float:
+        """ :return: Seconds until requests may continue """
+        with self._lock:
+            self._until = max(self._until, time.monotonic() + error.retry_after * 2 ** self._strikes)
+            self._strikes += 1
+        return self.remaining
+
+    def succeeded(self):
+        self._strikes = 0
+
+    def wait(self, max_wait: float = None) -> bool:
+        """ Waits until requests may continue
+
+        :return: False right away if that takes longer than <max_wait> seconds
+        """
+        remaining = self.remaining
+        if max_wait is not None and remaining > max_wait:
+            return False
+        if remaining > 0:
+            time.sleep(remaining)
+        return True
+
 
 class Communicator:
     _api_endpoint = 'https://api.github.com/graphql'
+    _rest_endpoint = 'https://api.github.com'
 
     def __init__(self, use_session=True):
         self._session = False
@@ -10,11 +85,19 @@ class Communicator:
             self._session = requests.Session()
 
     def send_and_receive(self, header: dict, post_data: dict):
+        start = time.perf_counter()
         if self._session:
             response = self._session.post(self._api_endpoint, data=post_data, headers=header)
         else:
             response = requests.post(self._api_endpoint, data=post_data, headers=header)
+        metrics.observe('api_call_seconds', time.perf_counter() - start)
+        metrics.increment('api_calls_total', status=response.status_code)
+        metrics.increment('api_bytes_received_total', len(response.content))
 
+        limited = rate_limit(response)
+        if limited is not None:
+            metrics.increment('api_rate_limited_total')
+            raise limited
         if response.status_code != 200:
             print(f'Error {response.status_code}: {response.reason}')
             print(response.text)
@@ -24,6 +107,28 @@ class Communicator:
         else:
             return response
 
+    def get(self, path: str, header: dict):
+        """ GET on the REST API, which unlike GraphQL supports conditional requests (If-None-Match). A 304 Not
+        Modified doesn't count against the rate limit.
+
+        :return: The response for 200 and 304, None otherwise
+        """
+        start = time.perf_counter()
+        url = self._rest_endpoint + path
+        if self._session:
+            response = self._session.get(url, headers=header)
+        else:
+            response = requests.get(url, headers=header)
+        metrics.observe('api_call_seconds', time.perf_counter() - start)
+        metrics.increment('api_calls_total', status=response.status_code)
+        metrics.increment('api_bytes_received_total', len(response.content))
+
+        if response.status_code not in (200, 304):
+            print(f'Error {response.status_code}: {response.reason}')
+            print(response.text)
+            return None
+        return response
+
     def close_session(self):
         if self._session:
             self._session.close()
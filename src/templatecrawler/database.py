@@ -0,0 +1,446 @@
+from contextlib import contextmanager
+from datetime import datetime
+import os
+import socket
+import threading
+import time
+from typing import Callable, List, Tuple, Union, Iterable
+import math
+import logging
+import pandas as pd
+from psycopg2.extras import execute_values
+
+from templatecrawler.bloom import BloomFilter
+from templatecrawler.dedup import digest
+from templatecrawler import metrics
+
+log = logging.getLogger(__name__)
+
+template_columns = ['template', 'arguments', 'raw', 'repo_id', 'parsed_template', 'crawl_date']
+repository_columns = ['name', 'owner', 'url', 'stars', 'is_fork', 'disk_usage', 'license', 'cursor', 'languages']
+
+
+# Also takes nested empty lists into account
+# Taken from https://stackoverflow.com/a/1605679/7307284
+def is_list_empty(li: List):
+    if isinstance(li, list):  # Is a list
+        return all(map(is_list_empty, li))
+    return False                  # Not a list
+
+
+def claim_repositories(conn, count: int = 1, lease: int = 3600, worker: str = None) -> pd.DataFrame:
+    """ Selects and locks up to <count> unprocessed repositories in one statement. Rows which are locked by the
+    transaction of another worker are skipped instead of waited for, so several workers can share the queue.
+    A lock older than <lease> seconds belongs to a crashed worker and is claimed again.
+
+    :param conn: psycopg2 connection
+    :param count: Maximum number of repositories to claim
+    :param lease: Seconds until the claim expires, unless it is renewed with renew_leases()
+    :param worker: Name of the claiming worker, defaults to host:pid
+    :return: The claimed repositories (may be empty)
+    """
+    cur = conn.cursor()
+    cur.execute("""UPDATE repositories SET locked = TRUE, locked_at = now(), locked_by = %s WHERE repo_id IN (
+                       SELECT repo_id FROM repositories
+                       WHERE processed = FALSE
+                         AND (locked = FALSE OR locked_at IS NULL OR locked_at < now() - %s * interval '1 second')
+                       ORDER BY repo_id LIMIT %s FOR UPDATE SKIP LOCKED)
+                   RETURNING *""", [worker or worker_name(), lease, count])
+    rows = cur.fetchall()
+    columns = [column.name for column in cur.description]
+    conn.commit()
+    cur.close()
+    return pd.DataFrame(rows, columns=columns)
+
+
+def renew_leases(conn, repo_ids: List[int], worker: str = None) -> int:
+    """ Extends the claims on repositories which are still being processed.
+
+    :return: Number of renewed leases. Less than len(repo_ids) means another worker took over some repositories.
+    """
+    if not repo_ids:
+        return 0
+    cur = conn.cursor()
+    cur.execute("""UPDATE repositories SET locked_at = now()
+                   WHERE repo_id = ANY(%s) AND locked = TRUE AND locked_by = %s""",
+                [[int(x) for x in repo_ids], worker or worker_name()])
+    renewed = cur.rowcount
+    conn.commit()
+    cur.close()
+    return renewed
+
+
+def owned_repositories(conn, repo_ids: List[int], worker: str = None) -> List[int]:
+    """ :return: Those of <repo_ids> which are still locked by <worker> """
+    if not repo_ids:
+        return []
+    cur = conn.cursor()
+    cur.execute("""SELECT repo_id FROM repositories WHERE repo_id = ANY(%s) AND locked = TRUE AND locked_by = %s""",
+                [[int(x) for x in repo_ids], worker or worker_name()])
+    owned = [repo_id for repo_id, in cur.fetchall()]
+    conn.commit()
+    cur.close()
+    return owned
+
+
+def release_repositories(conn, repo_ids: List[int]):
+    """ Gives repositories back to the queue without marking them as processed. """
+    if not repo_ids:
+        return
+    cur = conn.cursor()
+    cur.execute("""UPDATE repositories SET locked = FALSE, locked_at = NULL, locked_by = NULL
+                   WHERE repo_id = ANY(%s)""", [[int(x) for x in repo_ids]])
+    conn.commit()
+    cur.close()
+
+
+def finish_repositories(conn, results: List[Tuple[int, bool, Union[str, None]]], worker: str = None) -> int:
+    """ Marks repositories as processed and releases their locks. Only repositories still locked by <worker> are
+    updated, one whose lease expired and which was claimed by another worker in the meantime is left alone.
+
+    :param conn: psycopg2 connection
+    :param results: Tuples of (repo_id, successfully_processed, framework). A framework of None keeps the old value.
+    :param worker: Name of the claiming worker, defaults to host:pid
+    :return: Number of updated repositories. Less than len(results) means some were taken over by another worker.
+    """
+    if not results:
+        return 0
+    worker = worker or worker_name()
+    cur = conn.cursor()
+    updated = execute_values(cur=cur, sql="""UPDATE repositories SET processed = TRUE, locked = FALSE,
+                                             locked_at = NULL, locked_by = NULL,
+                                             successfully_processed = data.success,
+                                             framework = COALESCE(data.framework, repositories.framework)
+                                             FROM (VALUES %s) AS data(repo_id, success, framework, worker)
+                                             WHERE repositories.repo_id = data.repo_id
+                                               AND repositories.locked = TRUE
+                                               AND repositories.locked_by = data.worker
+                                             RETURNING repositories.repo_id""",
+                             argslist=[(int(repo_id), success, framework, worker)
+                                       for repo_id, success, framework in results],
+                             page_size=len(results), fetch=True)
+    conn.commit()
+    cur.close()
+    return len(updated)
+
+
+@contextmanager
+def keep_leases(connect: Callable, repo_ids: List[int], worker: str = None, interval: float = 1800):
+    """ Renews the leases on <repo_ids> every <interval> seconds in a background thread while the block runs.
+
+    :param connect: Returns a new psycopg2 connection, the thread uses its own one
+    """
+    stop = threading.Event()
+
+    def renew():
+        conn = connect()
+        try:
+            while not stop.wait(interval):
+                renewed = renew_leases(conn, repo_ids, worker=worker)
+                if renewed < len(repo_ids):
+                    log.warning(f'Lost the lease on {len(repo_ids) - renewed} of the repositories {list(repo_ids)}')
+        finally:
+            conn.close()
+
+    thread = threading.Thread(target=renew, name='lease-keeper', daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+def write_repositories(conn, data: pd.DataFrame, min_disk_usage: int = 512000) -> Tuple[int, int]:
+    """ Writes search results into the repositories table, the ones smaller than <min_disk_usage> into
+    discarded_repositories. Repositories which are already known are skipped by the database.
+
+    :param conn: psycopg2 connection
+    :param data: Needs all of repository_columns
+    :return: Number of (accepted, rejected) rows which were new
+    """
+    assert all([x in data.columns for x in repository_columns])
+    df = data[repository_columns]
+    accepted = df['disk_usage'] >= min_disk_usage
+    inserted = copy_rows(conn, 'repositories', repository_columns, df.loc[accepted].itertuples(index=False, name=None))
+    discarded = copy_rows(conn, 'discarded_repositories', repository_columns,
+                          df.loc[~accepted].itertuples(index=False, name=None))
+    metrics.increment('search_repositories_total', inserted, result='accepted')
+    metrics.increment('search_repositories_total', discarded, result='rejected')
+    return inserted, discarded
+
+
+def start_search_plan(conn, language: str, root_query: str):
+    """ Starts planning the shards of a language over, from the one shard covering all of it. The shards of the
+    language which weren't paged through completely are deleted in the same transaction, the new plan (e.g. with a
+    later end date) would overlap them. Completed shards stay, the new plan starts them over if it plans them again.
+    """
+    cur = conn.cursor()
+    cur.execute("""DELETE FROM search_shards WHERE language = %s AND done = FALSE""", [language])
+    _upsert_search_shards(cur, [(language, root_query, None, False)])
+    conn.commit()
+    cur.close()
+
+
+def save_search_shards(conn, language: str, shards: Iterable[Tuple[str, Union[int, None], bool]],
+                       replaces: Iterable[int] = ()) -> int:
+    """ Stores shards of a plan. A shard which was planned before starts over.
+
+    :param conn: psycopg2 connection
+    :param shards: Tuples of (query, total, truncated), the total is None if the shard still has to be counted
+    :param replaces: (optional) IDs of shards these take the place of, e.g. a shard split into halves. They are
+                     deleted in the same transaction.
+    :return: Number of stored shards
+    """
+    rows = [(language, query, total, truncated) for query, total, truncated in shards]
+    replaces = list(replaces)
+    cur = conn.cursor()
+    if replaces:
+        cur.execute("""DELETE FROM search_shards WHERE shard_id = ANY(%s)""", [replaces])
+    if rows:
+        _upsert_search_shards(cur, rows)
+    conn.commit()
+    cur.close()
+    return len(rows)
+
+
+def _upsert_search_shards(cur, rows: List[Tuple[str, str, Union[int, None], bool]]):
+    execute_values(cur=cur, sql="""INSERT INTO search_shards (language, query, total, truncated) VALUES %s
+                                   ON CONFLICT (query) DO UPDATE SET total = EXCLUDED.total,
+                                   truncated = EXCLUDED.truncated, cursor = NULL, fetched = 0, done = FALSE,
+                                   planned_at = now(), updated_at = NULL""", argslist=rows)
+
+
+def unplanned_search_shards(conn, language: str, limit: int = None) -> List[Tuple[int, str]]:
+    """ :return: Tuples of (shard_id, query) of the shards which still have to be counted, at most <limit> """
+    cur = conn.cursor()
+    cur.execute("""SELECT shard_id, query FROM search_shards WHERE language = %s AND done = FALSE AND total IS NULL
+                   ORDER BY shard_id LIMIT %s""", [language, limit])
+    rows = cur.fetchall()
+    conn.commit()
+    cur.close()
+    return rows
+
+
+def pending_search_shards(conn, language: str) -> List[Tuple[int, str, Union[str, None], int]]:
+    """ :return: Tuples of (shard_id, query, cursor, fetched) of the counted shards which weren't paged through yet """
+    cur = conn.cursor()
+    cur.execute("""SELECT shard_id, query, cursor, fetched FROM search_shards
+                   WHERE language = %s AND done = FALSE AND total IS NOT NULL ORDER BY shard_id""", [language])
+    rows = cur.fetchall()
+    conn.commit()
+    cur.close()
+    return rows
+
+
+def checkpoint_search_shard(conn, shard_id: int, cursor: Union[str, None], fetched: int, done: bool):
+    """ Remembers the cursor of the last page which was written, a later run continues after it """
+    cur = conn.cursor()
+    cur.execute("""UPDATE search_shards SET cursor = %s, fetched = %s, done = %s, updated_at = now()
+                   WHERE shard_id = %s""", [cursor, fetched, done, shard_id])
+    conn.commit()
+    cur.close()
+
+
+def worker_name() -> str:
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def count_discarded(conn) -> int:
+    cur = conn.cursor()
+    cur.execute("""SELECT count(*) FROM discarded_templates""")
+    count, = cur.fetchone()
+    conn.commit()
+    cur.close()
+    return count
+
+
+def load_discarded_filter(conn, error_rate: float = 0.001) -> BloomFilter:
+    """ Loads the digests of all discarded templates into a Bloom filter. Afterwards only the templates the filter
+    can't rule out have to be checked against the database. Templates discarded later are not in the filter, load it
+    again once count_discarded() changed.
+    """
+    count = count_discarded(conn)
+
+    bloom = BloomFilter(capacity=2 * count, error_rate=error_rate)
+    cur = conn.cursor(name='discarded_templates_filter')      # Server side cursor, the table is streamed
+    cur.itersize = 10000
+    cur.execute("""SELECT template_digest, parsed_template_digest FROM discarded_templates""")
+    for template_digest, parsed_template_digest in cur:
+        bloom.update(bytes(x) for x in (template_digest, parsed_template_digest) if x is not None)
+    cur.close()
+    conn.commit()
+    log.info(f'Loaded {count} discarded templates into a Bloom filter')
+    return bloom
+
+
+def find_discarded(conn, data: pd.DataFrame, discarded: BloomFilter = None) -> pd.Series:
+    """ Checks which templates are in the discarded_templates table, either by template or by parsed_template.
+    All candidates are shipped as digests in one VALUES list and matched in a single query.
+
+    :param conn: psycopg2 connection
+    :param data: Needs the columns 'template' and 'parsed_template'
+    :param discarded: (optional) Bloom filter from load_discarded_filter(). Rows it rules out are not sent at all.
+    :return: Boolean mask aligned with data, True if the row is discarded
+    """
+    mask = pd.Series(False, index=data.index)
+    # Positions instead of index labels, so duplicated labels from concatenated repositories don't matter
+    digests = [(digest(t), digest(p)) for t, p in zip(data['template'], data['parsed_template'])]
+    records = [(i, t, p) for i, (t, p) in enumerate(digests) if discarded is None or t in discarded or p in discarded]
+    if not records:
+        return mask
+
+    cur = conn.cursor()
+    query = """SELECT data.pos FROM (VALUES %s) AS data(pos, template_digest, parsed_template_digest)
+               WHERE EXISTS (SELECT 1 FROM discarded_templates d WHERE d.template_digest = data.template_digest)
+                  OR EXISTS (SELECT 1 FROM discarded_templates d
+                             WHERE d.parsed_template_digest = data.parsed_template_digest)"""
+    result = execute_values(cur=cur, sql=query, argslist=records, page_size=len(records), fetch=True)
+    cur.close()
+    conn.commit()
+    mask.iloc[[pos for pos, in result]] = True
+    return mask
+
+
+def write_templates(conn, data: pd.DataFrame, discarded: BloomFilter = None, method: str = 'copy') -> pd.DataFrame:
+    """ Writes formalized templates into the templates table. Empty and discarded templates are left out, duplicates
+    are rejected by the database.
+
+    :param conn: psycopg2 connection
+    :param data: Templates, needs all of template_columns except 'crawl_date'
+    :param discarded: (optional) Bloom filter of discarded templates, see load_discarded_filter()
+    :param method: 'copy' streams all rows through copy_rows(), 'values' uses two execute_values passes
+    :return: The rows sent to the database, without the empty and discarded ones. Afterwards every one of them is in
+             the table, either inserted or rejected as a duplicate of a row that already was.
+    """
+    data = data.copy()
+    data['crawl_date'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    columns = list(template_columns)
+    assert all([x in data.columns for x in columns])
+
+    df = data[columns]  # filter to the relevant columns
+    metrics.increment('database_rows_total', len(df))
+
+    # Check for empty entries
+    mask = df['template'].apply(len) <= 0
+    mask |= df['parsed_template'].apply(len) <= 0
+
+    filter_count = int(mask.sum())
+    metrics.increment('database_rows_dropped_total', filter_count, reason='empty')
+    if filter_count > 0:
+        log.info(f"Checked input data for empty entries in columns [template, parsed_template]"
+                 f"Discarding {filter_count} entries ({len(df)}-->{len(df) - filter_count})")
+        df = df.loc[~mask]
+
+    # First check if entries are in the discarded table:
+    with metrics.timer('database_lookup_seconds'):
+        mask = find_discarded(conn, df, discarded=discarded)
+    filter_count = int(mask.sum())
+    metrics.increment('database_rows_dropped_total', filter_count, reason='discarded')
+    if filter_count > 0:
+        log.info(f"Checked existing, but discarded templates. "
+                 f"Discarding {filter_count} entries ({len(df)}-->{len(df) - filter_count})")
+        df = df.loc[~mask]
+
+    sent = df
+    if method == 'copy':
+        # Empty argument lists are stored as NULL, just like the rows written without an 'arguments' column below
+        df = df.assign(arguments=[None if is_list_empty(x) else x for x in df['arguments']])
+        with metrics.timer('database_write_seconds', method=method):
+            written = copy_rows(conn, 'templates', columns, df.itertuples(index=False, name=None))
+        metrics.increment('database_rows_inserted_total', written)
+        log.info(f'Copied {len(df)} entries, {written} of them were new')
+        return sent
+
+    # Here we have to split the query into ones with arguments and one without arguments
+    emptiness_mask = df['arguments'].apply(is_list_empty).astype(bool)
+    df_args = df.loc[~emptiness_mask]
+    df_no_args = df.loc[emptiness_mask].drop('arguments', axis=1)        # Also drop the column 'arguments' completely
+    records_args = df_args.to_records(index=False).tolist()
+    records_no_args = df_no_args.to_records(index=False).tolist()
+
+    start = time.perf_counter()
+    cur = conn.cursor()
+    query = cur.mogrify(f"""INSERT INTO templates ({','.join(columns)}) VALUES %s ON CONFLICT DO NOTHING""")
+    execute_values(cur=cur, sql=query, argslist=records_args)
+    conn.commit()
+
+    columns.remove('arguments')
+    query = cur.mogrify(f"""INSERT INTO templates ({','.join(columns)}) VALUES %s ON CONFLICT DO NOTHING""")
+    execute_values(cur=cur, sql=query, argslist=records_no_args)
+    conn.commit()
+    cur.close()
+    metrics.observe('database_write_seconds', time.perf_counter() - start, method=method)
+
+    log.info(f'Wrote {len(records_args)} entries with arguments and {len(records_no_args)} entries with NO arguments')
+    return sent
+
+
+_copy_escapes = str.maketrans({'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r'})
+
+
+def _array_literal(values: Iterable) -> str:
+    elements = []
+    for value in values:
+        if value is None:
+            elements.append('NULL')
+        elif isinstance(value, (list, tuple)):
+            elements.append(_array_literal(value))      # Multidimensional, like psycopg2 adapts nested lists
+        else:
+            elements.append('"' + str(value).replace('\\', '\\\\').replace('"', '\\"') + '"')
+    return '{' + ','.join(elements) + '}'
+
+
+def _copy_value(value) -> str:
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return '\\N'
+    if isinstance(value, (list, tuple)):
+        value = _array_literal(value)
+    return str(value).translate(_copy_escapes)
+
+
+class _CopyStream:
+    """ File-like object which renders rows in COPY text format only when psycopg2 asks for the next block. """
+
+    def __init__(self, rows: Iterable[tuple]):
+        self._lines = ('\t'.join(_copy_value(value) for value in row) + '\n' for row in rows)
+        self._rest = ''
+
+    def read(self, size: int = -1) -> str:
+        chunks = [self._rest]
+        length = len(self._rest)
+        while size < 0 or length < size:
+            line = next(self._lines, None)
+            if line is None:
+                break
+            chunks.append(line)
+            length += len(line)
+        data = ''.join(chunks)
+        if 0 <= size < len(data):
+            data, self._rest = data[:size], data[size:]
+        else:
+            self._rest = ''
+        return data
+
+
+def copy_rows(conn, table: str, columns: List[str], rows: Iterable[tuple]) -> int:
+    """ Streams rows with COPY ... FROM STDIN into a temporary staging table and merges them into <table> with one
+    INSERT ... SELECT ... ON CONFLICT DO NOTHING. Lists are written as arrays, None as NULL.
+
+    :param conn: psycopg2 connection
+    :param table: Target table
+    :param columns: Target columns, in the order of the values in each row
+    :param rows: Iterable of tuples, consumed lazily
+    :return: Number of rows which were actually inserted
+    """
+    column_list = ','.join(columns)
+    staging = f'{table}_staging'
+    cur = conn.cursor()
+    # Takes over the column types of the target table, but none of its constraints or defaults
+    cur.execute(f"""CREATE TEMP TABLE {staging} ON COMMIT DROP AS SELECT {column_list} FROM {table} WITH NO DATA""")
+    cur.copy_expert(f"""COPY {staging} ({column_list}) FROM STDIN WITH (FORMAT text)""", _CopyStream(rows))
+    cur.execute(f"""INSERT INTO {table} ({column_list}) SELECT {column_list} FROM {staging} ON CONFLICT DO NOTHING""")
+    inserted = cur.rowcount
+    conn.commit()
+    cur.close()
+    return inserted
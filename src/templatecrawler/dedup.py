@@ -0,0 +1,127 @@
+from hashlib import sha256
+from pathlib import Path
+from typing import Dict, Union, Set
+import logging
+import struct
+import pandas as pd
+from filelock import FileLock
+
+log = logging.getLogger(__name__)
+
+# SHA-256 because Postgres can compute the same digest itself: sha256(convert_to(template, 'UTF8'))
+digest_size = 32
+
+
+def digest(value: str) -> bytes:
+    return sha256(value.encode('utf-8', errors='surrogatepass')).digest()
+
+
+def drop_batch_duplicates(data: pd.DataFrame, seen: Dict[str, Set[bytes]] = None) -> pd.DataFrame:
+    """ Removes rows whose template or parsed_template already appeared in an earlier row of the same batch.
+    Both columns are unique in the templates table, so such rows would be rejected anyway.
+
+    :param seen: (optional) Column --> digests of earlier batches. Rows found in there are removed as well and the
+                 digests of the kept rows are added, so a batch can be deduplicated chunk by chunk.
+    """
+    if len(data) == 0:
+        return data
+    template_digests = data['template'].map(digest)
+    parsed_digests = data['parsed_template'].map(digest)
+    mask = template_digests.duplicated() | parsed_digests.duplicated()
+    if seen is not None:
+        seen_templates = seen.setdefault('template', set())
+        seen_parsed = seen.setdefault('parsed_template', set())
+        mask |= template_digests.map(seen_templates.__contains__) | parsed_digests.map(seen_parsed.__contains__)
+        seen_templates.update(template_digests[~mask])
+        seen_parsed.update(parsed_digests[~mask])
+    return data.loc[~mask.values]
+
+
+class TemplateDeduplicator:
+    """ Keeps the digests of all templates in the database in memory, so templates which already exist are not
+    sent at all. The digest set is synced incrementally by template_id and can be cached in a local file.
+    """
+
+    def __init__(self, cache_path: Union[str, Path] = None):
+        self.cache_path = Path(cache_path) if cache_path else None
+        self.last_id = 0
+        self._templates = set()            # type: Set[bytes]
+        self._parsed_templates = set()     # type: Set[bytes]
+        if self.cache_path and self.cache_path.exists():
+            self.load()
+
+    def __len__(self):
+        return len(self._templates)
+
+    def sync(self, conn) -> int:
+        """ Fetches the templates written since the last sync. Rows which are committed late with a lower template_id
+        are missed, the unique constraints of the table still catch those.
+
+        :return: Number of new templates
+        """
+        cur = conn.cursor(name='template_digest_sync')      # Server side cursor, the table may be huge
+        cur.itersize = 10000
+        # Only the digest columns are transferred, see postgres/migrations/002_template_digests.sql
+        cur.execute("""SELECT template_id, template_digest, parsed_template_digest FROM templates
+                       WHERE template_id > %s ORDER BY template_id""", [self.last_id])
+        count = 0
+        for template_id, template_digest, parsed_template_digest in cur:
+            if template_digest is not None:
+                self._templates.add(bytes(template_digest))
+            if parsed_template_digest is not None:
+                self._parsed_templates.add(bytes(parsed_template_digest))
+            self.last_id = template_id
+            count += 1
+        cur.close()
+        conn.commit()
+        log.info(f'Synced {count} new template digests, {len(self)} known in total')
+        return count
+
+    def drop_duplicates(self, data: pd.DataFrame) -> pd.DataFrame:
+        """ Removes batch internal duplicates and all templates which are already known. """
+        data = drop_batch_duplicates(data)
+        if len(data) == 0:
+            return data
+        known = [digest(t) in self._templates or (p is not None and digest(p) in self._parsed_templates)
+                 for t, p in zip(data['template'], data['parsed_template'])]
+        known_count = sum(known)
+        if known_count > 0:
+            log.info(f'Dropping {known_count} templates which are already in the database '
+                     f'({len(data)}-->{len(data) - known_count})')
+        return data.loc[[not x for x in known]]
+
+    def add(self, data: pd.DataFrame):
+        """ Remembers templates which were just written, so the next batch doesn't need a sync to know them. """
+        for template, parsed_template in zip(data['template'], data['parsed_template']):
+            self._add(template, parsed_template)
+
+    def _add(self, template: str, parsed_template: str):
+        if template is not None:
+            self._templates.add(digest(template))
+        if parsed_template is not None:
+            self._parsed_templates.add(digest(parsed_template))
+
+    # Cache file layout: last_id, number of template digests, number of parsed digests, then both digest lists
+    _header = struct.Struct('<qqq')
+
+    def save(self):
+        if not self.cache_path:
+            return
+        self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+        with FileLock(f'{self.cache_path}.lock'):
+            with open(self.cache_path, 'wb') as fd:
+                fd.write(self._header.pack(self.last_id, len(self._templates), len(self._parsed_templates)))
+                fd.write(b''.join(self._templates))
+                fd.write(b''.join(self._parsed_templates))
+
+    def load(self):
+        with FileLock(f'{self.cache_path}.lock'):
+            with open(self.cache_path, 'rb') as fd:
+                data = fd.read()
+        self.last_id, template_count, parsed_count = self._header.unpack_from(data)
+        offset = self._header.size
+        self._templates = {data[offset + i * digest_size:offset + (i + 1) * digest_size]
+                           for i in range(template_count)}
+        offset += template_count * digest_size
+        self._parsed_templates = {data[offset + i * digest_size:offset + (i + 1) * digest_size]
+                                  for i in range(parsed_count)}
@@ -1,7 +1,6 @@
 from typing import List
 
-from templatecrawler.logdetector import python, csharp
-from templatecrawler.logdetector import java
+from templatecrawler import lazy, metrics
 
 
 class LogDetector:
@@ -10,14 +9,15 @@ class LogDetector:
     PYTHON = 'python'
     CSHARP = 'csharp'
 
-    _engine_selector = {'java': java.DetectorEngine,
-                        'c': java.DetectorEngine,
-                        'python': python.DetectorEngine,
-                        'csharp': csharp.DetectorEngine}
+    # Engines are imported on first use, see lazy.load()
+    _engine_selector = {'java': 'templatecrawler.logdetector.java:DetectorEngine',
+                        'c': 'templatecrawler.logdetector.java:DetectorEngine',
+                        'python': 'templatecrawler.logdetector.python:DetectorEngine',
+                        'csharp': 'templatecrawler.logdetector.csharp:DetectorEngine'}
 
     def __init__(self, language: str):
         self.language = language
-        self._engine = self._engine_selector[language]()
+        self._engine = lazy.load(self._engine_selector[language])()
 
     def from_files(self, files: List[str]):
         result = [self._engine.process_file(x) for x in files]
@@ -33,6 +33,8 @@ class LogDetector:
     def framework(self, files: List[str]):
         framework_indicators = [self._engine.detect_framework(x) for x in files]
         framework_indicators = list(filter(None, framework_indicators))
+        metrics.increment('detector_files_total', len(files))
+        metrics.increment('detector_indicators_total', len(framework_indicators))
         if not framework_indicators:
             return 'unknown'
         else:
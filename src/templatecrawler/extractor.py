@@ -1,9 +1,7 @@
 from typing import List
 
-from templatecrawler.logextractor.java.log4j import log4jExtractor
-from templatecrawler.logextractor.java.slf4j import slf4jExtractor
-from templatecrawler.logextractor.java.utillogger import utilloggerExtractor
-from templatecrawler.logextractor.c.c import CExtractor
+from templatecrawler import lazy
+from templatecrawler.budget import Budget
 
 
 class LogExtractor:
@@ -12,22 +10,23 @@ class LogExtractor:
     PYTHON = 'python'
     CSHARP = 'csharp',
 
+    # Engines are imported on first use, see lazy.load()
     _java_framework_selector = {
-        'log4j': log4jExtractor,
-        'slf4j': slf4jExtractor,
-        'util': utilloggerExtractor,
-        'utillogger': utilloggerExtractor,
-        'unknown': log4jExtractor
+        'log4j': 'templatecrawler.logextractor.java.log4j:log4jExtractor',
+        'slf4j': 'templatecrawler.logextractor.java.slf4j:slf4jExtractor',
+        'util': 'templatecrawler.logextractor.java.utillogger:utilloggerExtractor',
+        'utillogger': 'templatecrawler.logextractor.java.utillogger:utilloggerExtractor',
+        'unknown': 'templatecrawler.logextractor.java.log4j:log4jExtractor'
     }
 
     # Since C doesn't support frameworks, and I just want to be sure when a mistake happens, every Java framework
     # is replicated here.
     _c_framework_selector = {
-        'log4j': CExtractor,
-        'slf4j': CExtractor,
-        'util': CExtractor,
-        'utillogger': CExtractor,
-        'unknown': CExtractor,
+        'log4j': 'templatecrawler.logextractor.c.c:CExtractor',
+        'slf4j': 'templatecrawler.logextractor.c.c:CExtractor',
+        'util': 'templatecrawler.logextractor.c.c:CExtractor',
+        'utillogger': 'templatecrawler.logextractor.c.c:CExtractor',
+        'unknown': 'templatecrawler.logextractor.c.c:CExtractor',
     }
 
     _engine_selector = {'java': _java_framework_selector,
@@ -35,10 +34,19 @@ class LogExtractor:
                         'c': _c_framework_selector,
                         'csharp': NotImplementedError}
 
-    def __init__(self, language: str, framework: str, repository: str):
+    def __init__(self, language: str, framework: str, repository: str, budget: Budget = None):
         self.language = language
-        self._engine = self._engine_selector[language][framework](repository)
+        if self._engine_selector[language] is NotImplementedError:
+            raise NotImplementedError(f'Extracting {language} ({framework}) is not supported')
+        self._engine = lazy.load(self._engine_selector[language][framework])(repository, budget=budget)
+
+    @property
+    def aborted(self):
+        return self._engine.aborted
 
     def extract(self):
         return self._engine.extract_events()
 
+    def iter_events(self):
+        return self._engine.iter_events()
+
@@ -1,116 +1,141 @@
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
-from templatecrawler.tokentypes import TokenType
-from typing import List, Tuple
+from functools import lru_cache
+from templatecrawler.tokentypes import TokenType, KeywordMatcher
+from templatecrawler import metrics
+from typing import List, Tuple, Dict
 import random
+import re
 
+# A '{' followed by everything up to the next '}', if there is one
+_brace_re = re.compile(r'\{([^}]*)(\}?)')
 
-def formalize(data: pd.DataFrame, possible_types: List[TokenType]):
-    nan_rows = data[data.iloc[:, 0].isnull()]
-    data = data.drop(nan_rows.index)
-    print(f'Cleaned {nan_rows} empty rows')
 
-    data['preformat'] = data.iloc[:, 0].apply(_parse_string)
-    data['formatter_count'] = data['preformat'].apply(_count_formatters)
-    data['param_count'] = data.iloc[:, 1].apply(len)
+def formalize(data: pd.DataFrame, possible_types: List[TokenType], processes: int = 1, mode: str = 'ranked',
+              seed: int = None) -> Dict:
+    """ Replaces the '{}' placeholders of the templates in the first column with typed placeholders, based on the
+    argument names in the second column. Only templates with as many placeholders as arguments are kept.
+
+    :param data: First column templates, second column lists of arguments
+    :param possible_types: Token types to choose from
+    :param processes: Matching is spread over this many processes in chunks if > 1
+    :param mode: 'ranked' picks the token type with the most specific keyword, 'random' picks any matching one
+    :param seed: (optional) Makes the 'random' mode reproducible, every template is seeded by itself and this value
+    :return: Dictionary of index --> formalized template
+    """
+    valid = data.iloc[:, 0].notnull()
+    print(f'Cleaned {len(data) - int(valid.sum())} empty rows')
+    data = data.loc[valid.values]
+
+    preformat = [_parse_string(x) for x in data.iloc[:, 0]]
+    formatter_count = pd.Series([_count_formatters(x) for x in preformat], index=data.index)
+    param_count = data.iloc[:, 1].str.len()
 
     #  I used to filter those without params, but that's not good anymore
     # data = data[data['param_count'] > 0]
 
-    data = data.apply(_cut_longer, axis=1)
-    mask = data.apply(lambda row: row['param_count'] == row['formatter_count'], axis=1)
-    data = data[mask]
+    # Rows with more arguments than placeholders used to get their arguments truncated, but as their param_count
+    # stayed the same they never passed the mask below. So there is nothing to truncate.
+    mask = (param_count == formatter_count).values
+    rows = [(i, inp, params) for i, inp, params, keep in zip(data.index, preformat, data.iloc[:, 1], mask) if keep]
+    metrics.increment('formalizer_templates_total', len(data))
+    metrics.increment('formalizer_placeholder_mismatches_total', len(data) - len(rows))
+
+    if mode not in ('ranked', 'random'):
+        raise ValueError(f'Unknown token assignment mode {mode}')
+    if processes > 1 and len(rows) > processes:
+        chunk_size = -(-len(rows) // processes)
+        chunks = [rows[x:x + chunk_size] for x in range(0, len(rows), chunk_size)]
+        output = {}
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            for result in executor.map(_match_rows, chunks, [possible_types] * len(chunks),
+                                       [mode] * len(chunks), [seed] * len(chunks)):
+                output.update(result)
+    else:
+        output = _match_rows(rows, possible_types, mode=mode, seed=seed)
+    # Counted here, pool processes would report into registries of their own
+    metrics.increment('formalizer_errors_total', len(rows) - len(output))
+    return output
 
+
+def _match_rows(rows: List[Tuple], tokens: List[TokenType], mode: str = 'ranked', seed: int = None) -> Dict:
+    # Unless tokens are drawn without a seed, the result only depends on template and arguments.
+    # The same log statement shows up in many places, so every combination is only matched once.
+    memo = {} if mode == 'ranked' or seed is not None else None
     output = {}
-    for i, row in data.iterrows():
+    for i, inp, params in rows:
         try:
-            tmp = _match_tokens(row['preformat'], params=row['arguments'], tokens=possible_types)
-            output[i] = tmp
+            if memo is None:
+                output[i] = _match_tokens(inp, params=params, tokens=tokens, mode=mode)
+                continue
+            key = (tuple(inp), tuple(params))
+            if key not in memo:
+                rng = random.Random(f'{seed}:{"".join(inp)}:{key[1]}') if mode == 'random' else None
+                memo[key] = _match_tokens(inp, params=params, tokens=tokens, mode=mode, rng=rng)
+            output[i] = memo[key]
         except (TypeError, ValueError) as e:
             pass
     return output
 
 
-def _cut_longer(row: pd.Series):
-    difference = row['param_count'] > row['formatter_count']
-    if 0 < difference < row['param_count']:
-        row['arguments'] = row['arguments'][:-difference]
-    return row
-
-
-def _match_tokens(inp: List, params: List[str], tokens: List[TokenType]):
+def _match_tokens(inp: List, params: List[str], tokens: List[TokenType], mode: str = 'ranked',
+                  rng: random.Random = None):
     offsets = []
     for i, token in enumerate(inp):
         if token == '{}':
             offsets.append(i)
 
+    matcher = _keyword_matcher(tuple(tokens))
     possible_tokens = {}
     for i, param in enumerate(params):
-        possible_tokens[param] = []
-        param_low = param.lower()
-        for token in tokens:
-            for feature in token.keywords:
-                if param_low.find(feature) >= 0:
-                    possible_tokens[param].append(token)
-                    break
+        possible_tokens[param] = matcher.rank(param) if mode == 'ranked' else matcher.match(param)
 
     for i, param in enumerate(params):
         if possible_tokens[param]:
-            token = random.choice(possible_tokens[param])
+            if mode == 'ranked':
+                token = possible_tokens[param][0]
+            else:
+                token = (rng or random).choice(possible_tokens[param])
             inp[offsets[i]] = f'{{{token.name}}}'
 
     return ''.join(inp)
 
 
+@lru_cache(maxsize=16)
+def _keyword_matcher(tokens: Tuple[TokenType, ...]) -> KeywordMatcher:
+    # Argument names repeat a lot (id, path, e.getMessage()), so the matcher also memoizes its results
+    return KeywordMatcher(list(tokens))
+
+
 def _count_formatters(inp: List[str]) -> int:
     return inp.count('{}')
 
 
 def _parse_string(inp: str) -> List[str]:
+    """ Splits a template into text segments and '{}' placeholders, e.g.
+            'Loaded {} of {}'  -->  ['Loaded ', '{}', ' of ', '{}']
+        Braces with content are escaped ('{name}' --> '{{name}}'), an unclosed '{' ends the template.
+    """
     output = []
-    current_tokens = ""
+    current_tokens = []
     pos = 0
-    for i in range(len(inp)):
-        if pos >= len(inp):
+    for match in _brace_re.finditer(inp):
+        current_tokens.append(inp[pos:match.start()])
+        content, closed = match.groups()
+        if not closed:
             break
-        c = inp[pos]
-        if c == '{':
-            # if inp[pos + 1] == '{':
-            #     current_tokens += inp[pos: pos + 1]
-            #     pos += 1
-            #     pass
-            if _peek(inp[pos + 1:], '}') is True:
-                if len(current_tokens) > 0:
-                    output.append(current_tokens)
-                output.append('{}')
-                pos += 2   # + 1 for normal movement and +1 for the brackets
-                current_tokens = ""
-            else:
-                offset = _read_until(inp[pos + 1:], '}')
-                if offset > 0:
-                    current_tokens += '{{' + inp[pos + 1:pos + 1 + offset] + '}}'
-                    pos += offset + 2  # for the '{{' + '}}' + 1 by default
-
+        if content:
+            current_tokens.append('{{' + content + '}}')
         else:
-            current_tokens += c
-            pos += 1
-    if len(current_tokens) > 0:
-        output.append(current_tokens)
+            segment = ''.join(current_tokens)
+            if segment:
+                output.append(segment)
+            output.append('{}')
+            current_tokens = []
+        pos = match.end()
+    else:
+        current_tokens.append(inp[pos:])
+    segment = ''.join(current_tokens)
+    if segment:
+        output.append(segment)
     return output
-
-
-def _peek(inp: str, end: str) -> bool:
-
-    # In case of End of String
-    if len(inp) == 0:
-        return False
-
-    # For the default (requested case that) the our placeholder = '{}'
-    if inp[0] == end:
-        return True
-
-
-def _read_until(inp: str, end: str) -> int:
-    for i, c in enumerate(inp):
-        if c == end:
-            return i
-    return -1
@@ -0,0 +1,54 @@
+"""
+Hand over stage outputs between pipeline tasks as Arrow IPC files instead of pushing whole DataFrames through XCom.
+Only a small reference (path and row count) is passed along, the reader memory-maps the file.
+"""
+from pathlib import Path
+from typing import Union
+import shutil
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+
+
+_suffix = '.arrow'
+
+
+def dump(data: pd.DataFrame, directory: Union[str, Path], name: str) -> dict:
+    """ Writes a stage output to <directory>/<name>.arrow
+
+    :param data: Stage output
+    :param directory: Work directory of the current run
+    :param name: Name of the stage output, e.g. 'source_lines'
+    :return: A reference which is small enough to be passed around through XCom
+    """
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    path = directory / f'{name}{_suffix}'
+    table = pa.Table.from_pandas(data, preserve_index=True)
+    feather.write_feather(table, str(path), compression='uncompressed')
+    return {'path': str(path.absolute()), 'rows': len(data)}
+
+
+def load(reference: dict) -> pd.DataFrame:
+    """ Reads a stage output written by dump(). The file is memory-mapped, so only the touched columns are paged in.
+
+    :param reference: The reference returned by dump()
+    :return: The stage output with its original index
+    """
+    table = feather.read_table(reference['path'], memory_map=True)
+    data = table.to_pandas()
+    # Arrow hands list columns back as numpy arrays, the rest of the pipeline expects plain lists
+    for field in table.schema:
+        if pa.types.is_list(field.type) and field.name in data.columns:
+            data[field.name] = pd.Series(table.column(field.name).to_pylist(), index=data.index, dtype=object)
+    return data
+
+
+def work_directory(base: Union[str, Path], run_id: str) -> Path:
+    # Run ids contain characters like ':' and '+' which are not welcome in every file system
+    safe_id = ''.join(c if c.isalnum() or c in '-_.' else '_' for c in run_id)
+    return Path(base, safe_id)
+
+
+def cleanup(directory: Union[str, Path]):
+    shutil.rmtree(directory, ignore_errors=True)
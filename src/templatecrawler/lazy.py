@@ -0,0 +1,16 @@
+from functools import lru_cache
+from importlib import import_module
+from typing import Any
+
+
+@lru_cache(maxsize=None)
+def _load(path: str) -> Any:
+    module, _, name = path.partition(':')
+    return getattr(import_module(module), name) if name else import_module(module)
+
+
+def load(path: Any) -> Any:
+    """ Imports 'package.module:name' (or just 'package.module') on first use, anything but a string is returned as
+    it is. Lets the engines and their dependencies (pandas, ...) load only when a language actually needs them.
+    """
+    return _load(path) if isinstance(path, str) else path
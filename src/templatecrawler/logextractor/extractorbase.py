@@ -1,26 +1,171 @@
 from abc import ABC, abstractmethod
-from typing import Union
+from collections import Counter
+from typing import Union, Iterator, List, NamedTuple
 from pathlib import Path
+import re
+import pandas
+
+from templatecrawler import metrics
+from templatecrawler.budget import Budget, BudgetExceeded
+from templatecrawler.logparser.strstream import Stream
+
+
+class LogEvent(NamedTuple):
+    file: str               # Path relative to the repository
+    raw: str                # The log statement
+    line: int               # Line of the first character of the statement, starting at 1
+    byte_offset: int        # Offset of the first character of the statement in the file
 
 
 class ExtractorBase(ABC):
 
-    def __init__(self, repo_path: Union[str, Path]):
+    # Set by every extractor
+    file_pattern = '*'
+    log_statement_0 = None      # type: re.Pattern
+    text_blocks = False         # '"""' opens a text block (Java 15), which spans lines
+
+    def __init__(self, repo_path: Union[str, Path], budget: Budget = None):
+        """ :param budget: (optional) Only its length is used, it bounds how far a statement is scanned """
         self._path = repo_path if isinstance(repo_path, Path) else Path(repo_path)
+        self.budget = budget or Budget()
+        self.aborted = Counter()        # Statements given up on, by the kind of budget they exceeded
         self._df = None
         self._log_statements = None
         self._log_statement_files = None
         self._stream = {}
 
+    def extract_events(self) -> pandas.DataFrame:
+        self._log_statements = []
+        self._log_statement_files = []
+        for event in self.iter_events():
+            self._log_statements.append(event.raw)
+            self._log_statement_files.append(event.file)
+        return self._build_events()
+
+    def iter_events(self) -> Iterator[LogEvent]:
+        """ Yields the log statements of the repository file by file, as soon as they are found.
+        Nothing but the current file is kept in memory.
+        """
+        last_dir = self._path.name
+
+        for _file in self._path.rglob(self.file_pattern):
+            if not _file.is_file():
+                continue
+            with open(_file, 'r') as fd:
+                strip_parents = _file.parts[_file.parts.index(last_dir) + 1:]
+                filename = '/'.join(strip_parents)
+                line_begin = -1
+                metrics.increment('extractor_files_total')
+                metrics.increment('extractor_bytes_read_total', _file.stat().st_size)
+                try:
+                    data = fd.read()
+                    # Universal newlines turned every '\r\n' into '\n', one byte less in the file than in <data>
+                    crlf = self._crlf_before(_file) if fd.newlines and '\r\n' in fd.newlines else None
+                    # Lines and byte offsets are counted incrementally from the previous statement
+                    position, line, byte_offset = 0, 1, 0
+                    search_result = [m.end() for m in re.finditer(self.log_statement_0, data)]
+                    for index_end in search_result:
+                        line_begin = self._begin_of_line(data, index_end, _file)
+                        try:
+                            line_end = self._end_of_line(data, line_begin, filename)
+                        except BudgetExceeded as e:
+                            self.aborted[e.kind] += 1
+                            metrics.increment('extractor_aborted_total', reason=e.kind)
+                            self.logger.info(f'Skipped the statement at {_file}:{line_begin} {e}')
+                            continue
+                        if line_begin < position:
+                            position, line, byte_offset = 0, 1, 0
+                        line += data.count('\n', position, line_begin)
+                        byte_offset += len(data[position:line_begin].encode(fd.encoding, errors='surrogateescape'))
+                        position = line_begin
+                        metrics.increment('extractor_events_total')
+                        yield LogEvent(filename, data[line_begin:line_end], line,
+                                       byte_offset + crlf[line - 1] if crlf else byte_offset)
+                except UnicodeDecodeError as e:
+                    name = e.__class__.__name__
+                    metrics.increment('extractor_errors_total', error=name)
+                    self.logger.info(f'A problem occured parsing {_file}:{line_begin} {name} [Reason] --> {e.reason}')
+                except ValueError as e:
+                    name = e.__class__.__name__
+                    metrics.increment('extractor_errors_total', error=name)
+                    self.logger.info(f'A problem occured parsing {_file}:{line_begin} {name} [Reason] --> {e.args}')
+
+    @staticmethod
+    def _crlf_before(path: Path) -> List[int]:
+        """ :return: Number of '\\r\\n' line endings in the file before every line, the first line at index 0 """
+        counts = [0]
+        for match in re.finditer(rb'\r\n|\r|\n', path.read_bytes()):
+            counts.append(counts[-1] + (match.group() == b'\r\n'))
+        return counts
+
     @abstractmethod
-    def extract_events(self):
+    def get_event_count(self):
         ...
 
     @abstractmethod
-    def get_event_count(self):
+    def _build_events(self):
         ...
 
     @abstractmethod
-    def save(self, path: Union[str, Path], repo_name: str, repo_url: str):
+    def _begin_of_line(self, data: str, index: int, filename: str = 'unknown') -> int:
         ...
 
+    def _end_of_line(self, data: str, offset: int, file_id: str) -> Union[int, None]:
+        """ Finds the ';' which ends the statement starting at <offset>, ';' in string and character literals don't count.
+        Neither do they in text blocks, if the language has them.
+
+        :return: The index of the ';', None if the file ends before
+        :raises BudgetExceeded: If there's no ';' within the length of the budget
+        """
+        if file_id not in self._stream.keys():
+            self._stream.clear()
+            self._stream[file_id] = Stream(data)
+        cstream = self._stream[file_id]     # cstream == current stream
+        cstream.pos = offset
+        limit = min(len(data), offset + self.budget.length)
+
+        while cstream.pos < limit:
+            character = cstream.next()
+            if character == '"' and self.text_blocks and data.startswith('""', cstream.pos):
+                cstream.pos += 2
+                self._read_text_block(cstream, limit)
+            elif character == '"' or character == "'":
+                self._read_string(cstream, limit, character)
+            elif character == ';':
+                return cstream.pos - 1
+        if limit < len(data):
+            raise BudgetExceeded('length', '_end_of_line', self.budget.length)
+        return None
+
+    @staticmethod
+    def _read_string(cstream: Stream, limit: int, quote: str = '"'):
+        """ Skips a literal whose opening quote was just read. Literals don't span lines, so a stray quote (e.g. in a
+        comment) only swallows the rest of its line.
+        """
+        escaped = False
+        while cstream.pos < limit:
+            character = cstream.next()
+            if escaped:
+                escaped = False
+            elif character == '\\':
+                escaped = True
+            elif character == quote or character == '\n':
+                return
+
+    @staticmethod
+    def _read_text_block(cstream: Stream, limit: int):
+        """ Skips a text block whose three opening quotes were just read, up to the closing ones on whatever line """
+        escaped = False
+        while cstream.pos < limit:
+            character = cstream.next()
+            if escaped:
+                escaped = False
+            elif character == '\\':
+                escaped = True
+            elif character == '"' and cstream.s.startswith('""', cstream.pos):
+                cstream.pos += 2
+                return
+
+    @abstractmethod
+    def save(self, path: Union[str, Path], repo_name: str, repo_url: str):
+        ...
@@ -5,42 +5,15 @@ import pandas
 import logging
 
 from ..extractorbase import ExtractorBase
-from templatecrawler.logparser.strstream import Stream
 
 
 class slf4jExtractor(ExtractorBase):
     logger = logging.getLogger(__name__)
+    file_pattern = '*.java'
+    text_blocks = True
     log_statement_0 = re.compile(r'\.(fatal|info|error|debug|trace|warn)\(')
     log_statement_1 = re.compile(r'\.log\(')
 
-    def extract_events(self) -> pandas.DataFrame:
-        self._log_statements = []
-        self._log_statement_files = []
-        last_dir = self._path.name
-
-        for _file in self._path.rglob('*.java'):
-            if not _file.is_file():
-                continue
-            with open(_file, 'r') as fd:
-                strip_parents = _file.parts[_file.parts.index(last_dir) + 1:]
-                filename = '/'.join(strip_parents)
-                line_begin = -1
-                try:
-                    data = fd.read()
-                    search_result = [m.end() for m in re.finditer(self.log_statement_0, data)]
-                    for index_end in search_result:
-                        line_begin = self._begin_of_line(data, index_end, _file)
-                        line_end = self._end_of_line(data, line_begin, filename)
-                        self._log_statements.append(data[line_begin:line_end])
-                        self._log_statement_files.append(filename)
-                except UnicodeDecodeError as e:
-                    name = e.__class__.__name__
-                    self.logger.info(f'A problem occured parsing {_file}:{line_begin} {name} [Reason] --> {e.reason}')
-                except ValueError as e:
-                    name = e.__class__.__name__
-                    self.logger.info(f'A problem occured parsing {_file}:{line_begin} {name} [Reason] --> {e.args}')
-        return self._build_events()
-
     def get_event_count(self):
         return len(self._log_statements)
 
@@ -97,30 +70,6 @@ class slf4jExtractor(ExtractorBase):
             self.logger.warning(msg)
         return bof_index
 
-
-    def _end_of_line(self, data: str, offset: int, file_id: str):
-        if file_id not in self._stream.keys():
-            self._stream.clear()
-            self._stream[file_id] = Stream(data)
-        cstream = self._stream[file_id]     # cstream == current stream
-        cstream.pos = offset
-
-        while not cstream.eof():
-            if cstream.peek() == '"':
-                self._read_string(cstream)
-            elif cstream.peek() == ';':
-                return cstream.pos
-            cstream.next()
-
-    def _read_string(self, cstream: Stream):
-        escaped = False
-        while not cstream.eof():
-            if cstream.peek() == r'\\':
-                escaped = True
-            if cstream.peek() == '"' and not escaped:
-                return cstream.pos
-        raise ValueError("Unexpected EOF")
-
     def _run_forward_comment(self, data: str, offset: int):
         i = 0
         while offset + i < len(data):
@@ -1,6 +1,9 @@
 from templatecrawler.logparser.java import JavaParser
 import pandas as pd
 
+from templatecrawler.profiling import SlowStatements
+from templatecrawler.budget import Budget
+
 
 class CParser(JavaParser):
 
@@ -48,13 +51,13 @@ class CParser(JavaParser):
         'dprintk': ('format', ['str', '...']),
     }
 
-    def __init__(self, framework: str):
-        super().__init__(framework)
+    def __init__(self, framework: str, slow_statements: SlowStatements = None, budget: Budget = None):
+        super().__init__(framework, slow_statements=slow_statements, budget=budget)
 
         self._framework_map = self._c_functions
 
-    def run(self, data: pd.Series):
+    def run(self, data: pd.Series, keep_index: bool = False):
         data = data.apply(str.strip)
         mask = data.str.startswith('#')
         data = data[~mask]
-        return super(CParser, self).run(data)
+        return super(CParser, self).run(data, keep_index=keep_index)
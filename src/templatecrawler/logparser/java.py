@@ -1,11 +1,16 @@
+from collections import Counter
 import pandas as pd
 import re
 from typing import Tuple, List
 import logging
+import time
 
 from templatecrawler.logparser import filtersettings as fs
 from templatecrawler.logparser.strstream import Stream
 from templatecrawler.logparser.javatokenizer import JavaTokenizer
+from templatecrawler import metrics
+from templatecrawler.profiling import SlowStatements
+from templatecrawler.budget import Budget, BudgetExceeded
 
 
 class JavaParser:
@@ -41,33 +46,73 @@ class JavaParser:
         'unknown': _slf4j_map
     }
 
-    def __init__(self, framework: str):
+    def __init__(self, framework: str, slow_statements: SlowStatements = None, budget: Budget = None):
         self._framework_map = self._framework_selector[framework]
         self._current_template = None
+        self.slow_statements = slow_statements      # Every statement is timed if set
+        self.budget = budget or Budget()
+        self.aborted = Counter()                    # Statements given up on, by the kind of budget they exceeded
 
-    def run(self, data: pd.Series):
-        print(f'Dataset size before filtering is {len(data)}')
+    def run(self, data: pd.Series, keep_index: bool = False):
+        self.log.debug(f'Dataset size before filtering is {len(data)}')
+        metrics.increment('parser_statements_total', len(data))
 
         # Filter useless rows
-        for current_filter in fs.filter_rules:
+        for rule, current_filter in enumerate(fs.filter_rules):
             mask = data.apply(lambda x: True if re.search(current_filter, x) else False)  # True if filter matches
             data = data[~mask]                                                            # Remove all Trues
             # self.df = self.df[~mask]                                                      # Also in parent structure
-            print(f'Removed {sum(mask)} entries from dataset. New size is {len(data)}')
+            self.log.debug(f'Removed {sum(mask)} entries from dataset. New size is {len(data)}')
+            metrics.increment('parser_filtered_total', int(sum(mask)), rule=rule)
 
         output = {'parsed_template': [], 'arguments': [], 'raw': []}
-        for string in data:
+        index = []
+        for position, string in data.items():
             self._current_template = string
             try:
-                result, arguments = self._parse_new(string)
+                self.budget.start(string)
+                if self.slow_statements is None:
+                    result, arguments = self._parse_new(string)
+                else:
+                    result, arguments = self._timed_parse(string)
                 if result and len(result) > 0:
                     output['parsed_template'].append(result)
                     output['arguments'].append(arguments)
                     output['raw'].append(string)
+                    index.append(position)
+            except (BudgetExceeded, RecursionError) as e:
+                kind = e.kind if isinstance(e, BudgetExceeded) else 'depth'
+                self.log.info(f'Gave up on parsing "{string[:200]}" {e}')
+                self.aborted[kind] += 1
+                metrics.increment('parser_aborted_total', reason=kind)
             except (ValueError, IndexError) as e:
-                print(f'Parsing error on: "{string}"\n', e)
+                self.log.debug(f'Parsing error on: "{string}" {e}')
+                metrics.increment('parser_errors_total', error=e.__class__.__name__)
+
+        metrics.increment('parser_templates_total', len(index))
+        # The index of the input is only kept on request, so the rows can be matched with the input again
+        return pd.DataFrame(output, index=index if keep_index else None)
 
-        return pd.DataFrame(output)
+    def _timed_parse(self, string: str):
+        start = time.perf_counter()
+        try:
+            return self._parse_new(string)
+        finally:
+            seconds = time.perf_counter() - start
+            metrics.observe('parser_statement_seconds', seconds)
+            self.slow_statements.record(seconds, string, lambda: self._count_tokens(string))
+
+    @staticmethod
+    def _count_tokens(string: str) -> int:
+        lexer = JavaTokenizer(Stream(string))
+        count = 0
+        try:
+            while not lexer.eof():
+                lexer.next()
+                count += 1
+        except (ValueError, IndexError):
+            pass
+        return count
 
     def _parse(self, inp) -> Tuple[str, List[str]]:
         character_stream = Stream(inp)
@@ -83,6 +128,7 @@ class JavaParser:
         # is the delimiter between string concatenation and arguments for that string
 
         while not lexer.eof():
+            self.budget.step('_parse')
             current_type, current_token = lexer.peek()
             if current_type == 'str':
                 if first_token:
@@ -149,6 +195,7 @@ class JavaParser:
                     stream = JavaTokenizer(Stream(output))
                     constructed_token = ""
                     while not stream.eof():
+                        self.budget.step('_parse')
                         if (token := stream.next())[0] == 'str':
                             constructed_token += token[1]
                     log_string += constructed_token
@@ -168,6 +215,7 @@ class JavaParser:
         stack = []
         current_type, current_token = lexer.next()
         while not lexer.eof():
+            self.budget.step('_read_var')
             next_type, next_token = lexer.peek()
             if current_type == 'var' and (next_type == 'op' and next_token == '.'):
                 var_tokens += next_token
@@ -196,6 +244,7 @@ class JavaParser:
         string_only = True
         original_string = ""  # current_token
         while not lexer.eof():
+            self.budget.step('_read_expression')
             next_type, next_token = lexer.peek()
             if next_type == 'str':
                 original_string += f'"{next_token}"'
@@ -276,6 +325,7 @@ class JavaParser:
         variables = []
         statement_stack = []
         while not lexer.eof():
+            self.budget.step('_parse_format')
             token_type, token = lexer.peek()
 
             # Advance argument
@@ -353,6 +403,7 @@ class JavaParser:
 
         stack = []
         while not lexer.eof():
+            self.budget.step('_get_format_expression')
             token_type, token = lexer.peek()
             if token_type == 'punc' and token == '(':
                 return stack
@@ -386,6 +437,7 @@ class JavaParser:
         variable_name = []
         previous_was_var = False
         while not lexer.eof():
+            self.budget.step('_read_variable')
             token_type, token = lexer.peek()
             if token_type == 'punc' and token == ',' and not stack:
                 return 'simple', variable_name, None
@@ -443,6 +495,7 @@ class JavaParser:
         previous_token_type = None
         previous_token = None
         while not lexer.eof():
+            self.budget.step('_count_arguments')
             token_type, token = lexer.peek()
             if token_type == 'punc' and token == '(':
                 previous_token_type = token_type
@@ -456,6 +509,7 @@ class JavaParser:
         stack = []
         argument_count = 1
         while not lexer.eof():
+            self.budget.step('_count_arguments')
             token_type, token = lexer.peek()
 
             if token_type == 'punc' and token == ')' and not stack:
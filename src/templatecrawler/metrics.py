@@ -0,0 +1,204 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from threading import Lock, Thread
+from typing import Dict, Tuple, Union, TYPE_CHECKING
+import bisect
+import json
+import logging
+import math
+import time
+
+if TYPE_CHECKING:
+    from http.server import ThreadingHTTPServer
+
+log = logging.getLogger(__name__)
+
+# Seconds, from a single statement up to a whole repository
+default_buckets = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 60.0, 300.0, 1800.0)
+
+
+class Registry:
+    """ Counters and histograms of one run, keyed by name and labels. Names follow the Prometheus conventions,
+    counters end with '_total' and durations are histograms in seconds.
+    Stages don't hold a registry themselves, they report into the current one, see use().
+    """
+
+    def __init__(self, prefix: str = 'templatecrawler'):
+        self.prefix = prefix
+        self._counters = {}         # type: Dict[Tuple[str, tuple], float]
+        self._histograms = {}       # type: Dict[Tuple[str, tuple], dict]
+        self._lock = Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = Lock()
+
+    def increment(self, name: str, value: float = 1, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, buckets: Tuple[float, ...] = default_buckets, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = {'buckets': tuple(buckets), 'counts': [0] * (len(buckets) + 1),
+                                                     'sum': 0.0, 'count': 0}
+            histogram['counts'][bisect.bisect_left(histogram['buckets'], value)] += 1
+            histogram['sum'] += value
+            histogram['count'] += 1
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def value(self, name: str, **labels) -> float:
+        return self._counters.get((name, _label_key(labels)), 0)
+
+    def merge(self, other: 'Registry'):
+        """ Adds the values of another registry, e.g. the one of a repository which was processed in a pool process """
+        with self._lock:
+            for key, value in other._counters.items():
+                self._counters[key] = self._counters.get(key, 0) + value
+            for key, histogram in other._histograms.items():
+                own = self._histograms.get(key)
+                if own is None or own['buckets'] != histogram['buckets']:
+                    self._histograms[key] = {**histogram, 'counts': list(histogram['counts'])}
+                    continue
+                own['counts'] = [x + y for x, y in zip(own['counts'], histogram['counts'])]
+                own['sum'] += histogram['sum']
+                own['count'] += histogram['count']
+
+    def to_dict(self) -> Dict:
+        with self._lock:
+            counters = [{'name': self._name(name), 'labels': dict(labels), 'value': value}
+                        for (name, labels), value in sorted(self._counters.items())]
+            histograms = [{'name': self._name(name), 'labels': dict(labels), 'buckets': list(x['buckets']),
+                           'counts': list(x['counts']), 'sum': x['sum'], 'count': x['count']}
+                          for (name, labels), x in sorted(self._histograms.items())]
+        return {'counters': counters, 'histograms': histograms}
+
+    def dump(self, path: Union[str, Path]):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps(self.to_dict(), indent=2))
+
+    def to_prometheus(self) -> str:
+        """ Text exposition format, version 0.0.4 """
+        data = self.to_dict()
+        lines = []
+        seen = set()
+        for counter in data['counters']:
+            if counter['name'] not in seen:
+                seen.add(counter['name'])
+                lines.append(f'# TYPE {counter["name"]} counter')
+            lines.append(f'{counter["name"]}{_format_labels(counter["labels"])} {_format_value(counter["value"])}')
+        for histogram in data['histograms']:
+            name = histogram['name']
+            if name not in seen:
+                seen.add(name)
+                lines.append(f'# TYPE {name} histogram')
+            cumulative = 0
+            for bound, count in zip(list(histogram['buckets']) + [math.inf], histogram['counts']):
+                cumulative += count
+                labels = _format_labels({**histogram['labels'], 'le': _format_value(bound)})
+                lines.append(f'{name}_bucket{labels} {cumulative}')
+            labels = _format_labels(histogram['labels'])
+            lines.append(f'{name}_sum{labels} {_format_value(histogram["sum"])}')
+            lines.append(f'{name}_count{labels} {histogram["count"]}')
+        return '\n'.join(lines) + '\n'
+
+    def _name(self, name: str) -> str:
+        return f'{self.prefix}_{name}' if self.prefix else name
+
+
+def _label_key(labels: dict) -> tuple:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ''
+    escaped = {key: value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+               for key, value in labels.items()}
+    return '{' + ','.join(f'{key}="{value}"' for key, value in escaped.items()) + '}'
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return '+Inf'
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+# A context variable, so threads running at the same time (e.g. several pipelines) each report into the registry they
+# use(). New threads start out with the default registry.
+_current = ContextVar('metrics_registry', default=Registry())
+
+
+def current() -> Registry:
+    return _current.get()
+
+
+@contextmanager
+def use(registry: Registry):
+    """ Makes <registry> the one all stages report into, until the block ends. Only in the current thread, others
+    keep reporting into their own.
+    """
+    token = _current.set(registry)
+    try:
+        yield registry
+    finally:
+        _current.reset(token)
+
+
+def increment(name: str, value: float = 1, **labels):
+    _current.get().increment(name, value, **labels)
+
+
+def observe(name: str, value: float, **labels):
+    _current.get().observe(name, value, **labels)
+
+
+def timer(name: str, **labels):
+    return _current.get().timer(name, **labels)
+
+
+def serve(port: int, registry: Registry = None, address: str = '') -> 'ThreadingHTTPServer':
+    """ Exposes a registry for Prometheus on http://<address>:<port>/metrics, from a daemon thread.
+    Without a registry, the current one of the caller is exposed. The server threads can't see the caller's
+    context, so a registry set with use() later on isn't picked up.
+    """
+    registry = registry or current()
+    # Only here, every stage imports this module and the HTTP server isn't cheap to import
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = registry.to_prometheus().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            log.debug(format % args)
+
+    server = ThreadingHTTPServer((address, port), Handler)
+    Thread(target=server.serve_forever, daemon=True).start()
+    log.info(f'Serving metrics on port {server.server_port}')
+    return server
@@ -1,8 +1,13 @@
-from typing import List, Union
-import pandas as pd
+from collections import Counter
+from itertools import islice
+from typing import List, Union, Iterable, Iterator, TYPE_CHECKING
 
-from templatecrawler.logparser.java import JavaParser
-from templatecrawler.logparser.c import CParser
+from templatecrawler import lazy
+from templatecrawler.profiling import SlowStatements
+from templatecrawler.budget import Budget
+
+if TYPE_CHECKING:
+    import pandas as pd
 
 
 class LogParser:
@@ -11,20 +16,75 @@ class LogParser:
     PYTHON = 'python'
     CSHARP = 'csharp'
 
-    _engine_selector = {'java': JavaParser,
-                        'c': CParser,
+    # Engines (and pandas with them) are imported on first use, see lazy.load()
+    _engine_selector = {'java': 'templatecrawler.logparser.java:JavaParser',
+                        'c': 'templatecrawler.logparser.c:CParser',
                         'python': NotImplementedError,
                         'csharp': NotImplementedError}
 
-    def __init__(self, language: str):
+    def __init__(self, language: str, slow_statements: SlowStatements = None, budget: Budget = None):
+        """ :param slow_statements: (optional) Times every statement and keeps the slowest ones in here
+        :param budget: (optional) Steps and time a statement may take, statements exceeding it are skipped
+        """
         self.language = language
+        self.slow_statements = slow_statements
+        self.budget = budget
+        self.aborted = Counter()        # Statements given up on, by the kind of budget they exceeded
         self._engine = self._engine_selector[language]
 
-    def run(self, raw_input: Union[List[str], pd.Series], framework: str):
-        engine = self._engine(framework)
+    def _create_engine(self, framework: str):
+        if self._engine is NotImplementedError:
+            raise NotImplementedError(f'Parsing {self.language} ({framework}) is not supported')
+        engine = lazy.load(self._engine)(framework, slow_statements=self.slow_statements, budget=self.budget)
+        engine.aborted = self.aborted
+        return engine
+
+    def run(self, raw_input: Union[List[str], 'pd.Series'], framework: str):
+        import pandas as pd
+        engine = self._create_engine(framework)
         if isinstance(raw_input, list):
             raw_input = pd.Series(raw_input)
         if isinstance(raw_input, pd.Series):
             return engine.run(raw_input)
         else:
             raise ValueError(f'Expected type <List> or <pandas.Series> got <{type(raw_input)}> instead')
+
+    def run_iter(self, raw_input: Union[Iterable, 'pd.Series', 'pd.DataFrame'], framework: str,
+                 chunksize: int = 10000) -> Iterator['pd.DataFrame']:
+        """ Parses the input chunk by chunk and yields the results, so only one chunk is in memory at a time.
+        The index continues across chunks, every row keeps the position of its statement in the input.
+
+        :param raw_input: Raw statements. Either strings or records with a 'raw' field (named tuples or dicts), whose
+                          other fields are kept as columns. A DataFrame is read row by row.
+        :param framework: Logging framework
+        :param chunksize: Number of raw statements per chunk
+        :return: Generator of DataFrames like run() returns them, empty chunks are left out
+        """
+        import pandas as pd
+        engine = self._create_engine(framework)
+        if isinstance(raw_input, pd.DataFrame):
+            raw_input = raw_input.itertuples(index=False)
+        iterator = iter(raw_input)
+        position = 0
+        while True:
+            chunk = list(islice(iterator, chunksize))
+            if not chunk:
+                return
+            events = self._to_frame(chunk)
+            events.index += position
+            position += len(events)
+            parsed = engine.run(events['raw'], keep_index=True)
+            if len(parsed) > 0:
+                yield parsed.join(events.drop(columns='raw'))
+
+    @staticmethod
+    def _to_frame(chunk: List) -> 'pd.DataFrame':
+        import pandas as pd
+        first = chunk[0]
+        if isinstance(first, str):
+            return pd.DataFrame({'raw': chunk})
+        elif hasattr(first, '_fields'):
+            return pd.DataFrame.from_records(chunk, columns=first._fields)
+        elif isinstance(first, dict):
+            return pd.DataFrame.from_records(chunk)
+        raise ValueError(f'Expected strings or records with a field <raw> got <{type(first)}> instead')
@@ -0,0 +1,188 @@
+from pathlib import Path
+from typing import Union, List, Iterable, Iterator
+import argparse
+import logging
+import time
+import pandas as pd
+
+from templatecrawler.detector import LogDetector
+from templatecrawler.extractor import LogExtractor
+from templatecrawler.parser import LogParser
+from templatecrawler.templatefilter import find_valid
+from templatecrawler.formalizer import formalize
+from templatecrawler.dedup import drop_batch_duplicates
+from templatecrawler.tokentypes import TokenType, tokens
+from templatecrawler import metrics
+from templatecrawler.profiling import SlowStatements, StageProfiles
+from templatecrawler.budget import Budget
+
+
+class Pipeline:
+    """ Runs detect --> extract --> parse --> filter --> formalize --> deduplicate for one cloned repository in a single
+    process.
+    Every stage hands its output directly to the next one. Extraction and parsing are streamed, the statements of
+    <chunksize> log events are parsed while extraction goes on, and every parsed chunk is filtered, formalized and
+    deduplicated before the next one is parsed. Only the templates which make it through all stages are kept.
+
+    Every statement has a budget of steps, time and length in the extractor and the parser. Statements exceeding it are
+    skipped, self.aborted counts them per stage and kind of budget.
+
+    Profiling is opt-in: with a profile_dir every stage runs under cProfile and writes <profile_dir>/<stage>.pstats
+    (summed up over all chunks),
+    with slow_statements > 0 the parser times every statement and keeps that many of the slowest ones.
+    """
+
+    log = logging.getLogger(__name__)
+
+    def __init__(self, repository: Union[str, Path], language: str, framework: str = None,
+                 possible_types: List[TokenType] = None, chunksize: int = 10000, profile_dir: Union[str, Path] = None,
+                 slow_statements: int = 0, budget: Budget = None):
+        self.repository = str(repository)
+        self.language = language
+        self.framework = framework
+        self.possible_types = possible_types or tokens
+        self.chunksize = chunksize
+        self.stats = {}
+        self.aborted = {}       # Stage --> {kind of budget: statements}
+        self.timings = {}       # Seconds per stage, extract is part of parse
+        self.metrics = metrics.Registry()
+        self.profile_dir = Path(profile_dir) if profile_dir else None
+        self._profiles = StageProfiles(self.profile_dir)
+        self.slow_statements = SlowStatements(slow_statements) if slow_statements > 0 else None
+        self.budget = budget or Budget()
+        self._stages = [
+            ('filter', self._filter),
+            ('formalize', self._formalize),
+            ('deduplicate', self._deduplicate),
+        ]
+        self._seen = {}         # Digests of the templates of earlier chunks
+
+    def run(self) -> pd.DataFrame:
+        # Everything the stages report during the run ends up in self.metrics
+        with metrics.use(self.metrics):
+            try:
+                return self._run()
+            finally:
+                self._profiles.dump()
+                self._report_slow_statements()
+
+    def _run(self) -> pd.DataFrame:
+        if not self.framework:
+            start = time.perf_counter()
+            with self._profiles('detect'):
+                self.framework = self.detect()
+            self.timings['detect'] = time.perf_counter() - start
+            metrics.observe('stage_seconds', self.timings['detect'], stage='detect')
+
+        names = ['parse'] + [name for name, _ in self._stages]
+        self.stats.update({name: 0 for name in names})
+        self.timings.update({name: 0.0 for name in names})
+        self._seen = {}
+        results = []
+        for data in self._parse():
+            for name, stage in self._stages:
+                metrics.increment('stage_items_in_total', len(data), stage=name)
+                start = time.perf_counter()
+                with self._profiles(name):
+                    data = stage(data)
+                self.timings[name] += time.perf_counter() - start
+                self.stats[name] += len(data)
+                metrics.increment('stage_items_out_total', len(data), stage=name)
+                if len(data) <= 0:
+                    break
+            else:
+                results.append(data)
+
+        for name in names:
+            metrics.observe('stage_seconds', self.timings[name], stage=name)
+            self.log.info(f'[{name.upper()}] {self.repository}: {self.stats[name]} entries')
+        if not results:
+            return pd.DataFrame(columns=['template', 'arguments', 'raw', 'parsed_template'])
+        return pd.concat(results)
+
+    def _report_slow_statements(self):
+        if self.slow_statements is None:
+            return
+        for statement in self.slow_statements.top()[:5]:
+            self.log.info(f'[SLOW] {statement["seconds"]:.4f}s {statement["tokens"]} tokens: {statement["raw"][:200]!r}')
+        if self.profile_dir:
+            self.slow_statements.dump(self.profile_dir / 'slow_statements.json')
+
+    def detect(self) -> str:
+        # git and requests come with the crawler, only load them if the framework isn't known yet
+        from templatecrawler.crawler import GitHubCrawler
+        crawler = GitHubCrawler(auth_token=None, owner=None, repository=None)
+        files = crawler.fetch_files(path=self.repository, language=self.language)
+        detector = LogDetector(language=self.language)
+        return detector.framework(files=files)
+
+    def _parse(self) -> Iterator[pd.DataFrame]:
+        """ Yields the parsed statements chunk by chunk, extraction and parsing count as the parse stage """
+        extractor = LogExtractor(language=self.language, framework=self.framework, repository=self.repository,
+                                 budget=self.budget)
+        parser = LogParser(language=self.language, slow_statements=self.slow_statements, budget=self.budget)
+        events = self._count('extract', extractor.iter_events())
+        chunks = parser.run_iter(events, framework=self.framework, chunksize=self.chunksize)
+        while True:
+            start = time.perf_counter()
+            with self._profiles('parse'):
+                chunk = next(chunks, None)
+            self.timings['parse'] += time.perf_counter() - start
+            if chunk is None:
+                break
+            self.stats['parse'] += len(chunk)
+            metrics.increment('stage_items_out_total', len(chunk), stage='parse')
+            yield chunk
+        self.aborted['extract'] = dict(extractor.aborted)
+        self.aborted['parse'] = dict(parser.aborted)
+        self.log.info(f'[EXTRACT] {self.repository}: {self.stats["extract"]} entries')
+        if extractor.aborted or parser.aborted:
+            self.log.warning(f'[ABORTED] {self.repository}: {self.aborted}')
+
+    def _count(self, name: str, iterable: Iterable) -> Iterator:
+        self.stats[name] = 0
+        for item in iterable:
+            self.stats[name] += 1
+            yield item
+
+    def _filter(self, parsed: pd.DataFrame) -> pd.DataFrame:
+        return parsed.loc[find_valid(parsed['parsed_template'])]
+
+    def _formalize(self, raw_templates: pd.DataFrame) -> pd.DataFrame:
+        output = formalize(data=raw_templates, possible_types=self.possible_types)
+        # The return value is a dict of index and result, so we kick out the indices which are not in the result
+        templates = raw_templates.loc[list(output.keys())]
+        templates['template'] = templates.index.map(output)
+        return templates
+
+    def _deduplicate(self, templates: pd.DataFrame) -> pd.DataFrame:
+        return drop_batch_duplicates(templates, seen=self._seen)
+
+
+def main(argv: List[str] = None):
+    arg_parser = argparse.ArgumentParser(description='Extracts log templates from a cloned repository')
+    arg_parser.add_argument('repository', help='Path to the cloned repository')
+    arg_parser.add_argument('--language', required=True, choices=['java', 'c'])
+    arg_parser.add_argument('--framework', default=None, help='Logging framework, detected if not given')
+    arg_parser.add_argument('--output', default=None, help='CSV file for the templates, printed if not given')
+    arg_parser.add_argument('--metrics', default=None, help='JSON file for the metrics of the run')
+    arg_parser.add_argument('--profile-dir', default=None, help='Write a cProfile .pstats file per stage in here')
+    arg_parser.add_argument('--slow-statements', type=int, default=0,
+                            help='Time every statement and report the n slowest ones')
+    args = arg_parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    pipeline = Pipeline(args.repository, language=args.language, framework=args.framework,
+                        profile_dir=args.profile_dir, slow_statements=args.slow_statements)
+    templates = pipeline.run()
+    if args.metrics:
+        pipeline.metrics.dump(args.metrics)
+    if args.output:
+        templates.to_csv(args.output)
+    else:
+        for template in templates['template']:
+            print(template)
+
+
+if __name__ == '__main__':
+    main()
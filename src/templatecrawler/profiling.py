@@ -0,0 +1,92 @@
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Union, Callable, List, Dict
+import cProfile
+import heapq
+import itertools
+import json
+import logging
+
+log = logging.getLogger(__name__)
+
+
+class SlowStatements:
+    """ Keeps the <size> slowest statements seen so far in a heap, the fastest of them on top.
+    Everything that is not slower than the top is dropped right away, so most statements cost one comparison.
+    """
+
+    def __init__(self, size: int = 20):
+        self.size = size
+        self.count = 0
+        self.seconds = 0.0
+        self._heap = []
+        self._order = itertools.count()     # Tie breaker, so equal times never compare the statements
+
+    def record(self, seconds: float, raw: str, token_count: Callable[[], int] = None):
+        """ :param token_count: (optional) Only called if the statement makes it into the heap """
+        self.count += 1
+        self.seconds += seconds
+        if len(self._heap) >= self.size and seconds <= self._heap[0][0]:
+            return
+        entry = (seconds, next(self._order), raw, token_count() if token_count else None)
+        if len(self._heap) < self.size:
+            heapq.heappush(self._heap, entry)
+        else:
+            heapq.heapreplace(self._heap, entry)
+
+    def top(self) -> List[Dict]:
+        return [{'seconds': seconds, 'raw': raw, 'tokens': tokens}
+                for seconds, _, raw, tokens in sorted(self._heap, reverse=True)]
+
+    def dump(self, path: Union[str, Path]):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps({'statements': self.count, 'seconds': self.seconds, 'slowest': self.top()},
+                                   indent=2))
+
+
+@contextmanager
+def profile(path: Union[str, Path, None]):
+    """ Runs the block under cProfile and writes the statistics to <path> (.pstats), does nothing without a path """
+    if path is None:
+        yield
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        profiler.dump_stats(str(path))
+        log.info(f'Wrote profile {path}')
+
+
+class StageProfiles:
+    """ One cProfile profiler per stage, which can be entered any number of times, e.g. once per chunk.
+    dump() writes <directory>/<stage>.pstats for every stage. Does nothing without a directory.
+    """
+
+    def __init__(self, directory: Union[str, Path, None]):
+        self.directory = Path(directory) if directory else None
+        self._profilers = {}
+
+    @contextmanager
+    def __call__(self, stage: str):
+        if self.directory is None:
+            yield
+            return
+        profiler = self._profilers.setdefault(stage, cProfile.Profile())
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+
+    def dump(self):
+        for stage, profiler in self._profilers.items():
+            path = self.directory / f'{stage}.pstats'
+            path.parent.mkdir(parents=True, exist_ok=True)
+            profiler.dump_stats(str(path))
+            log.info(f'Wrote profile {path}')
@@ -0,0 +1,215 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, as_completed, wait
+from dataclasses import asdict
+from datetime import date
+from typing import List, Tuple, Union
+import argparse
+import logging
+import os
+import threading
+import pandas as pd
+import psycopg2
+import requests
+
+from templatecrawler.crawlerengine.calls import GitHubCrawlerCalls
+from templatecrawler.crawlerengine.gittypes import GitRepo
+from templatecrawler.crawlerengine.shards import SearchPlanner, Shard, root_shard, search_cap
+from templatecrawler.crawlerengine.utils import Backoff, RateLimited
+from templatecrawler import database, metrics
+
+log = logging.getLogger(__name__)
+
+
+class ShardedSearcher:
+    """ Finds all repositories of a language, not only the first 1000 results GitHub returns for a search.
+    The query space is split into shards small enough to be paged through completely (see SearchPlanner). The plan is
+    saved level by level in the search_shards table, every run counts at most <max_queries> shards and the next one
+    continues splitting where it stopped. Planned shards are paged concurrently, one page per shard at a time, and
+    every written page is checkpointed, so a run can stop anytime and the next one continues where it stopped.
+
+    Once GitHub rate limits a request, all requests wait, twice as long for every further limit in a row. A run stops
+    if it would have to wait longer than <max_wait> seconds.
+
+    :param workers: Number of concurrent requests
+    :param min_disk_usage: Smaller repositories are written to discarded_repositories
+    :param max_wait: Seconds a run waits for a rate limit at most
+    """
+
+    def __init__(self, auth_token: str, language: str, workers: int = 4, page_size: int = 100,
+                 cap: int = search_cap, min_disk_usage: int = 512000, max_wait: float = 300):
+        self.language = language
+        self.workers = workers
+        self.page_size = page_size
+        self.cap = cap
+        self.min_disk_usage = min_disk_usage
+        self.max_wait = max_wait
+        self._auth_token = auth_token
+        self._local = threading.local()
+        self._backoff = Backoff()
+
+    def _caller(self) -> GitHubCrawlerCalls:
+        # One per thread, they don't share a connection
+        caller = getattr(self._local, 'caller', None)
+        if caller is None:
+            caller = self._local.caller = GitHubCrawlerCalls(auth_token=self._auth_token)
+        return caller
+
+    def plan(self, conn, until: date = None):
+        """ Starts planning over, the shards of the language which weren't paged through completely are dropped """
+        database.start_search_plan(conn, self.language, root_shard(self.language, until).query)
+
+    def continue_plan(self, conn, max_queries: int = None) -> int:
+        """ Counts the shards which weren't counted yet, level by level. Every counted shard is saved right away as
+        what it turns into, itself with its total or its uncounted halves.
+
+        :param max_queries: (optional) Stop after this many count queries, the rest is left for the next run
+        :return: Number of count queries
+        """
+        planner = SearchPlanner(self._count, cap=self.cap)
+        queries = 0
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            while max_queries is None or queries < max_queries:
+                level = database.unplanned_search_shards(conn, self.language,
+                                                         limit=None if max_queries is None else max_queries - queries)
+                if not level:
+                    break
+                futures = {executor.submit(self._count, query): (shard_id, query) for shard_id, query in level}
+                queries += len(level)
+                metrics.increment('search_plan_queries_total', len(level))
+                complete = True
+                for future in as_completed(futures):
+                    shard_id, query = futures[future]
+                    try:
+                        total = future.result()
+                    except RateLimited as e:
+                        self._limited(e)
+                        complete = False
+                        continue
+                    except (ValueError, KeyError, TypeError, requests.RequestException) as e:
+                        # The shard stays uncounted, the next run tries again
+                        log.warning(f'Counting <{query}> failed: {e}')
+                        metrics.increment('search_plan_errors_total')
+                        complete = False
+                        continue
+                    if total is None:
+                        complete = False
+                        continue
+                    parts = planner.expand(Shard.from_query(query), total)
+                    database.save_search_shards(conn, self.language, [(x.query, x.total, x.truncated) for x in parts],
+                                                replaces=[shard_id])
+                if not complete:
+                    break
+        log.info(f'Counted {queries} shards of {self.language}')
+        return queries
+
+    def run(self, conn, max_pages: int = None, max_queries: int = None) -> int:
+        """ Continues the plan, then pages through the pending shards. A new plan is started once all shards are done.
+
+        :param conn: psycopg2 connection, only used by the calling thread
+        :param max_pages: (optional) Stop after this many pages, the rest is left for the next run
+        :param max_queries: (optional) Count at most this many shards, see continue_plan()
+        :return: Number of fetched pages
+        """
+        if not database.pending_search_shards(conn, self.language) and \
+                not database.unplanned_search_shards(conn, self.language, limit=1):
+            self.plan(conn)
+        self.continue_plan(conn, max_queries=max_queries)
+        queue = deque(database.pending_search_shards(conn, self.language))
+        pages = 0
+        running = {}
+        stopped = False
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            while True:
+                while queue and not stopped and len(running) < self.workers and \
+                        (max_pages is None or pages + len(running) < max_pages):
+                    shard_id, query, cursor, fetched = queue.popleft()
+                    running[executor.submit(self._fetch, query, cursor)] = (shard_id, query, cursor, fetched)
+                if not running:
+                    break
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    shard_id, query, cursor, fetched = running.pop(future)
+                    try:
+                        result = future.result()
+                    except RateLimited as e:
+                        stopped |= self._limited(e)
+                        queue.appendleft((shard_id, query, cursor, fetched))    # Again after the wait
+                        continue
+                    except (ValueError, KeyError, TypeError, requests.RequestException) as e:
+                        # The shard stays at its checkpoint, the next run tries again
+                        log.warning(f'Fetching a page of <{query}> failed: {e}')
+                        metrics.increment('search_page_errors_total')
+                        continue
+                    if result is None:
+                        stopped = True
+                        continue
+                    repositories, _, end_cursor, has_next = result
+                    pages += 1
+                    fetched += len(repositories)
+                    done = not has_next or fetched >= self.cap
+                    self._write(conn, repositories)
+                    database.checkpoint_search_shard(conn, shard_id, end_cursor or cursor, fetched, done)
+                    if not done:
+                        queue.appendleft((shard_id, query, end_cursor, fetched))    # Finish started shards first
+        log.info(f'Fetched {pages} pages, {len(queue)} shards of {self.language} are left')
+        return pages
+
+    def _limited(self, error: RateLimited) -> bool:
+        """ :return: True if the wait is longer than a run waits """
+        delay = self._backoff.limited(error)
+        metrics.increment('search_rate_limited_total')
+        log.warning(f'{error}, all requests wait {delay:.0f}s')
+        return delay > self.max_wait
+
+    def _count(self, query: str) -> Union[int, None]:
+        """ :return: Number of results or None if the rate limit lasts longer than a run waits """
+        if not self._backoff.wait(self.max_wait):
+            return None
+        total = self._caller().count_repos(query)
+        self._backoff.succeeded()
+        return total
+
+    def _fetch(self, query: str, cursor: Union[str, None]) -> Union[Tuple[List[GitRepo], int, Union[str, None], bool],
+                                                                    None]:
+        """ :return: See GitHubCrawlerCalls.search_page, None if the rate limit lasts longer than a run waits """
+        if not self._backoff.wait(self.max_wait):
+            return None
+        with metrics.timer('search_page_seconds'):
+            result = self._caller().search_page(query, self.page_size, cursor)
+        self._backoff.succeeded()
+        return result
+
+    def _write(self, conn, repositories: List[GitRepo]):
+        if not repositories:
+            return
+        data = pd.DataFrame([asdict(x) for x in repositories])
+        data['cursor'] = None       # Cursors only mean something within their shard, the checkpoint keeps them
+        database.write_repositories(conn, data, min_disk_usage=self.min_disk_usage)
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description='Searches GitHub for repositories beyond the 1000 results of '
+                                                     'a single search and writes them into the database')
+    arg_parser.add_argument('--dsn', required=True, help='libpq connection string of the templates database')
+    arg_parser.add_argument('--language', action='append', required=True, help='e.g. Java or C, can be repeated')
+    arg_parser.add_argument('--token', default=os.environ.get('GITHUB_TOKEN'), help='Default: $GITHUB_TOKEN')
+    arg_parser.add_argument('--workers', type=int, default=4, help='Concurrent requests')
+    arg_parser.add_argument('--max-pages', type=int, default=None, help='Stop after n pages per language')
+    arg_parser.add_argument('--max-queries', type=int, default=None, help='Count at most n shards per language')
+    arg_parser.add_argument('--replan', action='store_true', help='Plan the shards again and start them over')
+    args = arg_parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    conn = psycopg2.connect(args.dsn)
+    try:
+        for language in args.language:
+            searcher = ShardedSearcher(args.token, language, workers=args.workers)
+            if args.replan:
+                searcher.plan(conn)
+            searcher.run(conn, max_pages=args.max_pages, max_queries=args.max_queries)
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
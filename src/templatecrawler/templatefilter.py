@@ -1,21 +1,83 @@
+from enum import IntFlag
 import re
 import pandas as pd
 from typing import Union, List
 
-re_length = re.compile(r'^.{10,}$')
-re_char = re.compile(r'^[^a-wyzA-WYZ]+$')
+from templatecrawler import metrics
 
-re_keyword_beginnings = re.compile(r'^\s*(static|#include|#define|#if|#endif)')
-re_comment = re.compile(r'^\s*(//|\*)')
 
+class Reason(IntFlag):
+    """ Rejection reason codes. A template can fail several rules, so the codes are combined as bit flags. """
+    NONE = 0
+    SHORT = 1               # Has to be at least n characters long
+    NO_LETTERS = 2          # Has to contain letters
+    KEYWORD = 4             # Exclude certain keywords, which may come from a parsing problem
+    COMMENT = 8             # Exclude comments, which may come from a parsing problem
+    PLACEHOLDERS = 16       # Exclude templates with too many placeholders
+    ALL = SHORT | NO_LETTERS | KEYWORD | COMMENT | PLACEHOLDERS
 
-def find_valid(data: Union[pd.Series, List[str]]) -> pd.Series:
+
+min_length = 15
+max_placeholders = 12
+
+# The beginning of the string, which is either a keyword or a comment, followed by everything up to the first letter.
+# Keywords contain letters themselves. So a single match tells us about three rules at once.
+# 'x' doesn't count as a letter, which excludes hexadecimal values like 0x{}
+re_template = re.compile(r'(?P<lead>\s*(?:(?P<keyword>static|#include|#define|#if|#endif)|(?P<comment>//|\*)))?'
+                         r'(?P<letter>[^a-wyzA-WYZ]*[a-wyzA-WYZ])?', re.DOTALL)
+# Matches at least every template which violates one of those three rules. Only a few templates do, so the series is
+# scanned once with this pattern and only the candidates are looked at in detail with re_template.
+# Kept as a string, so pandas can hand it to the vectorized regex engine of pyarrow strings.
+candidate_pattern = r'\s*(?:static|#include|#define|#if|#endif|//|\*)|[^a-wyzA-WYZ]*$'
+
+
+def check(template: str) -> Reason:
+    """ Evaluates all rules on one template in one regex match.
+
+    :return: The rules the template violates, Reason.NONE if it is valid
+    """
+    return Reason(_check(template))
+
+
+def _check(template: str, _match=re_template.match) -> int:
+    # Plain ints, creating Reason members for every template costs more than the checks themselves
+    reason = 1 if len(template) < min_length else 0
+    keyword, comment, letter = _match(template).group('keyword', 'comment', 'letter')
+    if keyword is not None:
+        reason |= 4
+    elif letter is None and template:
+        reason |= 2
+    if comment is not None:
+        reason |= 8
+    if template.count('{}') > max_placeholders:
+        reason |= 16
+    return reason
+
+
+def check_valid(data: Union[pd.Series, List[str]], reject: Reason = Reason.ALL) -> pd.DataFrame:
+    """ Checks all templates against all rules.
+
+    :param data: Templates
+    :param reject: Rules which make a template invalid. The others are only reported in the reason column.
+    :return: DataFrame with the index of data, a boolean column 'valid' and the column 'reason' with the Reason codes
+    """
     if isinstance(data, List):
         data = pd.Series(data)
 
-    mask = data.apply(len) > 14                       # Has to be at least n characters long
-    mask |= ~data.str.match(re_char)                  # Has to contain letters
-    mask |= ~data.str.match(re_keyword_beginnings)    # Exclude certain keywords, which may come from a parsing problem
-    mask |= ~data.str.match(re_comment)               # Exclude comments, which may come from a parsing problem
-    mask |= ~ data.str.count('{}') > 12               # Exclude templates with more than 12 placeholders
-    return mask
+    data = data.fillna('').astype(str)
+    reason = (data.str.len() < min_length).to_numpy(dtype='int64') * int(Reason.SHORT)
+    reason |= (data.str.count(r'\{\}') > max_placeholders).to_numpy(dtype='int64') * int(Reason.PLACEHOLDERS)
+    candidates = data.str.match(candidate_pattern).to_numpy(dtype=bool)
+    reason[candidates] = [_check(x) for x in data[candidates]]
+    reason = pd.Series(reason, index=data.index)
+    metrics.increment('filter_templates_total', len(reason))
+    for flag in (Reason.SHORT, Reason.NO_LETTERS, Reason.KEYWORD, Reason.COMMENT, Reason.PLACEHOLDERS):
+        count = int(((reason & int(flag)) > 0).sum())
+        if count > 0:
+            metrics.increment('filter_violations_total', count, reason=flag.name)
+    return pd.DataFrame({'valid': (reason & int(reject)) == 0, 'reason': reason})
+
+
+def find_valid(data: Union[pd.Series, List[str]], reject: Reason = Reason.ALL) -> pd.Series:
+    """ Boolean mask of the templates which violate none of the <reject> rules, see check_valid() """
+    return check_valid(data, reject=reject)['valid']
@@ -1,4 +1,6 @@
-from typing import List
+from functools import lru_cache
+from typing import List, Tuple, Dict
+import re
 
 
 class TokenType:
@@ -9,6 +11,50 @@ class TokenType:
         self.keywords = keywords
 
 
+class KeywordMatcher:
+    """ Finds all token types with a keyword contained in a string, in a single regex pass.
+
+    At every position the regex only reports the longest keyword starting there. Every shorter keyword starting at
+    the same position is a prefix of it, so each keyword maps to all token types with a keyword contained in it.
+
+    Every match is scored by its keyword specificity: longer keywords win, on equal length a keyword shared by fewer
+    token types wins. rank() orders the token types by their best score, ties keep the order they were given in.
+    """
+
+    def __init__(self, token_types: List[TokenType]):
+        self.token_types = list(token_types)
+        keywords = sorted({x for token in self.token_types for x in token.keywords}, key=len, reverse=True)
+        shared = {x: sum(x in token.keywords for token in self.token_types) for x in keywords}
+        self._regex = re.compile('(?=(' + '|'.join(re.escape(x) for x in keywords) + '))')
+        # keyword --> {token type index: score of the most specific keyword of that type contained in the keyword}
+        self._implied = {}
+        for keyword in keywords:
+            self._implied[keyword] = {}
+            for i, token in enumerate(self.token_types):
+                scores = [(len(x), -shared[x]) for x in token.keywords if x in keyword]
+                if scores:
+                    self._implied[keyword][i] = max(scores)
+        self.match = lru_cache(maxsize=65536)(self._match)
+        self.rank = lru_cache(maxsize=65536)(self._rank)
+
+    def _scores(self, value: str) -> Dict[int, Tuple[int, int]]:
+        scores = {}
+        for keyword in self._regex.findall(value.lower()):
+            for i, score in self._implied[keyword].items():
+                if score > scores.get(i, (0, 0)):
+                    scores[i] = score
+        return scores
+
+    def _match(self, value: str) -> Tuple[TokenType, ...]:
+        """ Token types (in the order they were given) which have a keyword contained in the lower cased value """
+        return tuple(self.token_types[i] for i in sorted(self._scores(value)))
+
+    def _rank(self, value: str) -> Tuple[TokenType, ...]:
+        """ Token types which have a keyword contained in the lower cased value, most specific match first """
+        scores = self._scores(value)
+        return tuple(self.token_types[i] for i in sorted(scores, key=lambda x: (-scores[x][0], -scores[x][1], x)))
+
+
 integer_token = TokenType('IntegerPlaceholder', int,
                           ['number', 'num', 'integer', 'int', 'index', 'idx', 'size', 'length', 'count', 'capacity',
                            'per', 'offset', 'sum'])
@@ -0,0 +1,243 @@
+from concurrent.futures import ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from typing import Union, Tuple
+import argparse
+import logging
+import shutil
+import time
+import pandas as pd
+import psycopg2
+
+from templatecrawler.crawler import GitHubCrawler
+from templatecrawler.pipeline import Pipeline
+from templatecrawler.dedup import TemplateDeduplicator
+from templatecrawler import database, metrics
+
+
+log = logging.getLogger(__name__)
+
+
+def _resolve_language(repo: dict) -> Union[str, None]:
+    if repo.get('main_language'):
+        return repo['main_language']
+    languages = repo.get('languages') or []
+    if 'java' in languages or 'Java' in languages:
+        return 'java'
+    elif 'c' in languages or 'C' in languages:
+        return 'c'
+    return None
+
+
+def process_repository(repo: dict, work_dir: str, metrics_dir: str = None, profile_dir: str = None,
+                       slow_statements: int = 0) -> Tuple[int, bool, Union[str, None], pd.DataFrame, metrics.Registry]:
+    """ Clones one repository, runs the pipeline on it and removes the clone again. Runs inside a pool process.
+
+    :param metrics_dir: (optional) The metrics of the repository are written to <metrics_dir>/<repo_id>.json
+    :param profile_dir: (optional) Profiles of the stages are written to <profile_dir>/<repo_id>/, see Pipeline
+    :param slow_statements: (optional) Number of the slowest statements of the parser to report
+    :return: (repo_id, success, framework, templates, metrics)
+    """
+    repo_id = int(repo['repo_id'])
+    registry = metrics.Registry()
+    with metrics.use(registry):
+        result = _process_repository(repo, repo_id, work_dir, profile_dir, slow_statements)
+    registry.increment('worker_repositories_total', result='success' if result[1] else 'failed')
+    if metrics_dir:
+        registry.dump(Path(metrics_dir, f'{repo_id}.json'))
+    return result + (registry,)
+
+
+def _process_repository(repo: dict, repo_id: int, work_dir: str, profile_dir: str = None,
+                        slow_statements: int = 0) -> Tuple[int, bool, Union[str, None], pd.DataFrame]:
+    language = _resolve_language(repo)
+    if language is None:
+        log.info(f'Language was neither c nor java, only contained {repo.get("languages")} ({repo["url"]})')
+        return repo_id, False, None, pd.DataFrame()
+
+    # Every repository gets its own directory, forks and unrelated projects may share a name
+    clone_dir = Path(work_dir, str(repo_id))
+    crawler = GitHubCrawler(auth_token=None, owner=repo['owner'], repository=repo['name'])
+    pipeline = None
+    try:
+        try:
+            repo_path = crawler.fetch_repository(clone_dir)
+        except ValueError as e:
+            log.warning(f'Cloning {repo["url"]} failed: {e.args}')
+            return repo_id, False, None, pd.DataFrame()
+        pipeline = Pipeline(repo_path, language=language, framework=repo.get('framework') or None,
+                            profile_dir=Path(profile_dir, str(repo_id)) if profile_dir else None,
+                            slow_statements=slow_statements)
+        templates = pipeline.run()
+    except Exception as e:
+        log.error(f'Pipeline failed for {repo["url"]}. Raised exception {e.__class__.__name__}')
+        metrics.increment('pipeline_errors_total', error=e.__class__.__name__)
+        return repo_id, False, None, pd.DataFrame()
+    finally:
+        # A failing cleanup must not turn a processed repository into a failed one
+        shutil.rmtree(clone_dir, ignore_errors=True)
+        # Also the metrics of a failed run, they tell how far it got
+        if pipeline is not None:
+            metrics.current().merge(pipeline.metrics)
+
+    templates['repo_id'] = repo_id
+    log.info(f'Processed {repo["url"]} with ID {repo_id}: {pipeline.stats} (aborted: {pipeline.aborted})')
+    return repo_id, len(templates) > 0, pipeline.framework, templates
+
+
+class WorkerPool:
+    """ Claims batches of repositories from the shared queue in the database and processes them concurrently.
+    Any number of pools, also on different nodes, can work on the same database.
+    """
+
+    def __init__(self, dsn: str, work_dir: Union[str, Path], batch_size: int = 8, processes: int = 4,
+                 lease: int = 3600, bloom_filter: bool = False, digest_cache: Union[str, Path] = None,
+                 metrics_dir: Union[str, Path] = None, profile_dir: Union[str, Path] = None,
+                 slow_statements: int = 0):
+        self.dsn = dsn
+        self.work_dir = str(work_dir)
+        self.batch_size = batch_size
+        self.processes = processes
+        self.lease = lease
+        self.name = database.worker_name()
+        self.bloom_filter = bloom_filter
+        self._discarded = None
+        self._discarded_count = 0
+        self._deduplicator = TemplateDeduplicator(digest_cache)
+        self.metrics_dir = str(metrics_dir) if metrics_dir else None
+        self.metrics = metrics.Registry()     # Everything this pool did so far
+        self.profile_dir = str(profile_dir) if profile_dir else None
+        self.slow_statements = slow_statements
+        self._broken = False        # A pool process died, the executor can't take any more work
+
+    def run(self, max_batches: int = None, idle_sleep: int = 60):
+        Path(self.work_dir).mkdir(parents=True, exist_ok=True)
+        batches = 0
+        executor = ProcessPoolExecutor(max_workers=self.processes)
+        try:
+            while max_batches is None or batches < max_batches:
+                if self._broken:
+                    log.warning('Starting new pool processes, one of them died')
+                    executor.shutdown(wait=False)
+                    executor = ProcessPoolExecutor(max_workers=self.processes)
+                    self._broken = False
+                if not self.run_batch(executor):
+                    if max_batches is not None:
+                        break
+                    time.sleep(idle_sleep)
+                    continue
+                batches += 1
+        finally:
+            executor.shutdown()
+
+    def run_batch(self, executor: ProcessPoolExecutor) -> int:
+        with metrics.use(self.metrics):
+            return self._run_batch(executor)
+
+    def _run_batch(self, executor: ProcessPoolExecutor) -> int:
+        conn = psycopg2.connect(self.dsn)
+        try:
+            repositories = database.claim_repositories(conn, self.batch_size, lease=self.lease, worker=self.name)
+            if len(repositories) == 0:
+                log.info('No unprocessed repositories left in the queue')
+                return 0
+            log.info(f'Claimed {len(repositories)} repositories: {list(repositories["repo_id"])}')
+
+            records = repositories.to_dict(orient='records')
+            futures = [executor.submit(process_repository, x, self.work_dir, self.metrics_dir, self.profile_dir,
+                                   self.slow_statements) for x in records]
+
+            # Keep our leases alive while the batch runs, otherwise another worker would take the repositories over
+            pending = futures
+            while pending:
+                _, pending = wait(pending, timeout=self.lease / 2)
+                if pending:
+                    database.renew_leases(conn, list(repositories['repo_id']), worker=self.name)
+            results = [self._result(record, future) for record, future in zip(records, futures)]
+            for result in results:
+                self.metrics.merge(result[4])
+
+            # A repository whose lease expired may belong to another worker by now, its results are left to that one
+            owned = set(database.owned_repositories(conn, [x[0] for x in results], worker=self.name))
+            lost = [x[0] for x in results if x[0] not in owned]
+            if lost:
+                log.warning(f'Lost the lease on repositories {lost}, skipping their results')
+                results = [x for x in results if x[0] in owned]
+
+            # Write everything of this batch back at once
+            templates = [x[3] for x in results if x[1]]
+            if templates:
+                if self.bloom_filter:
+                    self._refresh_discarded(conn)
+                self._deduplicator.sync(conn)
+                templates = self._deduplicator.drop_duplicates(pd.concat(templates, ignore_index=True))
+                written = database.write_templates(conn, templates, discarded=self._discarded)
+                self._deduplicator.add(written)       # Not the empty and discarded ones, they aren't in the table
+                self._deduplicator.save()
+                log.info(f'Wrote {len(written)} templates')
+            finished = database.finish_repositories(conn, [(repo_id, success, framework)
+                                                           for repo_id, success, framework, _, _ in results],
+                                                    worker=self.name)
+            if finished < len(results):
+                log.warning(f'{len(results) - finished} repositories were taken over before they were finished')
+            return len(results) + len(lost)
+        finally:
+            conn.close()
+
+    def _result(self, repo: dict, future) -> Tuple[int, bool, Union[str, None], pd.DataFrame, metrics.Registry]:
+        """ The result of process_repository(), a repository which raised counts as failed. So one repository (or a
+        dying pool process) doesn't cost the results of the whole batch.
+        """
+        try:
+            return future.result()
+        except Exception as e:
+            log.error(f'Processing {repo["url"]} failed. Raised exception {e.__class__.__name__}: {e}')
+            if isinstance(e, BrokenProcessPool):
+                self._broken = True
+            shutil.rmtree(Path(self.work_dir, str(repo['repo_id'])), ignore_errors=True)
+            registry = metrics.Registry()
+            registry.increment('worker_errors_total', error=e.__class__.__name__)
+            registry.increment('worker_repositories_total', result='failed')
+            return int(repo['repo_id']), False, None, pd.DataFrame(), registry
+
+    def _refresh_discarded(self, conn):
+        # Templates may have been discarded since the filter was loaded, they would slip through it. Counted before
+        # loading, a template discarded in between only causes another reload.
+        count = database.count_discarded(conn)
+        if self._discarded is None or count != self._discarded_count:
+            self._discarded = database.load_discarded_filter(conn)
+            self._discarded_count = count
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description='Processes repositories from the database queue')
+    arg_parser.add_argument('--dsn', required=True, help='libpq connection string of the templates database')
+    arg_parser.add_argument('--work-dir', default='/tmp/templatecrawler', help='Where repositories are cloned to')
+    arg_parser.add_argument('--batch-size', type=int, default=8)
+    arg_parser.add_argument('--processes', type=int, default=4)
+    arg_parser.add_argument('--max-batches', type=int, default=None, help='Stop after n batches or an empty queue')
+    arg_parser.add_argument('--lease', type=int, default=3600, help='Seconds until a claimed repository is released')
+    arg_parser.add_argument('--bloom-filter', action='store_true',
+                            help='Keep discarded templates in a Bloom filter, reloaded when the table changed')
+    arg_parser.add_argument('--digest-cache', default=None, help='File to keep the digests of known templates in')
+    arg_parser.add_argument('--metrics-dir', default=None, help='Directory for a metrics JSON file per repository')
+    arg_parser.add_argument('--metrics-port', type=int, default=None,
+                            help='Expose the metrics of the pool for Prometheus on this port')
+    arg_parser.add_argument('--profile-dir', default=None,
+                            help='Profile every stage, a directory of .pstats files per repository in here')
+    arg_parser.add_argument('--slow-statements', type=int, default=0,
+                            help='Report the n slowest statements of the parser per repository')
+    args = arg_parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    pool = WorkerPool(args.dsn, args.work_dir, batch_size=args.batch_size, processes=args.processes,
+                      lease=args.lease, bloom_filter=args.bloom_filter, digest_cache=args.digest_cache,
+                      metrics_dir=args.metrics_dir, profile_dir=args.profile_dir,
+                      slow_statements=args.slow_statements)
+    if args.metrics_port is not None:
+        metrics.serve(args.metrics_port, registry=pool.metrics)
+    pool.run(max_batches=args.max_batches)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+"""
+The implementations the optimized formalizer, keyword matcher and template filter replaced, kept as they were to
+check the new ones against. Only the print of formalize() is left out.
+"""
+from typing import List
+import random
+import re
+import pandas as pd
+
+from templatecrawler.templatefilter import Reason, min_length, max_placeholders
+from templatecrawler.tokentypes import TokenType
+
+
+def formalize(data: pd.DataFrame, possible_types: List[TokenType]):
+    nan_rows = data[data.iloc[:, 0].isnull()]
+    data = data.drop(nan_rows.index)
+
+    data['preformat'] = data.iloc[:, 0].apply(_parse_string)
+    data['formatter_count'] = data['preformat'].apply(_count_formatters)
+    data['param_count'] = data.iloc[:, 1].apply(len)
+
+    data = data.apply(_cut_longer, axis=1)
+    mask = data.apply(lambda row: row['param_count'] == row['formatter_count'], axis=1)
+    data = data[mask]
+
+    output = {}
+    for i, row in data.iterrows():
+        try:
+            tmp = _match_tokens(row['preformat'], params=row['arguments'], tokens=possible_types)
+            output[i] = tmp
+        except (TypeError, ValueError) as e:
+            pass
+    return output
+
+
+def _cut_longer(row: pd.Series):
+    difference = row['param_count'] > row['formatter_count']
+    if 0 < difference < row['param_count']:
+        row['arguments'] = row['arguments'][:-difference]
+    return row
+
+
+def match_keywords(param: str, tokens: List[TokenType]) -> List[TokenType]:
+    """ The keyword scan of _match_tokens """
+    matches = []
+    param_low = param.lower()
+    for token in tokens:
+        for feature in token.keywords:
+            if param_low.find(feature) >= 0:
+                matches.append(token)
+                break
+    return matches
+
+
+def _match_tokens(inp: List, params: List[str], tokens: List[TokenType]):
+    offsets = []
+    for i, token in enumerate(inp):
+        if token == '{}':
+            offsets.append(i)
+
+    possible_tokens = {}
+    for i, param in enumerate(params):
+        possible_tokens[param] = match_keywords(param, tokens)
+
+    for i, param in enumerate(params):
+        if possible_tokens[param]:
+            token = random.choice(possible_tokens[param])
+            inp[offsets[i]] = f'{{{token.name}}}'
+
+    return ''.join(inp)
+
+
+def _count_formatters(inp: List[str]) -> int:
+    return inp.count('{}')
+
+
+def _parse_string(inp: str) -> List[str]:
+    output = []
+    current_tokens = ""
+    pos = 0
+    for i in range(len(inp)):
+        if pos >= len(inp):
+            break
+        c = inp[pos]
+        if c == '{':
+            if _peek(inp[pos + 1:], '}') is True:
+                if len(current_tokens) > 0:
+                    output.append(current_tokens)
+                output.append('{}')
+                pos += 2   # + 1 for normal movement and +1 for the brackets
+                current_tokens = ""
+            else:
+                offset = _read_until(inp[pos + 1:], '}')
+                if offset > 0:
+                    current_tokens += '{{' + inp[pos + 1:pos + 1 + offset] + '}}'
+                    pos += offset + 2  # for the '{{' + '}}' + 1 by default
+
+        else:
+            current_tokens += c
+            pos += 1
+    if len(current_tokens) > 0:
+        output.append(current_tokens)
+    return output
+
+
+def _peek(inp: str, end: str) -> bool:
+    if len(inp) == 0:
+        return False
+    if inp[0] == end:
+        return True
+
+
+def _read_until(inp: str, end: str) -> int:
+    for i, c in enumerate(inp):
+        if c == end:
+            return i
+    return -1
+
+
+re_char = re.compile(r'^[^a-wyzA-WYZ]+$')
+re_keyword_beginnings = re.compile(r'^\s*(static|#include|#define|#if|#endif)')
+re_comment = re.compile(r'^\s*(//|\*)')
+
+
+def filter_reasons(data: pd.Series) -> pd.Series:
+    """ The rules of find_valid, one pandas pass per rule, combined into Reason codes """
+    reason = (data.apply(len) < min_length) * int(Reason.SHORT)
+    reason |= data.str.match(re_char) * int(Reason.NO_LETTERS)
+    reason |= data.str.match(re_keyword_beginnings) * int(Reason.KEYWORD)
+    reason |= data.str.match(re_comment) * int(Reason.COMMENT)
+    reason |= (data.str.count('{}') > max_placeholders) * int(Reason.PLACEHOLDERS)
+    return reason
@@ -0,0 +1,68 @@
+import os
+from pathlib import Path
+
+import pytest
+
+root = Path(__file__).parent.parent
+
+
+@pytest.fixture(scope='session')
+def database_dsn():
+    """ A fresh database with the schema and all migrations, created through TEMPLATECRAWLER_TEST_DSN and dropped
+    afterwards. The DSN is a libpq key/value string of a user who may create databases and roles.
+    """
+    dsn = os.environ.get('TEMPLATECRAWLER_TEST_DSN')
+    if not dsn:
+        pytest.skip('Set TEMPLATECRAWLER_TEST_DSN to run against PostgreSQL')
+    psycopg2 = pytest.importorskip('psycopg2')
+    name = f'templatecrawler_test_{os.getpid()}'
+
+    admin = psycopg2.connect(dsn)
+    admin.autocommit = True
+    cur = admin.cursor()
+    cur.execute(f'DROP DATABASE IF EXISTS {name}')
+    cur.execute(f'CREATE DATABASE {name}')
+    cur.execute("""DO $$ BEGIN CREATE ROLE tassadarius; EXCEPTION WHEN duplicate_object THEN NULL; END $$""")
+
+    test_dsn = f'{dsn} dbname={name}'
+    conn = psycopg2.connect(test_dsn)
+    with conn.cursor() as schema_cur:
+        schema_cur.execute((root / 'postgres' / 'postgres_db.sql').read_text())
+        for migration in sorted((root / 'postgres' / 'migrations').glob('*.sql')):
+            schema_cur.execute(migration.read_text())
+    conn.commit()
+    conn.close()
+
+    yield test_dsn
+
+    cur.execute(f'DROP DATABASE IF EXISTS {name}')
+    admin.close()
+
+
+@pytest.fixture
+def conn(database_dsn):
+    """ Connection to the test database, all tables are emptied afterwards """
+    import psycopg2
+    conn = psycopg2.connect(database_dsn)
+    yield conn
+    conn.rollback()
+    with conn.cursor() as cur:
+        cur.execute("""TRUNCATE templates, discarded_templates, repositories, discarded_repositories, search_shards,
+                       cursor RESTART IDENTITY""")
+    conn.commit()
+    conn.close()
+
+
+@pytest.fixture(scope='session')
+def parsed_samples():
+    """ The statements in benchmarks/samples/ parsed into templates and arguments, like the pipeline does it """
+    import pandas as pd
+    from templatecrawler.logparser.java import JavaParser
+    from templatecrawler.logparser.c import CParser
+
+    def load(name):
+        return pd.Series((root / 'benchmarks' / 'samples' / name).read_text(encoding='utf-8').splitlines())
+
+    parsed = pd.concat([JavaParser('slf4j').run(load('java_statements.txt')),
+                        CParser('unknown').run(load('c_statements.txt'))], ignore_index=True)
+    return parsed[['parsed_template', 'arguments']]
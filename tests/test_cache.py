@@ -0,0 +1,84 @@
+import time
+from types import SimpleNamespace
+
+from templatecrawler.crawlerengine.cache import ResponseCache, TreeCache
+from templatecrawler.crawlerengine.calls import GitHubCrawlerCalls
+
+entries = [{'type': 'blob', 'name': 'Main.java', 'oid': 'a94a8fe5ccb19ba61c4c0873d391e987982fbbd3'},
+           {'type': 'tree', 'name': 'src', 'oid': 'de9f2c7fd25e1b3afad3e85a0bd17d9b100db4b3'}]
+
+
+def _used_at(cache: TreeCache, oid: bytes) -> float:
+    return cache._db.execute('SELECT used_at FROM trees WHERE oid = ?', [oid]).fetchone()[0]
+
+
+def test_tree_round_trip(tmp_path):
+    cache = TreeCache(tmp_path / 'trees.sqlite')
+    assert cache.get(b'\x01') is None
+    cache.put(b'\x01', entries)
+    assert cache.get(b'\x01') == entries
+    assert (cache.hits, cache.misses) == (1, 1)
+    cache.close()
+    reopened = TreeCache(tmp_path / 'trees.sqlite')
+    assert reopened.get(b'\x01') == entries
+    reopened.close()
+
+
+def test_recent_hits_are_reads_only(tmp_path):
+    cache = TreeCache(tmp_path / 'trees.sqlite')
+    cache.put(b'\x01', entries)
+    stored = _used_at(cache, b'\x01')
+    cache.get(b'\x01')
+    assert _used_at(cache, b'\x01') == stored
+    cache.touch_after = 0
+    time.sleep(0.01)
+    cache.get(b'\x01')
+    assert _used_at(cache, b'\x01') > stored
+    cache.close()
+
+
+def test_least_recently_used_are_evicted(tmp_path):
+    cache = TreeCache(tmp_path / 'trees.sqlite', touch_after=0)
+    cache.put(b'\x01', entries)
+    size = cache._size
+    cache.max_bytes = int(size * 2.5)
+    cache.put(b'\x02', entries)
+    time.sleep(0.01)
+    cache.get(b'\x01')
+    cache.put(b'\x03', entries)
+    assert cache.get(b'\x02') is None
+    assert cache.get(b'\x01') == entries and cache.get(b'\x03') == entries
+    cache.close()
+
+
+def test_response_ttl(tmp_path):
+    cache = ResponseCache(tmp_path / 'responses.sqlite', ttl={'repository': 60})
+    cache.put('repository', {'owner': 'o', 'name': 'n'}, {'language': 'Java'}, validator='"etag"')
+    entry = cache.get('repository', {'name': 'n', 'owner': 'o'})
+    assert entry.value == {'language': 'Java'} and entry.validator == '"etag"'
+    assert cache.fresh('repository', entry) and not cache.fresh('root_tree', entry._replace(stored_at=0))
+    cache.close()
+
+
+def test_refetched_root_tree_keeps_the_etag(tmp_path):
+    old, new, newer = 'aa' * 20, 'bb' * 20, 'cc' * 20
+    head = {'oid': new, 'fetched': new}
+    cache = ResponseCache(tmp_path / 'responses.sqlite', ttl={'root_tree': 0})
+    calls = GitHubCrawlerCalls(None, owner='o', repository='n', use_session=False, cache=cache)
+    calls.get_default_branch = lambda: 'main'
+    calls._fetch_root_tree = lambda: (head['fetched'], entries)
+    calls._communicator = SimpleNamespace(get=lambda path, header: SimpleNamespace(
+        status_code=200, text=head['oid'], headers={'ETag': f'"{head["oid"]}"'}))
+
+    variables = {'owner': 'o', 'repository': 'n'}
+    cache.put('root_tree', variables, {'oid': old, 'entries': []}, validator='"old"')
+    assert calls.get_root_tree().oid == new
+    entry = cache.get('root_tree', variables)
+    assert entry.value['oid'] == new and entry.validator == f'"{new}"'
+
+    # Pushed to between the lookup and the fetch, the ETag belongs to an older commit than the tree
+    head['oid'], head['fetched'] = old, newer
+    calls.get_root_tree()
+    entry = cache.get('root_tree', variables)
+    assert entry.value['oid'] == newer and entry.validator is None
+    cache.close()
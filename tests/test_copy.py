@@ -0,0 +1,84 @@
+import math
+
+import pytest
+
+from templatecrawler.database import _CopyStream, _copy_value, copy_rows
+
+
+def test_plain_values():
+    assert _copy_value('text') == 'text'
+    assert _copy_value(42) == '42'
+    assert _copy_value(True) == 'True'
+
+
+def test_null():
+    assert _copy_value(None) == '\\N'
+    assert _copy_value(math.nan) == '\\N'
+
+
+def test_special_characters_are_escaped():
+    assert _copy_value('a\tb') == 'a\\tb'
+    assert _copy_value('a\nb') == 'a\\nb'
+    assert _copy_value('a\rb') == 'a\\rb'
+    assert _copy_value('a\\b') == 'a\\\\b'
+
+
+def test_literal_backslash_n_is_not_null():
+    assert _copy_value('\\N') == '\\\\N'
+
+
+def test_lists():
+    assert _copy_value(['a', 'b']) == '{"a","b"}'
+    assert _copy_value([]) == '{}'
+    assert _copy_value(['a', None]) == '{"a",NULL}'
+    assert _copy_value(['NULL']) == '{"NULL"}'
+    # Quotes and backslashes are escaped for the array and then once more for COPY
+    assert _copy_value(['say "hi"']) == '{"say \\\\"hi\\\\""}'
+    assert _copy_value(['a\\b']) == '{"a\\\\\\\\b"}'
+    assert _copy_value(['a\tb', 'c\nd']) == '{"a\\tb","c\\nd"}'
+
+
+def test_nested_lists():
+    assert _copy_value([['a', 'b'], ['c', None]]) == '{{"a","b"},{"c",NULL}}'
+    assert _copy_value((('a',),)) == '{{"a"}}'
+
+
+def test_stream_rows():
+    stream = _CopyStream([('a', 1, None), ('b\tc', 2, ['x'])])
+    assert stream.read() == 'a\t1\t\\N\nb\\tc\t2\t{"x"}\n'
+    assert stream.read() == ''
+
+
+@pytest.mark.parametrize('size', [1, 3, 7, 8192])
+def test_stream_reads_in_blocks(size):
+    rows = [(f'row {i}', ['a\\b', 'c"d'], 'x\ny') for i in range(50)]
+    expected = _CopyStream(rows).read()
+    stream = _CopyStream(rows)
+    blocks = []
+    while True:
+        block = stream.read(size)
+        if not block:
+            break
+        assert len(block) <= size
+        blocks.append(block)
+    assert ''.join(blocks) == expected
+
+
+@pytest.fixture
+def copy_table(conn):
+    with conn.cursor() as cur:
+        cur.execute("""CREATE TEMP TABLE copy_test (id integer PRIMARY KEY, text text, list text[], grid text[])""")
+    conn.commit()
+    return 'copy_test'
+
+
+def test_round_trip(conn, copy_table):
+    rows = [(1, 'tab\there', ['a', None, 'NULL'], [['a', 'b'], ['c', 'd']]),
+            (2, 'line\nbreak\r\n', ['say "hi"', 'back\\slash'], None),
+            (3, '\\N', [], [['\\N', '{}']]),
+            (4, None, ['', ','], None)]
+    assert copy_rows(conn, 'copy_test', ['id', 'text', 'list', 'grid'], rows) == 4
+    assert copy_rows(conn, 'copy_test', ['id', 'text', 'list', 'grid'], rows[:1]) == 0      # Conflicts are skipped
+    cur = conn.cursor()
+    cur.execute("""SELECT id, text, list, grid FROM copy_test ORDER BY id""")
+    assert cur.fetchall() == rows
@@ -0,0 +1,94 @@
+from concurrent.futures import Executor, Future
+from concurrent.futures.process import BrokenProcessPool
+import pandas as pd
+
+from templatecrawler import database, metrics
+from templatecrawler.dedup import TemplateDeduplicator
+from templatecrawler.worker import WorkerPool
+
+
+def _repositories(conn, count):
+    rows = [(f'repo{i}', 'owner', f'https://github.com/owner/repo{i}', 1, False, 600000, '', None, ['Java'])
+            for i in range(count)]
+    database.copy_rows(conn, 'repositories', database.repository_columns, rows)
+    with conn.cursor() as cur:
+        cur.execute("""SELECT repo_id FROM repositories ORDER BY repo_id""")
+        return [x for x, in cur.fetchall()]
+
+
+def _templates(repo_id, *pairs):
+    return pd.DataFrame({'template': [t for t, _ in pairs], 'parsed_template': [p for _, p in pairs],
+                         'arguments': [['x'] for _ in pairs], 'raw': ['raw'] * len(pairs), 'repo_id': repo_id})
+
+
+def _discard(conn, template, parsed_template):
+    with conn.cursor() as cur:
+        cur.execute("""INSERT INTO discarded_templates (template, parsed_template) VALUES (%s, %s)""",
+                    [template, parsed_template])
+    conn.commit()
+
+
+def test_write_templates_returns_the_rows_sent(conn):
+    repo_id, = _repositories(conn, 1)
+    _discard(conn, 'discarded {}', 'discarded %s')
+    data = _templates(repo_id, ('kept {}', 'kept %s'), ('', 'empty template %s'), ('discarded {}', 'discarded %s'))
+    for method in ('copy', 'values'):
+        written = database.write_templates(conn, data, method=method)
+        assert list(written['template']) == ['kept {}']
+
+
+def test_deduplicator_only_learns_written_templates(conn):
+    repo_id, = _repositories(conn, 1)
+    _discard(conn, 'discarded {}', 'discarded %s')
+    deduplicator = TemplateDeduplicator()
+    data = _templates(repo_id, ('kept {}', 'kept %s'), ('discarded {}', 'discarded %s'))
+    deduplicator.add(database.write_templates(conn, data))
+    assert list(deduplicator.drop_duplicates(data)['template']) == ['discarded {}']
+
+
+def test_finish_only_owned_repositories(conn):
+    first, second = _repositories(conn, 2)
+    claimed = database.claim_repositories(conn, 2, worker='a')
+    assert sorted(claimed['repo_id']) == [first, second]
+
+    # The lease of <a> on <second> expired and <b> took it over
+    with conn.cursor() as cur:
+        cur.execute("""UPDATE repositories SET locked_by = 'b' WHERE repo_id = %s""", [second])
+    conn.commit()
+
+    assert database.owned_repositories(conn, [first, second], worker='a') == [first]
+    assert database.finish_repositories(conn, [(first, True, 'log4j'), (second, True, 'log4j')], worker='a') == 1
+    with conn.cursor() as cur:
+        cur.execute("""SELECT repo_id, processed, locked, locked_by FROM repositories ORDER BY repo_id""")
+        assert cur.fetchall() == [(first, True, False, None), (second, False, True, 'b')]
+
+
+class _Executor(Executor):
+    """ Runs process_repository() of the repositories in <results> right away, the others raise """
+
+    def __init__(self, results):
+        self.results = results
+
+    def submit(self, fn, repo, *args, **kwargs):
+        future = Future()
+        if repo['url'] in self.results:
+            future.set_result(self.results[repo['url']])
+        else:
+            future.set_exception(BrokenProcessPool('A process in the process pool was terminated abruptly'))
+        return future
+
+
+def test_batch_survives_a_failing_repository(conn, database_dsn, tmp_path):
+    first, second = _repositories(conn, 2)
+    templates = _templates(first, ('kept {}', 'kept %s'))
+    executor = _Executor({'https://github.com/owner/repo0': (first, True, 'log4j', templates, metrics.Registry())})
+    pool = WorkerPool(database_dsn, tmp_path, batch_size=2)
+
+    assert pool.run_batch(executor) == 2
+    assert pool._broken
+    assert pool.metrics.value('worker_errors_total', error='BrokenProcessPool') == 1
+    with conn.cursor() as cur:
+        cur.execute("""SELECT template, repo_id FROM templates""")
+        assert cur.fetchall() == [('kept {}', first)]
+        cur.execute("""SELECT repo_id, processed, successfully_processed, locked FROM repositories ORDER BY repo_id""")
+        assert cur.fetchall() == [(first, True, True, False), (second, True, False, False)]
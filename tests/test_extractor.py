@@ -0,0 +1,107 @@
+import pandas as pd
+
+from templatecrawler.budget import Budget
+from templatecrawler.extractor import LogExtractor
+from templatecrawler.logparser.java import JavaParser
+
+source = ('class Example {\n'
+          '    void run() {\n'
+          '        log.info("Started {}", name);\n'
+          '        // A comment with a stray " quote\n'
+          '        log.warn("Stopped after {} ms", time);\n'
+          '    }\n'
+          '}\n')
+
+
+def _events(tmp_path, content: bytes):
+    repository = tmp_path / 'repository'
+    repository.mkdir()
+    (repository / 'Example.java').write_bytes(content)
+    return content, list(LogExtractor('java', 'slf4j', str(repository)).iter_events())
+
+
+def _check_offsets(content: bytes, events):
+    for event in events:
+        start = content[event.byte_offset:].decode()
+        assert start.replace('\r\n', '\n').replace('\r', '\n').startswith(event.raw)
+
+
+def test_lf(tmp_path):
+    content, events = _events(tmp_path, source.encode())
+    assert [(x.raw, x.line) for x in events] == [('log.info("Started {}", name)', 3),
+                                                 ('log.warn("Stopped after {} ms", time)', 5)]
+    _check_offsets(content, events)
+
+
+def test_crlf_offsets_point_into_the_file(tmp_path):
+    content, events = _events(tmp_path, source.replace('\n', '\r\n').encode())
+    assert [x.line for x in events] == [3, 5]
+    assert all('\r' not in x.raw for x in events)
+    _check_offsets(content, events)
+
+
+def test_mixed_line_endings(tmp_path):
+    mixed = source.replace('\n', '\r\n', 2).replace('quote\n', 'quote\r')
+    content, events = _events(tmp_path, mixed.encode())
+    assert [x.line for x in events] == [3, 5]
+    _check_offsets(content, events)
+
+
+def test_statement_spanning_lines_is_normalized(tmp_path):
+    content, events = _events(tmp_path, source.replace('name);', 'name\r\n            );').encode())
+    assert events[0].raw == 'log.info("Started {}", name\n            )'
+
+
+def _statements(tmp_path, body: str, budget: Budget = None):
+    repository = tmp_path / 'repository'
+    repository.mkdir()
+    (repository / 'Example.java').write_text(f'class Example {{\n    void run() {{\n{body}\n    }}\n}}\n')
+    extractor = LogExtractor('java', 'slf4j', str(repository), budget=budget)
+    return [x.raw for x in extractor.iter_events()], extractor
+
+
+def test_semicolon_in_string(tmp_path):
+    raw, _ = _statements(tmp_path, '        log.info("Done; took {} ms", time);')
+    assert raw == ['log.info("Done; took {} ms", time)']
+
+
+def test_semicolon_in_char_literal(tmp_path):
+    raw, _ = _statements(tmp_path, "        log.info(\"Split at {}\", ';');")
+    assert raw == ["log.info(\"Split at {}\", ';')"]
+
+
+def test_escaped_quotes(tmp_path):
+    raw, _ = _statements(tmp_path, '        log.info("Say \\"hi;\\" to {}", name);\n'
+                                   "        log.info(\"Quote {}\", '\\'');")
+    assert raw == ['log.info("Say \\"hi;\\" to {}", name)', "log.info(\"Quote {}\", '\\'')"]
+
+
+def test_unterminated_quote_in_comment(tmp_path):
+    # The quote only swallows the rest of its line, the statement still ends at its ';'
+    raw, _ = _statements(tmp_path, '        log.info("Loaded {}", // don\'t log the "rows\n'
+                                   '                 count);\n'
+                                   '        log.warn("Next");')
+    assert raw == ['log.info("Loaded {}", // don\'t log the "rows\n                 count)', 'log.warn("Next")']
+
+
+def test_text_block(tmp_path):
+    raw, _ = _statements(tmp_path, '        log.info("""\n'
+                                   '            Loaded {}; "quoted" and \\""" escaped\n'
+                                   '            """, count);')
+    assert raw == ['log.info("""\n            Loaded {}; "quoted" and \\""" escaped\n            """, count)']
+
+
+def test_length_budget_skips_only_the_statement(tmp_path):
+    raw, extractor = _statements(tmp_path, '        log.info("' + 'x' * 200 + '", count);\n'
+                                           '        log.warn("Next");', budget=Budget(length=100))
+    assert raw == ['log.warn("Next")']
+    assert extractor.aborted == {'length': 1}
+
+
+def test_parser_step_budget():
+    nested = 'log.info(String.format("%s", String.format("%s", String.format("%s", x))))'
+    parser = JavaParser('slf4j', budget=Budget(steps=50))
+    result = parser.run(pd.Series([nested, 'log.info("Loaded {} rows", count)']))
+    assert result['parsed_template'].tolist() == ['Loaded {} rows']
+    assert parser.aborted == {'steps': 1}
+    assert JavaParser('slf4j').run(pd.Series([nested]))['parsed_template'].tolist() == ['{}{}{}']
@@ -0,0 +1,78 @@
+import random
+
+import pytest
+
+from templatecrawler.formalizer import formalize, _parse_string
+from templatecrawler.tokentypes import KeywordMatcher, tokens, path_token, time_token, user_token
+from tests import baseline
+
+edge_cases = ['', '{}', '{}{}', 'Value {} of {', '{', 'unclosed { brace', '}{}', '{ {}', '{{}}', '{name} is {}',
+              'Empty {} and named {id} and {}']
+
+
+def _random_templates(count: int):
+    rng = random.Random(0)
+    return [''.join(rng.choice('ab {}') for _ in range(rng.randrange(12))) for _ in range(count)]
+
+
+def test_parse_string_matches_baseline(parsed_samples):
+    for template in list(parsed_samples['parsed_template']) + edge_cases + _random_templates(5000):
+        assert _parse_string(template) == baseline._parse_string(template), template
+
+
+def test_unbalanced_brace_ends_the_template():
+    assert _parse_string('Value {} of {') == ['Value ', '{}', ' of ']
+    assert _parse_string('Value {} of { and more') == ['Value ', '{}', ' of ']
+
+
+def test_empty_placeholder():
+    assert _parse_string('{}') == ['{}']
+    assert _parse_string('Took {}{} ms') == ['Took ', '{}', '{}', ' ms']
+    assert _parse_string('') == []
+
+
+def test_keyword_matcher_matches_baseline(parsed_samples):
+    matcher = KeywordMatcher(tokens)
+    names = {x for arguments in parsed_samples['arguments'] for x in arguments}
+    names |= {'timestamp', 'userName', 'ipAddress', 'fileSize', 'NUM_ENTRIES', ''}
+    for name in names:
+        assert list(matcher.match(name)) == baseline.match_keywords(name, tokens), name
+
+
+def test_rank_prefers_the_most_specific_keyword():
+    matcher = KeywordMatcher(tokens)
+    assert matcher.rank('fileSize')[0] is path_token        # 'file' is only a path keyword, 'size' is shared
+    assert matcher.rank('userName')[0] is user_token
+    assert matcher.rank('timestamp')[0] is time_token       # Shared with DatePlaceholder, the given order decides
+    assert set(matcher.rank('fileSize')) == set(matcher.match('fileSize'))
+
+
+def test_random_mode_matches_baseline(parsed_samples):
+    random.seed(7)
+    expected = baseline.formalize(parsed_samples.copy(), tokens)
+    random.seed(7)
+    assert formalize(parsed_samples, tokens, mode='random') == expected
+
+
+def test_ranked_mode_picks_a_baseline_candidate(parsed_samples):
+    ranked = formalize(parsed_samples, tokens)
+    assert ranked.keys() == baseline.formalize(parsed_samples.copy(), tokens).keys()
+    matcher = KeywordMatcher(tokens)
+    for i, template in ranked.items():
+        arguments = parsed_samples.loc[i, 'arguments']
+        chosen = [x for x in (matcher.rank(a) for a in arguments) if x]
+        assert all(f'{{{x[0].name}}}' in template for x in chosen), template
+
+
+@pytest.mark.parametrize('mode,seed', [('ranked', None), ('random', 3)])
+def test_processes_give_the_same_result(parsed_samples, mode, seed):
+    expected = formalize(parsed_samples, tokens, mode=mode, seed=seed)
+    assert formalize(parsed_samples, tokens, processes=3, mode=mode, seed=seed) == expected
+    # Fewer rows than processes are matched in this process
+    few = parsed_samples.head(2)
+    assert formalize(few, tokens, processes=3, mode=mode, seed=seed) == formalize(few, tokens, mode=mode, seed=seed)
+
+
+def test_unknown_mode():
+    with pytest.raises(ValueError):
+        formalize(baseline.pd.DataFrame({'t': ['{}'], 'a': [['x']]}), tokens, mode='best')
@@ -0,0 +1,46 @@
+import pickle
+
+from templatecrawler.crawlerengine.gittypes import GitBlob, GitObject, GitTree
+
+oid = 'a94a8fe5ccb19ba61c4c0873d391e987982fbbd3'
+other_oid = 'de9f2c7fd25e1b3afad3e85a0bd17d9b100db4b3'
+
+
+def test_equal_by_oid_and_type():
+    assert GitBlob('a.java', oid, 'blob', 10, 'x') == GitBlob('b.java', oid, 'blob', 20, None)
+    assert GitObject('a.java', oid, 'blob') == GitBlob('a.java', oid, 'blob', 10, 'x')
+    assert GitObject('src', oid, 'tree') != GitObject('src', oid, 'blob')
+    assert GitObject('src', oid, 'tree') != GitObject('src', other_oid, 'tree')
+    assert GitObject('src', oid, 'tree') != oid
+
+
+def test_hex_and_binary_oid():
+    first, second = GitObject('src', oid, 'tree'), GitObject('src', bytes.fromhex(oid), 'tree')
+    assert first == second and hash(first) == hash(second)
+    assert second.oid == oid and first.oid_bytes == bytes.fromhex(oid)
+
+
+def test_without_oid_only_equal_to_itself():
+    first, second = GitObject('src', None, 'tree'), GitObject('src', None, 'tree')
+    assert first == first and first != second
+    assert len({first, second}) == 2
+
+
+def test_usable_in_sets_and_as_keys():
+    blobs = {GitBlob('a.java', oid, 'blob', 10, 'x'), GitBlob('b.java', oid, 'blob', 10, 'x'),
+             GitBlob('c.java', other_oid, 'blob', 5, 'y')}
+    assert len(blobs) == 2
+    cache = {GitTree('src', oid, 'tree', []): 'entries'}
+    assert cache[GitTree('other', oid, 'tree', None)] == 'entries'
+
+
+def test_blobs_compare_by_size():
+    small, large = GitBlob('a', oid, 'blob', 1, None), GitBlob('b', other_oid, 'blob', 2, None)
+    assert small < large and max([small, large]) is large
+
+
+def test_content_and_pickle():
+    blob = GitBlob('a.java', oid, 'blob', 3, 'ä\udcff')
+    assert blob.content == 'ä\udcff'
+    copy = pickle.loads(pickle.dumps(blob))
+    assert copy == blob and copy.content == blob.content and copy.name == 'a.java'
@@ -0,0 +1,57 @@
+from concurrent.futures import ThreadPoolExecutor
+from threading import Barrier
+from urllib.request import urlopen
+
+from templatecrawler import metrics
+
+
+def test_use_restores_the_previous_registry():
+    outer, inner = metrics.Registry(), metrics.Registry()
+    with metrics.use(outer):
+        metrics.increment('events_total')
+        with metrics.use(inner):
+            metrics.increment('events_total', 2)
+        metrics.increment('events_total')
+    assert outer.value('events_total') == 2
+    assert inner.value('events_total') == 2
+
+
+def test_threads_report_into_their_own_registry():
+    barrier = Barrier(2)
+
+    def run(count: int) -> metrics.Registry:
+        registry = metrics.Registry()
+        with metrics.use(registry):
+            barrier.wait()      # Both threads are inside use() at the same time
+            for _ in range(count):
+                metrics.increment('events_total', stage='parse')
+            barrier.wait()
+        return registry
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        first, second = executor.map(run, [3, 5])
+    assert first.value('events_total', stage='parse') == 3
+    assert second.value('events_total', stage='parse') == 5
+
+
+def test_merge():
+    registry, other = metrics.Registry(), metrics.Registry()
+    registry.increment('events_total', 1)
+    other.increment('events_total', 2)
+    other.observe('stage_seconds', 0.2, stage='parse')
+    registry.merge(other)
+    assert registry.value('events_total') == 3
+    assert registry.to_dict()['histograms'][0]['count'] == 1
+
+
+def test_serve_exposes_the_callers_registry():
+    registry = metrics.Registry()
+    with metrics.use(registry):
+        server = metrics.serve(0, address='127.0.0.1')
+    try:
+        registry.increment('events_total', 2)
+        with urlopen(f'http://127.0.0.1:{server.server_port}/metrics') as response:
+            assert 'events_total 2' in response.read().decode('utf-8')
+    finally:
+        server.shutdown()
+        server.server_close()
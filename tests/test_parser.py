@@ -0,0 +1,17 @@
+import pytest
+
+from templatecrawler.extractor import LogExtractor
+from templatecrawler.parser import LogParser
+
+
+def test_parse_list():
+    result = LogParser('java').run(['log.info("Loaded {} rows", count)'], framework='slf4j')
+    assert result['parsed_template'].tolist() == ['Loaded {} rows']
+
+
+@pytest.mark.parametrize('language', ['python', 'csharp'])
+def test_unsupported_language(language, tmp_path):
+    with pytest.raises(NotImplementedError, match=language):
+        LogParser(language).run(['print("x")'], framework='unknown')
+    with pytest.raises(NotImplementedError, match=language):
+        LogExtractor(language, 'unknown', str(tmp_path))
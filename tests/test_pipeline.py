@@ -0,0 +1,32 @@
+from templatecrawler.pipeline import Pipeline
+from tests.conftest import root
+
+
+def _repository(tmp_path, copies: int = 3):
+    statements = (root / 'benchmarks' / 'samples' / 'java_statements.txt').read_text(encoding='utf-8').splitlines()
+    repository = tmp_path / 'repository'
+    repository.mkdir()
+    for i in range(copies):
+        body = '\n'.join(f'        {x};' for x in statements)
+        (repository / f'Example{i}.java').write_text(f'class Example{i} {{\n    void run() {{\n{body}\n    }}\n}}\n')
+    return repository
+
+
+def test_chunks_give_the_same_templates(tmp_path):
+    repository = _repository(tmp_path)
+    whole = Pipeline(repository, language='java', framework='slf4j').run()
+    chunked = Pipeline(repository, language='java', framework='slf4j', chunksize=7)
+    templates = chunked.run()
+    assert len(whole) > 0
+    assert templates['template'].tolist() == whole['template'].tolist()
+    assert templates.index.tolist() == whole.index.tolist()
+    # The other copies of the file only contain duplicates of the first one
+    assert chunked.stats['deduplicate'] <= chunked.stats['formalize'] // 3
+
+
+def test_nothing_found(tmp_path):
+    repository = tmp_path / 'repository'
+    repository.mkdir()
+    pipeline = Pipeline(repository, language='java', framework='slf4j')
+    assert len(pipeline.run()) == 0
+    assert pipeline.stats['parse'] == 0
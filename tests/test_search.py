@@ -0,0 +1,157 @@
+from datetime import date
+import time
+
+import pytest
+import requests
+
+from templatecrawler import database
+from templatecrawler.crawlerengine.gittypes import GitRepo
+from templatecrawler.crawlerengine.shards import SearchPlanner, Shard, root_shard
+from templatecrawler.crawlerengine.utils import Backoff, RateLimited, rate_limit
+from templatecrawler.search import ShardedSearcher
+
+until = date(2008, 1, 31)
+
+
+def _response(status: int, body: str = '{}', **headers) -> requests.Response:
+    response = requests.Response()
+    response.status_code = status
+    response._content = body.encode()
+    response.headers.update(headers)
+    return response
+
+
+class FakeGitHub:
+    """ Every day since GitHub started has <per_day> repositories, one page each """
+
+    def __init__(self, per_day: int = 300, fail: Exception = None):
+        self.per_day = per_day
+        self.fail = fail
+        self.counts = 0
+
+    def count_repos(self, query: str) -> int:
+        self.counts += 1
+        created = Shard.from_query(query).created
+        return ((created[1] - created[0]).days + 1) * self.per_day
+
+    def search_page(self, query: str, count: int, cursor: str = None):
+        if self.fail is not None:
+            raise self.fail
+        page = int(cursor or 0)
+        repositories = [GitRepo(name=f'{query}-{page}-{i}', owner='owner', url=f'https://github.com/{page}/{i}/{query}',
+                                stars=0, is_fork=False, disk_usage=1024, license='', license_key='',
+                                languages=['Java'], cursor=None) for i in range(2)]
+        return repositories, 2, str(page + 1), page == 0
+
+
+class Searcher(ShardedSearcher):
+
+    def __init__(self, github: FakeGitHub, **kwargs):
+        super().__init__(auth_token=None, language='Java', workers=2, cap=1000, **kwargs)
+        self.github = github
+
+    def _caller(self):
+        return self.github
+
+
+def test_query_round_trip():
+    shard = root_shard('Java', until)
+    assert Shard.from_query(shard.query) == shard
+    for half in shard.split():
+        assert Shard.from_query(half.query, total=3) == Shard(**{**half.__dict__, 'total': 3})
+    with pytest.raises(ValueError):
+        Shard.from_query('language:Java')
+
+
+def test_expand():
+    planner = SearchPlanner(FakeGitHub().count_repos, cap=1000)
+    shard = Shard('Java', created=(date(2008, 1, 1), date(2008, 1, 1)), stars=(5, 5), size=(7, 7))
+    assert planner.expand(shard, 0) == []
+    assert planner.expand(shard, 10) == [Shard(**{**shard.__dict__, 'total': 10})]
+    assert planner.expand(shard, 5000)[0].truncated
+    assert planner.expand(root_shard('Java', until), 5000) == list(root_shard('Java', until).split())
+
+
+def test_rate_limit():
+    assert rate_limit(_response(200)) is None
+    assert rate_limit(_response(403, 'Forbidden')) is None
+    assert rate_limit(_response(403, 'You have exceeded a secondary rate limit')).retry_after == 60
+    assert rate_limit(_response(429, 'Slow down', **{'Retry-After': '30'})).retry_after == 30
+    reset = str(int(time.time()) + 120)
+    primary = rate_limit(_response(403, '', **{'X-RateLimit-Remaining': '0', 'X-RateLimit-Reset': reset}))
+    assert 100 < primary.retry_after <= 122
+    graphql = rate_limit(_response(200, '{"errors": [{"type": "RATE_LIMITED"}]}', **{'Retry-After': '5'}))
+    assert isinstance(graphql, ValueError) and graphql.retry_after == 5
+
+
+def test_backoff_doubles():
+    backoff = Backoff()
+    assert backoff.limited(RateLimited('limited', 10)) == pytest.approx(10, abs=1)
+    assert backoff.limited(RateLimited('limited', 10)) == pytest.approx(20, abs=1)
+    assert not backoff.wait(max_wait=5)
+    backoff.succeeded()
+    assert backoff.limited(RateLimited('limited', 1)) == pytest.approx(20, abs=1)     # Doesn't shorten the wait
+
+
+def _shards(conn):
+    with conn.cursor() as cur:
+        cur.execute("""SELECT query, total, done FROM search_shards ORDER BY query""")
+        rows = cur.fetchall()
+    conn.commit()
+    return rows
+
+
+def _plan(until: date):
+    github = FakeGitHub()
+    return list(SearchPlanner(github.count_repos, cap=1000).plan(root_shard('Java', until))), github.counts
+
+
+def test_plan_is_saved_level_by_level(conn):
+    github = FakeGitHub()
+    searcher = Searcher(github)
+    searcher.plan(conn, until=until)
+    # The root and its 2 halves, then 2 of the 4 quarters are counted. Their 4 halves and the other 2 quarters are left.
+    assert searcher.continue_plan(conn, max_queries=5) == 5
+    assert sum(total is None for _, total, _ in _shards(conn)) == 6
+    while searcher.continue_plan(conn, max_queries=5):
+        pass
+    expected, counts = _plan(until)
+    assert _shards(conn) == sorted((x.query, x.total, False) for x in expected)
+    assert github.counts == counts      # Nothing was counted twice
+
+
+def test_replan_drops_pending_shards(conn):
+    searcher = Searcher(FakeGitHub())
+    searcher.plan(conn, until=until)
+    searcher.continue_plan(conn)
+    searcher.plan(conn, until=date(2008, 2, 29))
+    searcher.continue_plan(conn)
+    expected, _ = _plan(date(2008, 2, 29))
+    assert _shards(conn) == sorted((x.query, x.total, False) for x in expected)
+
+
+def test_replan_keeps_completed_shards(conn):
+    searcher = Searcher(FakeGitHub())
+    searcher.plan(conn, until=date(2007, 10, 2))
+    searcher.run(conn)
+    searcher.plan(conn, until=date(2007, 10, 3))
+    assert [done for _, _, done in _shards(conn)] == [True, False]
+
+
+def test_failed_pages_stay_at_their_checkpoint(conn):
+    searcher = Searcher(FakeGitHub(fail=requests.ConnectionError('reset')))
+    searcher.plan(conn, until=date(2007, 10, 2))
+    assert searcher.run(conn) == 0
+    assert [(cursor, fetched) for _, _, cursor, fetched in database.pending_search_shards(conn, 'Java')] == [(None, 0)]
+    searcher.github.fail = None
+    assert searcher.run(conn) == 2
+    assert database.pending_search_shards(conn, 'Java') == []
+
+
+def test_long_rate_limit_stops_the_run(conn):
+    github = FakeGitHub(fail=RateLimited('limited', 3600))
+    searcher = Searcher(github, max_wait=10)
+    searcher.plan(conn, until=date(2007, 10, 2))
+    assert searcher.run(conn) == 0
+    [(_, _, cursor, fetched)] = database.pending_search_shards(conn, 'Java')
+    assert (cursor, fetched) == (None, 0)
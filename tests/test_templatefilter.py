@@ -0,0 +1,27 @@
+import pandas as pd
+
+from templatecrawler.templatefilter import Reason, check, check_valid, find_valid
+from tests import baseline
+
+edge_cases = ['', '   ', '0x{} 0x{} 0x{} 0x{}', '12345 67890 12345', '// commented out statement', ' * in a comment block',
+              '#include <stdio.h> is here', '  static final int x = {}', 'static', 'x' * 20, 'Short {}',
+              'Too many ' + '{}' * 13, 'Exactly enough ' + '{}' * 12, '// {}{}{}{}{}{}{}{}{}{}{}{}{} and more']
+
+
+def test_reasons_match_the_per_rule_filter(parsed_samples):
+    data = pd.Series(list(parsed_samples['parsed_template']) + edge_cases)
+    assert check_valid(data)['reason'].tolist() == baseline.filter_reasons(data).tolist()
+
+
+def test_check_combines_flags():
+    assert check('// short') == Reason.SHORT | Reason.COMMENT
+    assert check('0x{} 0x{} 0x{} 0x{}') == Reason.NO_LETTERS
+    assert check('Loaded {} templates from {}') == Reason.NONE
+
+
+def test_reject_only_selected_rules():
+    data = ['short', '// a long enough comment', 'A long enough template {}']
+    result = check_valid(data, reject=Reason.COMMENT)
+    assert result['valid'].tolist() == [True, False, True]
+    assert result['reason'].tolist() == [int(Reason.SHORT), int(Reason.COMMENT), 0]
+    assert find_valid(data).tolist() == [False, False, True]